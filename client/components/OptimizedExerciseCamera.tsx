@@ -2,7 +2,7 @@ import React, { useRef, useEffect, useState, useCallback } from 'react';
 import { Button } from '@/components/ui/button';
 
 interface OptimizedExerciseCameraProps {
-  onFrame: (frameData: string) => void;
+  onFrame: (frame: Blob) => void;
   isActive: boolean;
   className?: string;
   width?: number;
@@ -97,10 +97,13 @@ export const OptimizedExerciseCamera: React.FC<OptimizedExerciseCameraProps> = (
     // Draw video frame to canvas
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    // Convert to base64 with compression for performance
+    // Encode to a JPEG blob (sent as raw bytes, no base64) with compression for performance
     try {
-      const frameData = canvas.toDataURL('image/jpeg', 0.7); // 70% quality for performance
-      onFrame(frameData);
+      canvas.toBlob((frame) => {
+        if (frame) {
+          onFrame(frame);
+        }
+      }, 'image/jpeg', 0.7); // 70% quality for performance
     } catch (err) {
       console.error('Frame capture error:', err);
     }
@@ -7,6 +7,7 @@ import { Button } from "@/components/ui/button";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select";
 import { Alert, AlertDescription } from "@/components/ui/alert";
 import { Badge } from "@/components/ui/badge";
+import { decodeFrame, isFrameMessage, replaceFrameUrl } from "@/lib/frameProtocol";
 
 // Optimized interfaces
 interface Exercise {
@@ -64,6 +65,7 @@ export default function OptimizedExerciseGuidance() {
   // Refs
   const timerRef = useRef<number | null>(null);
   const websocketRef = useRef<WebSocket | null>(null);
+  const frameUrlRef = useRef<string | null>(null);
   const videoRef = useRef<HTMLImageElement>(null);
   const frameCountRef = useRef(0);
   const lastFrameTimeRef = useRef(0);
@@ -177,6 +179,7 @@ export default function OptimizedExerciseGuidance() {
     setErrorMessage("");
 
     const ws = new WebSocket(`ws://localhost:8000/ws/exercise/${selectedExercise}`);
+    ws.binaryType = "arraybuffer";
     websocketRef.current = ws;
 
     ws.onopen = () => {
@@ -186,28 +189,29 @@ export default function OptimizedExerciseGuidance() {
 
     ws.onmessage = (event) => {
       try {
-        const data: OptimizedExerciseData = JSON.parse(event.data);
-
-        if (data.type === "frame_data") {
+        // Video frames are binary (header + JPEG), control messages are JSON
+        if (isFrameMessage(event.data)) {
+          const frame = decodeFrame(event.data);
           frameCountRef.current++;
 
           // Batch state updates for better performance
-          setReps(data.reps);
-          setCurrentAngle(data.angle);
-          setExerciseStage(data.stage);
-          setPoseDetected(data.pose_detected);
+          setReps(frame.reps);
+          setCurrentAngle(Math.round(frame.angle));
+          setExerciseStage(frame.stage);
+          setPoseDetected(frame.poseDetected);
 
           // Update posture state
-          const newPostureState = data.posture_state as "good" | "ok" | "bad";
+          const newPostureState = frame.postureState;
           setPostureState(newPostureState);
 
-          // Update camera frame with optimization
-          if (data.frame && frameCountRef.current % 2 === 0) { // Only update every 2nd frame
-            setCameraFrame(`data:image/jpeg;base64,${data.frame}`);
+          // Update camera frame (the server attaches a JPEG to every 2nd frame)
+          if (frame.image) {
+            frameUrlRef.current = replaceFrameUrl(frameUrlRef.current, frame.image);
+            setCameraFrame(frameUrlRef.current);
           }
 
           // Handle completed rep with debouncing
-          if (data.rep_completed) {
+          if (frame.repCompleted) {
             const currentTime = Date.now();
             if (currentTime - lastRepTime > 500) { // 500ms debounce
               setLastRepTime(currentTime);
@@ -219,9 +223,12 @@ export default function OptimizedExerciseGuidance() {
           if (newPostureState === "bad" && frameCountRef.current % 30 === 0) {
             playAudioFeedback("Adjust your posture", 1.0);
           }
-        } else if (data.type === "error") {
-          setErrorMessage(data.message || "Unknown error");
-          setConnectionStatus("error");
+        } else {
+          const data: OptimizedExerciseData = JSON.parse(event.data);
+          if (data.type === "error") {
+            setErrorMessage(data.message || "Unknown error");
+            setConnectionStatus("error");
+          }
         }
       } catch (error) {
         console.error("WebSocket message parsing error:", error);
@@ -314,6 +321,7 @@ export default function OptimizedExerciseGuidance() {
       disconnectWebSocket();
       if (timerRef.current) window.clearInterval(timerRef.current);
       if (performanceIntervalRef.current) window.clearInterval(performanceIntervalRef.current);
+      if (frameUrlRef.current) URL.revokeObjectURL(frameUrlRef.current);
     };
   }, [disconnectWebSocket]);
 
@@ -1,7 +1,45 @@
 import React, { useRef, useEffect, useCallback } from 'react';
+import type { PoseLandmark } from '@/lib/frameProtocol';
+
+// MediaPipe pose skeleton (landmark index pairs)
+const POSE_CONNECTIONS: [number, number][] = [
+  [0, 1], [1, 2], [2, 3], [3, 7], [0, 4], [4, 5], [5, 6], [6, 8], [9, 10],
+  [11, 12], [11, 13], [13, 15], [15, 17], [15, 19], [15, 21], [17, 19],
+  [12, 14], [14, 16], [16, 18], [16, 20], [16, 22], [18, 20],
+  [11, 23], [12, 24], [23, 24], [23, 25], [24, 26], [25, 27], [26, 28],
+  [27, 29], [28, 30], [29, 31], [30, 32], [27, 31], [28, 32]
+];
+const MIN_VISIBILITY = 0.5;
+
+const drawSkeleton = (ctx: CanvasRenderingContext2D, landmarks: PoseLandmark[], width: number, height: number) => {
+  const visible = (landmark: PoseLandmark) => (landmark.visibility ?? 1) >= MIN_VISIBILITY;
+
+  ctx.strokeStyle = '#00FF00';
+  ctx.lineWidth = 2;
+  ctx.beginPath();
+  for (const [a, b] of POSE_CONNECTIONS) {
+    if (visible(landmarks[a]) && visible(landmarks[b])) {
+      ctx.moveTo(landmarks[a].x * width, landmarks[a].y * height);
+      ctx.lineTo(landmarks[b].x * width, landmarks[b].y * height);
+    }
+  }
+  ctx.stroke();
+
+  ctx.fillStyle = '#FF0000';
+  for (const landmark of landmarks) {
+    if (visible(landmark)) {
+      ctx.beginPath();
+      ctx.arc(landmark.x * width, landmark.y * height, 2, 0, 2 * Math.PI);
+      ctx.fill();
+    }
+  }
+};
 
 interface UltraFastVideoFeedProps {
   cameraFrame: string;
+  // Landmarks-only sessions: skeleton drawn client-side over a transparent canvas, to be placed on
+  // top of the client's own (mirrored) video instead of a server-rendered frame
+  landmarks?: PoseLandmark[] | null;
   isActive: boolean;
   poseDetected: boolean;
   exerciseStage: string;
@@ -11,6 +49,7 @@ interface UltraFastVideoFeedProps {
 
 export const UltraFastVideoFeed: React.FC<UltraFastVideoFeedProps> = ({
   cameraFrame,
+  landmarks,
   isActive,
   poseDetected,
   exerciseStage,
@@ -22,18 +61,23 @@ export const UltraFastVideoFeed: React.FC<UltraFastVideoFeedProps> = ({
   
   // Ultra-fast frame rendering using canvas for better performance
   const renderFrame = useCallback(() => {
-    if (!cameraFrame || !canvasRef.current || !imgRef.current) return;
+    if ((!cameraFrame && !landmarks) || !canvasRef.current || !imgRef.current) return;
     
     const canvas = canvasRef.current;
     const ctx = canvas.getContext('2d');
     if (!ctx) return;
     
-    // Set canvas size to match image
+    // Set canvas size to match image (also clears it)
     canvas.width = 320;
     canvas.height = 240;
     
-    // Draw the image
-    ctx.drawImage(imgRef.current, 0, 0, 320, 240);
+    // Draw the image, or the skeleton in landmarks-only mode
+    if (cameraFrame) {
+      ctx.drawImage(imgRef.current, 0, 0, 320, 240);
+    }
+    if (landmarks) {
+      drawSkeleton(ctx, landmarks, canvas.width, canvas.height);
+    }
     
     // Add overlays with minimal rendering
     ctx.font = '12px Arial';
@@ -50,18 +94,22 @@ export const UltraFastVideoFeed: React.FC<UltraFastVideoFeedProps> = ({
     ctx.fillStyle = postureColor;
     ctx.fillText(`${postureState.toUpperCase()} posture`, 10, canvas.height - 10);
     
-  }, [cameraFrame, exerciseStage, currentAngle, postureState]);
+  }, [cameraFrame, landmarks, exerciseStage, currentAngle, postureState]);
   
-  // Update frame when cameraFrame changes
+  // Update frame when cameraFrame changes (landmarks-only mode renders straight away)
   useEffect(() => {
     if (cameraFrame && imgRef.current) {
       imgRef.current.onload = renderFrame;
       imgRef.current.src = cameraFrame;
+    } else if (landmarks) {
+      renderFrame();
     }
-  }, [cameraFrame, renderFrame]);
+  }, [cameraFrame, landmarks, renderFrame]);
+  
+  const landmarksOnly = !cameraFrame && !!landmarks;
   
   return (
-    <div className="relative w-full h-full bg-black rounded-xl overflow-hidden">
+    <div className={`relative w-full h-full rounded-xl overflow-hidden ${landmarksOnly ? '' : 'bg-black'}`}>
       {/* Hidden image for loading */}
       <img
         ref={imgRef}
@@ -70,7 +118,7 @@ export const UltraFastVideoFeed: React.FC<UltraFastVideoFeedProps> = ({
       />
       
       {/* Canvas for ultra-fast rendering */}
-      {cameraFrame ? (
+      {cameraFrame || landmarks ? (
         <canvas
           ref={canvasRef}
           className="w-full h-full object-cover"
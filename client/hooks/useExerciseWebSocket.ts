@@ -1,4 +1,5 @@
 import { useEffect, useRef, useState, useCallback } from 'react';
+import { decodeFrame, encodeClientFrame, isFrameMessage, replaceFrameUrl } from '@/lib/frameProtocol';
 
 interface ExerciseData {
   type: string;
@@ -7,7 +8,7 @@ interface ExerciseData {
   angle: number;
   pose_detected: boolean;
   exercise_type: string;
-  frame?: string;
+  frame?: string; // object URL of the processed JPEG
   timestamp: number;
 }
 
@@ -41,6 +42,9 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectCountRef = useRef(0);
   const messageQueueRef = useRef<string[]>([]);
+  const exerciseTypeRef = useRef('');
+  const frameIdRef = useRef(0);
+  const frameUrlRef = useRef<string | null>(null);
 
   // Performance optimization: throttle frame processing
   const lastFrameTimeRef = useRef(0);
@@ -56,6 +60,7 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
 
     try {
       const ws = new WebSocket(url);
+      ws.binaryType = 'arraybuffer';
       websocketRef.current = ws;
 
       ws.onopen = () => {
@@ -77,6 +82,25 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
 
       ws.onmessage = (event) => {
         try {
+          // Processed frames are binary (header + JPEG), control messages are JSON
+          if (isFrameMessage(event.data)) {
+            const frame = decodeFrame(event.data);
+            if (frame.image) {
+              frameUrlRef.current = replaceFrameUrl(frameUrlRef.current, frame.image);
+            }
+            setExerciseData({
+              type: 'exercise_data',
+              reps: frame.reps,
+              stage: frame.stage,
+              angle: Math.round(frame.angle * 10) / 10,
+              pose_detected: frame.poseDetected,
+              exercise_type: exerciseTypeRef.current,
+              frame: frame.image ? frameUrlRef.current ?? undefined : undefined,
+              timestamp: frame.timestamp * 1000
+            });
+            return;
+          }
+
           const message: WebSocketMessage = JSON.parse(event.data);
           setLastMessage(message);
 
@@ -85,25 +109,13 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
               setAvailableExercises(message.exercises || {});
               break;
             
-            case 'frame_processed':
-              setExerciseData({
-                type: 'exercise_data',
-                reps: message.reps || 0,
-                stage: message.stage || 'detecting',
-                angle: message.angle || 0,
-                pose_detected: message.pose_detected || false,
-                exercise_type: message.exercise_type || '',
-                frame: message.frame,
-                timestamp: message.timestamp || Date.now()
-              });
-              break;
-            
             case 'error':
               setError(message.message || 'Unknown error');
               console.error('WebSocket error:', message.message);
               break;
             
             case 'session_started':
+              exerciseTypeRef.current = message.exercise_type || '';
               console.log('Session started:', message.exercise_type);
               break;
             
@@ -171,20 +183,21 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
     }
   }, []);
 
-  // Optimized frame processing with throttling
-  const processFrame = useCallback((frameData: string, exerciseType: string) => {
+  // Optimized frame processing with throttling. Frames go out as binary messages (header + JPEG)
+  // for the exercise of the current session; they are dropped rather than queued while disconnected.
+  const processFrame = useCallback((frame: Blob) => {
     const now = Date.now();
     if (now - lastFrameTimeRef.current < frameThrottleMs) {
       return; // Skip frame to maintain performance
     }
+    if (websocketRef.current?.readyState !== WebSocket.OPEN) {
+      return;
+    }
     lastFrameTimeRef.current = now;
 
-    sendMessage({
-      type: 'process_frame',
-      frame: frameData,
-      exercise_type: exerciseType
-    });
-  }, [sendMessage]);
+    frameIdRef.current += 1;
+    websocketRef.current.send(encodeClientFrame(frame, frameIdRef.current));
+  }, []);
 
   const startSession = useCallback((exerciseType: string) => {
     sendMessage({
@@ -219,6 +232,9 @@ export const useExerciseWebSocket = (options: UseExerciseWebSocketOptions = {})
       if (websocketRef.current) {
         websocketRef.current.close();
       }
+      if (frameUrlRef.current) {
+        URL.revokeObjectURL(frameUrlRef.current);
+      }
     };
   }, []);
 
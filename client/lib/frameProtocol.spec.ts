@@ -0,0 +1,108 @@
+import { describe, it, expect, vi, afterEach } from "vitest";
+import {
+  decodeFrame,
+  encodeClientFrame,
+  HEADER_SIZE,
+  LANDMARK_COUNT,
+  MSG_CLIENT_FRAME,
+  MSG_FRAME,
+  MSG_LANDMARKS,
+} from "./frameProtocol";
+
+// Messages written by server/frame_protocol.py (the same fixtures are pinned in
+// test_frame_protocol.py), so a layout change on either side fails here
+const SERVER_FRAME_HEX = "01010702020700000000001040fc54d9410c000000bb42ffd84a504547";
+const CLIENT_FRAME_HEX = "010204000005000000000000000000f03f0000000000004a5047";
+const LANDMARKS_HEX =
+  "01030901010403020100006040fc54d941030000003542000000008813c4096400ceff59121027c8009cff2a11c4" +
+  "092c016afffb0f1027900138ffcc0ec409f40106ff9d0d10275802d4fe6e0cc409bc02a2fe3f0b1027200370fe10" +
+  "0ac40984033efee1081027e8030cfeb207c4094c04dafd83061027b004a8fd5405c409140576fd25041027780544" +
+  "fdf602c409dc0512fdc70110274006e0fc9800c409a406aefc68ff102708077cfc39fec4096c074afc0afd1027d0" +
+  "0718fcdbfbc4093408e6fbacfa10279808b4fb7df9c409fc0882fb4ef81027600950fb1ff7c409c4091efbf0f510" +
+  "27280aecfac1f4c4098c0abafa92f31027f00a88fa63f2c409540b56fa34f11027b80b24fa05f0c4091c0cf2f9d6" +
+  "ee1027800cc0f9a7edc409";
+
+const fromHex = (hex: string): ArrayBuffer =>
+  new Uint8Array(hex.match(/../g)!.map((byte) => parseInt(byte, 16))).buffer;
+
+const toHex = (buffer: ArrayBuffer): string =>
+  Array.from(new Uint8Array(buffer), (byte) => byte.toString(16).padStart(2, "0")).join("");
+
+// Landmarks of the Python fixture: landmark i is (i / 100, -i / 200, 0.5 - i / 33, 1 or 0.25)
+const fixtureLandmarks = () =>
+  Array.from({ length: LANDMARK_COUNT }, (_, i) => ({
+    x: i / 100,
+    y: -i / 200,
+    z: 0.5 - i / 33,
+    visibility: i % 2 ? 1 : 0.25,
+  }));
+
+const landmarksMessage = (): ArrayBuffer => fromHex(LANDMARKS_HEX);
+
+describe("frame protocol", () => {
+  afterEach(() => {
+    vi.useRealTimers();
+  });
+
+  it("has the 23-byte header of server/frame_protocol.py", () => {
+    expect(HEADER_SIZE).toBe(23);
+  });
+
+  it("decodes a server frame message", async () => {
+    const frame = decodeFrame(fromHex(SERVER_FRAME_HEX));
+    expect(frame).toMatchObject({
+      type: MSG_FRAME,
+      frameId: 7,
+      timestamp: 1700000000.25,
+      reps: 12,
+      stage: "down",
+      angle: 93.5,
+      postureState: "bad",
+      poseDetected: true,
+      repCompleted: true,
+      landmarks: undefined,
+    });
+    expect(toHex(await frame.image!.arrayBuffer())).toBe("ffd84a504547");
+  });
+
+  it("decodes a landmarks-only message", () => {
+    const frame = decodeFrame(landmarksMessage());
+    expect(frame).toMatchObject({
+      type: MSG_LANDMARKS,
+      frameId: 0x01020304,
+      timestamp: 1700000001.5,
+      reps: 3,
+      stage: "up",
+      angle: 45.25,
+      postureState: "ok",
+      poseDetected: true,
+      repCompleted: false,
+      image: undefined,
+    });
+    expect(frame.landmarks).toHaveLength(LANDMARK_COUNT);
+    frame.landmarks!.forEach((landmark, i) => {
+      const expected = fixtureLandmarks()[i];
+      expect(landmark.x).toBeCloseTo(expected.x, 4);
+      expect(landmark.y).toBeCloseTo(expected.y, 4);
+      expect(landmark.z).toBeCloseTo(expected.z, 4);
+      expect(landmark.visibility).toBeCloseTo(expected.visibility, 4);
+    });
+  });
+
+  it("encodes client frames byte for byte like the server", async () => {
+    vi.useFakeTimers();
+    vi.setSystemTime(1000);
+    const message = encodeClientFrame(new Blob([new Uint8Array([0x4a, 0x50, 0x47])]), 5);
+    const buffer = await message.arrayBuffer();
+    expect(new DataView(buffer).getUint8(1)).toBe(MSG_CLIENT_FRAME);
+    expect(toHex(buffer)).toBe(CLIENT_FRAME_HEX);
+  });
+
+  it("rejects truncated and unknown-version messages", () => {
+    expect(() => decodeFrame(new ArrayBuffer(HEADER_SIZE - 1))).toThrow(/too short/);
+    const wrongVersion = fromHex(SERVER_FRAME_HEX);
+    new Uint8Array(wrongVersion)[0] = 2;
+    expect(() => decodeFrame(wrongVersion)).toThrow(/version/);
+    expect(() => decodeFrame(landmarksMessage().slice(0, HEADER_SIZE + 10))).toThrow(/truncated/);
+  });
+});
@@ -0,0 +1,113 @@
+// Binary WebSocket frame protocol shared with the exercise servers (server/frame_protocol.py).
+// Frames are a fixed little-endian header followed by the raw JPEG bytes; JSON is only used for
+// control messages. Landmarks-only sessions (`?mode=landmarks`) get MSG_LANDMARKS messages instead:
+// the same header plus the 33 pose landmarks quantised to int16, and no image.
+
+export const PROTOCOL_VERSION = 1;
+
+export const MSG_FRAME = 1;
+export const MSG_CLIENT_FRAME = 2;
+export const MSG_LANDMARKS = 3;
+
+const FLAG_POSE_DETECTED = 0x01;
+const FLAG_REP_COMPLETED = 0x02;
+const FLAG_HAS_IMAGE = 0x04;
+const FLAG_HAS_LANDMARKS = 0x08;
+
+export const STAGES = ["detecting", "up", "down", "completed", "no_pose", "active", "rest", "error"] as const;
+export const POSTURES = ["good", "ok", "bad"] as const;
+
+// version, type, flags, stage, posture (uint8) | frame id (uint32) | timestamp (float64) | reps (uint16) | angle (float32)
+export const HEADER_SIZE = 23;
+
+// 33 x (x, y, z, visibility) int16, each multiplied by LANDMARK_SCALE; x / y are normalised to the
+// mirrored (selfie) frame
+export const LANDMARK_COUNT = 33;
+export const LANDMARK_SCALE = 10000;
+const LANDMARKS_SIZE = LANDMARK_COUNT * 4 * 2;
+
+export interface PoseLandmark {
+  x: number;
+  y: number;
+  z: number;
+  visibility?: number;
+}
+
+export interface FrameMessage {
+  type: number;
+  frameId: number;
+  timestamp: number; // seconds since the epoch
+  reps: number;
+  stage: string;
+  angle: number;
+  postureState: "good" | "ok" | "bad";
+  poseDetected: boolean;
+  repCompleted: boolean;
+  image?: Blob; // JPEG
+  landmarks?: PoseLandmark[];
+}
+
+export const isFrameMessage = (data: unknown): data is ArrayBuffer => data instanceof ArrayBuffer;
+
+export function decodeFrame(buffer: ArrayBuffer): FrameMessage {
+  if (buffer.byteLength < HEADER_SIZE) {
+    throw new Error(`Frame message too short (${buffer.byteLength} bytes)`);
+  }
+  const view = new DataView(buffer);
+  const version = view.getUint8(0);
+  if (version !== PROTOCOL_VERSION) {
+    throw new Error(`Unsupported frame protocol version ${version}`);
+  }
+  const flags = view.getUint8(2);
+
+  let offset = HEADER_SIZE;
+  let landmarks: PoseLandmark[] | undefined;
+  if (flags & FLAG_HAS_LANDMARKS) {
+    if (buffer.byteLength < offset + LANDMARKS_SIZE) {
+      throw new Error("Frame message truncated in the landmarks block");
+    }
+    landmarks = [];
+    for (let i = 0; i < LANDMARK_COUNT; i++, offset += 8) {
+      landmarks.push({
+        x: view.getInt16(offset, true) / LANDMARK_SCALE,
+        y: view.getInt16(offset + 2, true) / LANDMARK_SCALE,
+        z: view.getInt16(offset + 4, true) / LANDMARK_SCALE,
+        visibility: view.getInt16(offset + 6, true) / LANDMARK_SCALE,
+      });
+    }
+  }
+
+  return {
+    type: view.getUint8(1),
+    frameId: view.getUint32(5, true),
+    timestamp: view.getFloat64(9, true),
+    reps: view.getUint16(17, true),
+    stage: STAGES[view.getUint8(3)] ?? STAGES[0],
+    angle: view.getFloat32(19, true),
+    postureState: POSTURES[view.getUint8(4)] ?? POSTURES[0],
+    poseDetected: (flags & FLAG_POSE_DETECTED) !== 0,
+    repCompleted: (flags & FLAG_REP_COMPLETED) !== 0,
+    image: flags & FLAG_HAS_IMAGE ? new Blob([buffer.slice(offset)], { type: "image/jpeg" }) : undefined,
+    landmarks,
+  };
+}
+
+// Client -> server frame: header + JPEG blob, sent with WebSocket.send without copying the image
+export function encodeClientFrame(image: Blob, frameId: number): Blob {
+  const header = new ArrayBuffer(HEADER_SIZE);
+  const view = new DataView(header);
+  view.setUint8(0, PROTOCOL_VERSION);
+  view.setUint8(1, MSG_CLIENT_FRAME);
+  view.setUint8(2, FLAG_HAS_IMAGE);
+  view.setUint32(5, frameId >>> 0, true);
+  view.setFloat64(9, Date.now() / 1000, true);
+  return new Blob([header, image]);
+}
+
+// Object URL for a received JPEG, revoking the previously displayed one
+export function replaceFrameUrl(previous: string | null, image: Blob): string {
+  if (previous) {
+    URL.revokeObjectURL(previous);
+  }
+  return URL.createObjectURL(image);
+}
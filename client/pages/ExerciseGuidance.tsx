@@ -9,6 +9,7 @@ import { Alert, AlertDescription } from "@/components/ui/alert";
 import { Badge } from "@/components/ui/badge";
 import { UltraFastVideoFeed } from "@/components/UltraFastVideoFeed";
 import { BicepCurlDetector } from "@/components/BicepCurlDetector";
+import { decodeFrame, isFrameMessage, replaceFrameUrl, type PoseLandmark } from "@/lib/frameProtocol";
 
 // Exercise types available from the backend
 interface Exercise {
@@ -50,6 +51,7 @@ export default function ExerciseGuidance() {
   const [exerciseStage, setExerciseStage] = useState<string>("detecting");
   const [poseDetected, setPoseDetected] = useState(false);
   const [cameraFrame, setCameraFrame] = useState<string>("");
+  const [serverLandmarks, setServerLandmarks] = useState<PoseLandmark[] | null>(null);
   const [frameRate, setFrameRate] = useState(0);
   const [lastRepTime, setLastRepTime] = useState(0);
 
@@ -68,6 +70,7 @@ export default function ExerciseGuidance() {
   const timerRef = useRef<number | null>(null);
   const frameCountRef = useRef(0);
   const websocketRef = useRef<WebSocket | null>(null);
+  const frameUrlRef = useRef<string | null>(null);
   const lastFrameTimeRef = useRef(0);
   const performanceIntervalRef = useRef<number | null>(null);
   const videoRef = useRef<HTMLVideoElement>(null);
@@ -160,7 +163,10 @@ export default function ExerciseGuidance() {
     setErrorMessage("");
 
     try {
-      const ws = new WebSocket(`ws://localhost:8001/ws/exercise/${selectedExercise}`);
+      // Landmarks-only session: the page shows its own camera, so the server skips drawing and
+      // JPEG encoding and only sends rep state + pose landmarks
+      const ws = new WebSocket(`ws://localhost:8001/ws/exercise/${selectedExercise}?mode=landmarks`);
+      ws.binaryType = "arraybuffer";
       websocketRef.current = ws;
 
       ws.onopen = () => {
@@ -170,28 +176,32 @@ export default function ExerciseGuidance() {
 
       ws.onmessage = (event) => {
         try {
-          const data: ExerciseData = JSON.parse(event.data);
-
-          if (data.type === "frame_data") {
+          // Video frames are binary (header + JPEG), control messages are JSON
+          if (isFrameMessage(event.data)) {
+            const frame = decodeFrame(event.data);
             frameCountRef.current++;
 
             // Batch state updates for better performance
-            setReps(data.reps);
-            setCurrentAngle(data.angle);
-            setExerciseStage(data.stage);
-            setPoseDetected(data.pose_detected);
+            setReps(frame.reps);
+            setCurrentAngle(Math.round(frame.angle));
+            setExerciseStage(frame.stage);
+            setPoseDetected(frame.poseDetected);
 
             // Update posture state
-            const newPostureState = data.posture_state as "good" | "ok" | "bad";
+            const newPostureState = frame.postureState;
             setPostureState(newPostureState);
 
+            // Server landmarks are normalised to the mirrored frame; the detector's video is not mirrored
+            setServerLandmarks(frame.landmarks ? frame.landmarks.map((l) => ({ ...l, x: 1 - l.x })) : null);
+
             // Update camera frame immediately for ultra-fast rendering
-            if (data.frame) {
-              setCameraFrame(`data:image/jpeg;base64,${data.frame}`);
+            if (frame.image) {
+              frameUrlRef.current = replaceFrameUrl(frameUrlRef.current, frame.image);
+              setCameraFrame(frameUrlRef.current);
             }
 
             // Handle completed rep with debouncing
-            if (data.rep_completed) {
+            if (frame.repCompleted) {
               const currentTime = Date.now();
               if (currentTime - lastRepTime > 500) { // 500ms debounce
                 setLastRepTime(currentTime);
@@ -221,9 +231,12 @@ export default function ExerciseGuidance() {
                 console.error('Audio feedback error:', error);
               }
             }
-          } else if (data.type === "error") {
-            setErrorMessage(data.message || "Unknown error");
-            setConnectionStatus("error");
+          } else {
+            const data: ExerciseData = JSON.parse(event.data);
+            if (data.type === "error") {
+              setErrorMessage(data.message || "Unknown error");
+              setConnectionStatus("error");
+            }
           }
         } catch (error) {
           console.error("WebSocket message parsing error:", error);
@@ -253,6 +266,7 @@ export default function ExerciseGuidance() {
       websocketRef.current.close();
       websocketRef.current = null;
     }
+    setServerLandmarks(null);
     setConnectionStatus("disconnected");
   }, []);
 
@@ -322,6 +336,10 @@ export default function ExerciseGuidance() {
   useEffect(() => {
     return () => {
       disconnectWebSocket();
+      if (frameUrlRef.current) {
+        URL.revokeObjectURL(frameUrlRef.current);
+        frameUrlRef.current = null;
+      }
     };
   }, [disconnectWebSocket]);
 
@@ -449,6 +467,21 @@ export default function ExerciseGuidance() {
                 className="w-full h-full"
               />
 
+              {/* Pose landmarks from the landmarks-only server session, drawn over the detector's video */}
+              {sessionActive && showSkeleton && serverLandmarks && (
+                <div className="absolute inset-0 pointer-events-none" style={{ zIndex: 15 }}>
+                  <UltraFastVideoFeed
+                    cameraFrame=""
+                    landmarks={serverLandmarks}
+                    isActive={sessionActive && !paused}
+                    poseDetected={poseDetected}
+                    exerciseStage={exerciseStage}
+                    currentAngle={currentAngle}
+                    postureState={postureState}
+                  />
+                </div>
+              )}
+
               {/* Exercise info overlay */}
               {sessionActive && (
                 <div className="absolute bottom-4 left-4 right-4" style={{ zIndex: 20 }}>
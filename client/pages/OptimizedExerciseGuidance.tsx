@@ -124,11 +124,11 @@ export default function OptimizedExerciseGuidance() {
   }, [exerciseData, reps, audioFeedback, postureState]);
 
   // Handle frame processing
-  const handleFrame = useCallback((frameData: string) => {
+  const handleFrame = useCallback((frame: Blob) => {
     if (sessionActive && !paused && isConnected) {
-      processFrame(frameData, selectedExercise);
+      processFrame(frame);
     }
-  }, [sessionActive, paused, isConnected, processFrame, selectedExercise]);
+  }, [sessionActive, paused, isConnected, processFrame]);
 
   // Timer effect for session duration
   useEffect(() => {
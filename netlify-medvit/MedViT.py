@@ -7,12 +7,12 @@ MedViT: A Robust Vision Transformer for Generalized Medical Image Classification
 from functools import partial
 import math
 import torch
+import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
-from einops import rearrange
 from timm.models.layers import DropPath, trunc_normal_
 from timm.models.registry import register_model
 from torch import nn
-from utils import merge_pre_bn
+from utils import merge_pre_bn, merge_post_bn
 
 NORM_EPS = 1e-5
 
@@ -30,8 +30,29 @@ class ConvBNReLU(nn.Module):
                               padding=1, groups=groups, bias=False)
         self.norm = nn.BatchNorm2d(out_channels, eps=NORM_EPS)
         self.act = nn.ReLU(inplace=True)
+        self.fused_relu = False
+
+    def merge_bn(self):
+        if isinstance(self.norm, nn.BatchNorm2d):
+            merge_post_bn(self.conv, self.norm)
+            self.norm = nn.Identity()
+
+    def fuse_relu(self):
+        """Run conv + ReLU as one oneDNN kernel (eager CPU inference only, needs folded BN)"""
+        if isinstance(self.norm, nn.Identity) and torch.backends.mkldnn.is_available():
+            self.fused_relu = True
+
+    @staticmethod
+    def _is_capturing():
+        """Tracing, scripting, ONNX export and torch.compile see the plain conv -> ReLU graph"""
+        return torch.jit.is_scripting() or torch.jit.is_tracing() or torch.onnx.is_in_onnx_export() \
+            or torch._dynamo.is_compiling()
 
     def forward(self, x):
+        if self.fused_relu and not self.training and x.device.type == 'cpu' and not self._is_capturing():
+            conv = self.conv
+            return torch.ops.mkldnn._convolution_pointwise(x, conv.weight, conv.bias, conv.padding, conv.stride,
+                                                           conv.dilation, conv.groups, 'relu', [], '')
         x = self.conv(x)
         x = self.norm(x)
         x = self.act(x)
@@ -68,6 +89,11 @@ class PatchEmbed(nn.Module):
             self.conv = nn.Identity()
             self.norm = nn.Identity()
 
+    def merge_bn(self):
+        if isinstance(self.norm, nn.BatchNorm2d):
+            merge_post_bn(self.conv, self.norm)
+            self.norm = nn.Identity()
+
     def forward(self, x):
         return self.norm(self.conv(self.avgpool(x)))
 
@@ -85,6 +111,11 @@ class MHCA(nn.Module):
         self.act = nn.ReLU(inplace=True)
         self.projection = nn.Conv2d(out_channels, out_channels, kernel_size=1, bias=False)
 
+    def merge_bn(self):
+        if isinstance(self.norm, nn.BatchNorm2d):
+            merge_post_bn(self.group_conv3x3, self.norm)
+            self.norm = nn.Identity()
+
     def forward(self, x):
         out = self.group_conv3x3(x)
         out = self.norm(out)
@@ -148,6 +179,28 @@ class SELayer(nn.Module):
         y = self.fc(y).view(b, c, 1, 1)
         return x * y
 
+
+class SEConv(nn.Module):
+    """
+    Inference form of ``SELayer``: the two linear layers run as 1x1 convolutions on the pooled
+    ``(B, C, 1, 1)`` map, so no reshapes are needed, and h_sigmoid is a single hardsigmoid.
+    """
+    def __init__(self, se_layer):
+        super(SEConv, self).__init__()
+        fc1, fc2 = se_layer.fc[0], se_layer.fc[2]
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.fc1 = nn.Conv2d(fc1.in_features, fc1.out_features, 1)
+        self.fc2 = nn.Conv2d(fc2.in_features, fc2.out_features, 1)
+        with torch.no_grad():
+            self.fc1.weight.copy_(fc1.weight.view_as(self.fc1.weight))
+            self.fc1.bias.copy_(fc1.bias)
+            self.fc2.weight.copy_(fc2.weight.view_as(self.fc2.weight))
+            self.fc2.bias.copy_(fc2.bias)
+
+    def forward(self, x):
+        y = F.relu(self.fc1(self.avg_pool(x)))
+        return x * F.hardsigmoid(self.fc2(y))
+
 class LocalityFeedForward(nn.Module):
     def __init__(self, in_dim, out_dim, stride, expand_ratio=4., act='hs+se', reduction=4,
                  wo_dp_conv=False, dp_first=False):
@@ -204,8 +257,38 @@ class LocalityFeedForward(nn.Module):
             nn.BatchNorm2d(out_dim)
         ])
         self.conv = nn.Sequential(*layers)
+        self.register_buffer('shortcut_scale', None)
+
+    def merge_bn(self, pre_norm=None):
+        """
+        Fold every BatchNorm after a convolution into that convolution. If ``pre_norm`` is given, it is the
+        BatchNorm applied to the input of this module; it is folded into the first 1x1 convolution and the
+        identity shortcut, which also sees the normalised input, becomes a per-channel scale.
+        """
+        layers = list(self.conv)
+        for i, layer in enumerate(layers):
+            if isinstance(layer, nn.BatchNorm2d):
+                merge_post_bn(layers[i - 1], layer)
+                layers[i] = nn.Identity()
+        self.conv = nn.Sequential(*layers)
+
+        if pre_norm is not None:
+            first, last = layers[0], layers[-2]
+            assert first.kernel_size == (1, 1), "pre BN can only be merged into a 1x1 convolution"
+            scale_invstd = pre_norm.running_var.add(pre_norm.eps).pow(-0.5)
+            shortcut_scale = scale_invstd * pre_norm.weight
+            shortcut_bias = pre_norm.bias - pre_norm.running_mean * shortcut_scale
+            merge_pre_bn(first, pre_norm)
+            last.bias.data.add_(shortcut_bias)
+            self.shortcut_scale = shortcut_scale.detach().view(1, -1, 1, 1)
+
+    def drop_identities(self):
+        """Remove the Identity placeholders left by ``merge_bn`` (inference only)"""
+        self.conv = nn.Sequential(*[layer for layer in self.conv if not isinstance(layer, nn.Identity)])
 
     def forward(self, x):
+        if self.shortcut_scale is not None:
+            return x * self.shortcut_scale + self.conv(x)
         x = x + self.conv(x)
         return x
 
@@ -257,7 +340,9 @@ class ECB(nn.Module):
 
     def merge_bn(self):
         if not self.is_bn_merged:
-            self.mlp.merge_bn(self.norm)
+            self.patch_embed.merge_bn()
+            self.mhca.merge_bn()
+            self.conv.merge_bn(self.norm)
             self.is_bn_merged = True
 
     def forward(self, x):
@@ -338,13 +423,81 @@ class E_MHSA(nn.Module):
         return x
 
 
+class E_MHSA_SDPA(nn.Module):
+    """
+    Efficient Multi-Head Self Attention on top of ``F.scaled_dot_product_attention``.
+
+    Numerically equivalent to ``E_MHSA``. The q/k/v projections are packed into a single linear
+    (``qkv``, or ``q`` + ``kv`` when keys and values come from the spatially reduced input), and
+    checkpoints with separate ``q``/``k``/``v`` weights are packed on load.
+    """
+    def __init__(self, dim, out_dim=None, head_dim=32, qkv_bias=True, qk_scale=None,
+                 attn_drop=0, proj_drop=0., sr_ratio=1):
+        super().__init__()
+        self.dim = dim
+        self.out_dim = out_dim if out_dim is not None else dim
+        self.num_heads = self.dim // head_dim
+        self.head_dim = head_dim
+        self.scale = qk_scale or head_dim ** -0.5
+        self.sr_ratio = sr_ratio
+        self.N_ratio = sr_ratio ** 2
+        if sr_ratio > 1:
+            self.q = nn.Linear(dim, self.dim, bias=qkv_bias)
+            self.kv = nn.Linear(dim, self.dim * 2, bias=qkv_bias)
+            self.sr = nn.AvgPool1d(kernel_size=self.N_ratio, stride=self.N_ratio)
+            self.norm = nn.BatchNorm1d(dim, eps=NORM_EPS)
+        else:
+            self.qkv = nn.Linear(dim, self.dim * 3, bias=qkv_bias)
+        self.proj = nn.Linear(self.dim, self.out_dim)
+        self.attn_drop = attn_drop
+        self.proj_drop = nn.Dropout(proj_drop)
+        self.is_bn_merged = False
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        packed = ['k', 'v'] if self.sr_ratio > 1 else ['q', 'k', 'v']
+        target = 'kv' if self.sr_ratio > 1 else 'qkv'
+        for param in ('weight', 'bias'):
+            keys = [prefix + name + '.' + param for name in packed]
+            if all(key in state_dict for key in keys):
+                state_dict[prefix + target + '.' + param] = torch.cat([state_dict.pop(key) for key in keys], dim=0)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def merge_bn(self, pre_bn):
+        if self.sr_ratio > 1:
+            merge_pre_bn(self.q, pre_bn)
+            merge_pre_bn(self.kv, pre_bn, self.norm)
+        else:
+            merge_pre_bn(self.qkv, pre_bn)
+        self.is_bn_merged = True
+
+    def forward(self, x):
+        B, N, C = x.shape
+        if self.sr_ratio > 1:
+            q = self.q(x).reshape(B, N, self.num_heads, self.head_dim).transpose(1, 2)
+            x_ = self.sr(x.transpose(1, 2))
+            if not torch.onnx.is_in_onnx_export() and not self.is_bn_merged:
+                x_ = self.norm(x_)
+            kv = self.kv(x_.transpose(1, 2)).reshape(B, -1, 2, self.num_heads, self.head_dim)
+            k, v = kv.permute(2, 0, 3, 1, 4).unbind(0)
+        else:
+            qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, self.head_dim)
+            q, k, v = qkv.permute(2, 0, 3, 1, 4).unbind(0)
+
+        x = F.scaled_dot_product_attention(q, k, v, dropout_p=self.attn_drop if self.training else 0.,
+                                           scale=self.scale)
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
+
 class LTB(nn.Module):
     """
     Local Transformer Block
     """
     def __init__(
             self, in_channels, out_channels, path_dropout, stride=1, sr_ratio=1,
-            mlp_ratio=2, head_dim=32, mix_block_ratio=0.75, attn_drop=0, drop=0,
+            mlp_ratio=2, head_dim=32, mix_block_ratio=0.75, attn_drop=0, drop=0, use_sdpa=False,
     ):
         super(LTB, self).__init__()
         self.in_channels = in_channels
@@ -357,8 +510,9 @@ class LTB(nn.Module):
 
         self.patch_embed = PatchEmbed(in_channels, self.mhsa_out_channels, stride)
         self.norm1 = norm_func(self.mhsa_out_channels)
-        self.e_mhsa = E_MHSA(self.mhsa_out_channels, head_dim=head_dim, sr_ratio=sr_ratio,
-                             attn_drop=attn_drop, proj_drop=drop)
+        mhsa_layer = E_MHSA_SDPA if use_sdpa else E_MHSA
+        self.e_mhsa = mhsa_layer(self.mhsa_out_channels, head_dim=head_dim, sr_ratio=sr_ratio,
+                                 attn_drop=attn_drop, proj_drop=drop)
         self.mhsa_path_dropout = DropPath(path_dropout * mix_block_ratio)
 
         self.projection = PatchEmbed(self.mhsa_out_channels, self.mhca_out_channels, stride=1)
@@ -375,8 +529,11 @@ class LTB(nn.Module):
 
     def merge_bn(self):
         if not self.is_bn_merged:
+            self.patch_embed.merge_bn()
             self.e_mhsa.merge_bn(self.norm1)
-            self.mlp.merge_bn(self.norm2)
+            self.projection.merge_bn()
+            self.mhca.merge_bn()
+            self.conv.merge_bn(self.norm2)
             self.is_bn_merged = True
 
     def forward(self, x):
@@ -386,9 +543,10 @@ class LTB(nn.Module):
             out = self.norm1(x)
         else:
             out = x
-        out = rearrange(out, "b c h w -> b (h w) c")  # b n c
+        # b c h w -> b (h w) c and back; both are views for channels_last inputs
+        out = out.flatten(2).transpose(1, 2)  # b n c
         out = self.mhsa_path_dropout(self.e_mhsa(out))
-        x = x + rearrange(out, "b (h w) c -> b c h w", h=H)
+        x = x + out.transpose(1, 2).reshape(B, C, H, W)
 
         out = self.projection(x)
         out = out + self.mhca_path_dropout(self.mhca(out))
@@ -403,17 +561,66 @@ class LTB(nn.Module):
         return x
 
 
+class ECBInference(ECB):
+    """ECB forward for BN-folded inference: no drop paths, norms or export checks"""
+    def forward(self, x):
+        x = self.patch_embed(x)
+        x = x + self.mhca(x)
+        return x + self.conv(x)
+
+
+class LTBInference(LTB):
+    """LTB forward for BN-folded inference: no drop paths, norms or export checks"""
+    def forward(self, x):
+        x = self.patch_embed(x)
+        B, C, H, W = x.shape
+        out = self.e_mhsa(x.flatten(2).transpose(1, 2))
+        x = x + out.transpose(1, 2).reshape(B, C, H, W)
+
+        out = self.projection(x)
+        out = out + self.mhca(out)
+        x = torch.cat([x, out], dim=1)
+        return x + self.conv(x)
+
+
+def _replace_modules(model, make_replacement):
+    """Replace every submodule for which ``make_replacement`` returns a module"""
+    replaced = []
+    for name, module in list(model.named_modules()):
+        if not name or any(name.startswith(prefix + '.') for prefix in replaced):
+            continue
+        replacement = make_replacement(module)
+        if replacement is not None:
+            parent_name, _, child_name = name.rpartition('.')
+            parent = model.get_submodule(parent_name) if parent_name else model
+            setattr(parent, child_name, replacement)
+            replaced.append(name)
+
+
+def _inference_replacement(module):
+    if isinstance(module, (DropPath, nn.Dropout)):
+        return nn.Identity()
+    if isinstance(module, h_swish):
+        return nn.Hardswish()
+    if isinstance(module, h_sigmoid):
+        return nn.Hardsigmoid()
+    if isinstance(module, SELayer):
+        return SEConv(module)
+    return None
+
+
 class MedViT(nn.Module):
     def __init__(self, stem_chs, depths, path_dropout, attn_drop=0, drop=0, num_classes=1000,
                  strides=[1, 2, 2, 2], sr_ratios=[8, 4, 2, 1], head_dim=32, mix_block_ratio=0.75,
-                 use_checkpoint=False):
+                 use_checkpoint=False, use_sdpa=False, init_weights=True, stage_out_channels=None):
         super(MedViT, self).__init__()
         self.use_checkpoint = use_checkpoint
 
-        self.stage_out_channels = [[96] * (depths[0]),
-                                   [192] * (depths[1] - 1) + [256],
-                                   [384, 384, 384, 384, 512] * (depths[2] // 5),
-                                   [768] * (depths[3] - 1) + [1024]]
+        # Pruned variants (pruning.py) pass their own per-block widths
+        self.stage_out_channels = stage_out_channels or [[96] * (depths[0]),
+                                                         [192] * (depths[1] - 1) + [256],
+                                                         [384, 384, 384, 384, 512] * (depths[2] // 5),
+                                                         [768] * (depths[3] - 1) + [1024]]
 
         # Next Hybrid Strategy
         self.stage_block_types = [[ECB] * depths[0],
@@ -430,7 +637,7 @@ class MedViT(nn.Module):
         input_channel = stem_chs[-1]
         features = []
         idx = 0
-        dpr = [x.item() for x in torch.linspace(0, path_dropout, sum(depths))]  # stochastic depth decay rule
+        dpr = [x.item() for x in torch.linspace(0, path_dropout, sum(depths), device='cpu')]  # stochastic depth decay rule
         for stage_id in range(len(depths)):
             numrepeat = depths[stage_id]
             output_channels = self.stage_out_channels[stage_id]
@@ -449,7 +656,7 @@ class MedViT(nn.Module):
                 elif block_type is LTB:
                     layer = LTB(input_channel, output_channel, path_dropout=dpr[idx + block_id], stride=stride,
                                 sr_ratio=sr_ratios[stage_id], head_dim=head_dim, mix_block_ratio=mix_block_ratio,
-                                attn_drop=attn_drop, drop=drop)
+                                attn_drop=attn_drop, drop=drop, use_sdpa=use_sdpa)
                     features.append(layer)
                 input_channel = output_channel
             idx += numrepeat
@@ -463,14 +670,67 @@ class MedViT(nn.Module):
         )
 
         self.stage_out_idx = [sum(depths[:idx + 1]) - 1 for idx in range(len(depths))]
-        print('initialize_weights...')
-        self._initialize_weights()
+        self.is_bn_merged = False
+        self.is_inference = False
+        self.channels_last = False
+        if init_weights:
+            print('initialize_weights...')
+            self._initialize_weights()
 
+    @torch.no_grad()
     def merge_bn(self):
+        """
+        Fold every BatchNorm into the adjacent convolution / linear layer for inference. Call this after
+        ``proj_head`` has been replaced, since the final norm is folded into the classifier. The final norm
+        is kept as ``head_norm`` so it can be folded into other classifier heads later.
+        """
+        if self.is_bn_merged:
+            return
         self.eval()
         for idx, module in self.named_modules():
-            if isinstance(module, ECB) or isinstance(module, LTB):
+            if isinstance(module, (ConvBNReLU, ECB, LTB)):
                 module.merge_bn()
+        merge_pre_bn(self.proj_head[0], self.norm)
+        self.head_norm = self.norm
+        self.norm = nn.Identity()
+        self.is_bn_merged = True
+
+    @torch.no_grad()
+    def to_inference(self):
+        """
+        Strip training-only structure for serving: BatchNorm is folded, DropPath / Dropout become
+        Identity, h_swish / h_sigmoid become single hardswish / hardsigmoid ops, SELayer runs as
+        1x1 convolutions, and ECB / LTB use lean forwards without per-block checks. Outputs match
+        the eval-mode model; the result can no longer be trained.
+        """
+        if self.is_inference:
+            return self
+        self.merge_bn()
+        self.use_checkpoint = False
+        _replace_modules(self, _inference_replacement)
+        for module in self.modules():
+            if isinstance(module, LocalityFeedForward):
+                module.drop_identities()
+            elif isinstance(module, E_MHSA_SDPA):
+                module.attn_drop = 0.
+            elif type(module) is ECB:
+                module.__class__ = ECBInference
+            elif type(module) is LTB:
+                module.__class__ = LTBInference
+        self.is_inference = True
+        return self.eval()
+
+    def to_channels_last(self):
+        """
+        Inference mode for oneDNN CPU kernels: BatchNorm is folded, weights and inputs use the
+        ``torch.channels_last`` (NHWC) layout and the stem runs fused conv + ReLU.
+        """
+        self.merge_bn()
+        for module in self.stem:
+            module.fuse_relu()
+        self.to(memory_format=torch.channels_last)
+        self.channels_last = True
+        return self
 
     def _initialize_weights(self):
         for n, m in self.named_modules():
@@ -486,20 +746,75 @@ class MedViT(nn.Module):
                 if hasattr(m, 'bias') and m.bias is not None:
                     nn.init.constant_(m.bias, 0)
 
-    def forward(self, x):
+    def forward_features(self, x, stages=None):
+        """
+        Run the stem and feature trunk and return the pooled features fed to ``proj_head``. If ``stages``
+        (stage indices, 0-3) is given, return ``(pooled, {stage: feature map})`` with the output map of
+        each requested stage as well.
+        """
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         x = self.stem(x)
-        for idx, layer in enumerate(self.features):
-            if self.use_checkpoint:
+        stage_maps = {}
+        if stages is not None:
+            stage_of_layer = {self.stage_out_idx[stage]: stage for stage in stages}
+            for idx, layer in enumerate(self.features):
+                x = checkpoint.checkpoint(layer, x) if self.use_checkpoint else layer(x)
+                if idx in stage_of_layer:
+                    stage_maps[stage_of_layer[idx]] = x
+        elif self.use_checkpoint:
+            for layer in self.features:
                 x = checkpoint.checkpoint(layer, x)
-            else:
-                x = layer(x)
+        else:
+            x = self.features(x)
         x = self.norm(x)
         x = self.avgpool(x)
         x = torch.flatten(x, 1)
+        if stages is not None:
+            return x, stage_maps
+        return x
+
+    def embed(self, x, stages=None):
+        """
+        Image embeddings: the pooled, normalised features seen by the classifier (the final norm is
+        applied even when it has been folded into ``proj_head``). With ``stages``, returns
+        ``(embedding, {stage: pooled stage features})``.
+        """
+        if stages is None:
+            pooled = self.forward_features(x)
+        else:
+            pooled, stage_maps = self.forward_features(x, stages=stages)
+        if self.is_bn_merged:
+            norm = self.head_norm
+            pooled = (pooled - norm.running_mean) * torch.rsqrt(norm.running_var + norm.eps) * norm.weight + norm.bias
+        if stages is None:
+            return pooled
+        return pooled, {stage: torch.flatten(F.adaptive_avg_pool2d(x, 1), 1) for stage, x in stage_maps.items()}
+
+    def forward(self, x):
+        x = self.forward_features(x)
         x = self.proj_head(x)
         return x
 
 
+@torch.no_grad()
+def merge_bn_and_verify(model, image_size=224, batch_size=2, rtol=1e-4):
+    """
+    Fold ``model``'s BatchNorm layers in place and return it together with the max absolute difference
+    between its logits before and after folding on a random batch, relative to the largest logit.
+    Raises if the outputs diverge beyond ``rtol``. No copy of the model is made, so memory-mapped
+    weights are only written once, by the fold itself.
+    """
+    model.eval()
+    x = torch.randn(batch_size, 3, image_size, image_size)
+    reference = model(x)
+    model.merge_bn()
+    rel_diff = ((reference - model(x)).abs().max() / reference.abs().max().clamp_min(1e-6)).item()
+    if rel_diff > rtol:
+        raise RuntimeError('BN merge changed the model outputs (relative diff {:.2e})'.format(rel_diff))
+    return model, rel_diff
+
+
 @register_model
 def MedViT_small(pretrained=False, pretrained_cfg=None, **kwargs):
     model = MedViT(stem_chs=[64, 32, 64], depths=[3, 4, 10, 3], path_dropout=0.1, **kwargs)
@@ -0,0 +1,183 @@
+"""
+Build step: serialise ready-to-run MedViT-Small snapshots for the predict function.
+
+The datasets share one backbone snapshot: MedViT-Small up to the pooled features, BN-folded and
+stripped for inference, traced and frozen with TorchScript (or exported to ONNX). Each dataset only
+adds its classifier head, with the final norm folded in, as a small ``.npz`` of NumPy weights
+(a few KB), so building every dataset costs one backbone. The predict function only has to load
+the backbone with torch.jit / onnxruntime; it never imports torchvision, timm, einops or MedViT.py
+and never builds or initialises a model.
+
+    python build_snapshot.py --checkpoint checkpoints/medvit_small_imagenet.pth --head-dir checkpoints
+    python build_snapshot.py --format onnx --datasets PathMNIST ChestMNIST
+
+Dataset heads are read from ``<head dir>/<checkpoint stem>_<dataset>_head.pth`` (the naming used
+by server/python). Without a checkpoint the snapshots are built from random weights and are
+marked as not pretrained. ``manifest.json`` in the output directory describes the backbone and
+every head.
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.join(CURRENT_DIR, 'netlify', 'functions')
+sys.path.insert(0, CURRENT_DIR)
+sys.path.insert(0, FUNCTIONS_DIR)
+os.environ['MEDVIT_PRELOAD'] = '0'
+
+from MedViT import MedViT_small  # noqa: E402
+from utils import merge_pre_bn  # noqa: E402
+from predict import CLASS_LABELS, MANIFEST_FILE, SNAPSHOT_DIR  # noqa: E402
+
+
+def load_state_dict(path):
+    checkpoint = torch.load(path, map_location='cpu')
+    if 'model' in checkpoint:
+        return checkpoint['model']
+    if 'state_dict' in checkpoint:
+        return checkpoint['state_dict']
+    return checkpoint
+
+
+class FeatureBackbone(nn.Module):
+    """Traceable view of an inference MedViT that returns the pooled features"""
+    def __init__(self, model):
+        super(FeatureBackbone, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_features(x)
+
+
+def build_backbone(checkpoint=None):
+    """BN-folded inference MedViT-Small. Returns ``(model, pretrained)``"""
+    model = MedViT_small(num_classes=1000, use_sdpa=True)
+    pretrained = False
+    if checkpoint:
+        model.load_state_dict(load_state_dict(checkpoint), strict=False)
+        pretrained = True
+    model.eval()
+    # The final norm is folded into the ImageNet head and kept as ``head_norm`` for the dataset heads
+    return model.to_inference(), pretrained
+
+
+@torch.no_grad()
+def build_head(backbone, dataset, checkpoint=None, head_dir=None):
+    """The dataset's classifier with the backbone's final norm folded in. Returns ``(head, pretrained)``"""
+    head = nn.Linear(backbone.head_norm.num_features, len(CLASS_LABELS[dataset]))
+    pretrained = bool(checkpoint)
+    if checkpoint and head_dir:
+        stem = os.path.splitext(os.path.basename(checkpoint))[0]
+        head_path = os.path.join(head_dir, f"{stem}_{dataset.lower()}_head.pth")
+        if os.path.exists(head_path):
+            head.load_state_dict(torch.load(head_path, map_location='cpu'))
+        else:
+            print(f"⚠ Warning: No {dataset} head at {head_path}; using a random head")
+            pretrained = False
+    merge_pre_bn(head, backbone.head_norm)
+    return head.eval(), pretrained
+
+
+def export_head(head, path):
+    np.savez(path, weight=head.weight.detach().numpy().astype(np.float32),
+             bias=head.bias.detach().numpy().astype(np.float32))
+
+
+@torch.no_grad()
+def export_torchscript(model, path, image_size):
+    traced = torch.jit.trace(model, torch.randn(1, 3, image_size, image_size), check_trace=False)
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+
+@torch.no_grad()
+def export_onnx(model, path, image_size):
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False
+    torch.onnx.export(model, torch.randn(1, 3, image_size, image_size), path, input_names=['input'],
+                      output_names=['features'], dynamic_axes={'input': {0: 'batch'}, 'features': {0: 'batch'}},
+                      opset_version=17, do_constant_folding=True, **export_kwargs)
+
+
+@torch.no_grad()
+def verify(model, path, fmt, image_size):
+    x = torch.randn(1, 3, image_size, image_size)
+    reference = model(x)
+    if fmt == 'onnx':
+        import onnxruntime
+
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        output = torch.from_numpy(session.run(None, {'input': x.numpy()})[0])
+    else:
+        output = torch.jit.load(path)(x)
+    return ((output - reference).abs().max() / reference.abs().max().clamp_min(1e-6)).item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build MedViT snapshots for the Netlify predict function')
+    parser.add_argument('--checkpoint', default=os.environ.get('MEDVIT_CHECKPOINT'),
+                        help='MedViT-Small checkpoint (default: $MEDVIT_CHECKPOINT, else random weights)')
+    parser.add_argument('--head-dir', default=None, help='directory with per-dataset head weights')
+    parser.add_argument('--datasets', nargs='+', default=list(CLASS_LABELS), choices=list(CLASS_LABELS),
+                        help='datasets to build heads for (default: all; each head is a few KB)')
+    parser.add_argument('--format', default='torchscript', choices=['torchscript', 'onnx'])
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--output-dir', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.checkpoint and not os.path.exists(args.checkpoint):
+        raise SystemExit(f"Checkpoint not found: {args.checkpoint}")
+    head_dir = args.head_dir or (os.path.dirname(args.checkpoint) if args.checkpoint else None)
+    os.makedirs(args.output_dir, exist_ok=True)
+    extension = 'onnx' if args.format == 'onnx' else 'pt'
+
+    start = time.perf_counter()
+    backbone, pretrained = build_backbone(args.checkpoint)
+    file_name = f"medvit_small_features_{args.image_size}.{extension}"
+    path = os.path.join(args.output_dir, file_name)
+    features = FeatureBackbone(backbone).eval()
+    if args.format == 'onnx':
+        export_onnx(features, path, args.image_size)
+    else:
+        export_torchscript(features, path, args.image_size)
+    rel_diff = verify(features, path, args.format, args.image_size)
+    print(f"✓ Backbone: {file_name} ({os.path.getsize(path) / 1e6:.1f} MB, relative diff {rel_diff:.2e}, "
+          f"{time.perf_counter() - start:.1f}s)")
+    if rel_diff > 1e-3:
+        raise SystemExit(f"Backbone snapshot diverges from the eager model (relative diff {rel_diff:.2e})")
+
+    # Heads carry this backbone's folded final norm, so they are always rebuilt with it
+    heads = {}
+    for dataset in args.datasets:
+        head, head_pretrained = build_head(backbone, dataset, args.checkpoint, head_dir)
+        head_file = f"medvit_small_{dataset.lower()}_head.npz"
+        export_head(head, os.path.join(args.output_dir, head_file))
+        heads[dataset] = {'file': head_file, 'pretrained': head_pretrained}
+        print(f"✓ {dataset}: {head_file} ({len(CLASS_LABELS[dataset])} classes)")
+
+    manifest = {
+        'backbone': {
+            'file': file_name,
+            'format': args.format,
+            'image_size': args.image_size,
+            'model': 'MedViT-Small',
+            'pretrained': pretrained,
+        },
+        'heads': heads,
+    }
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILE)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✓ Wrote {manifest_path}")
+
+
+if __name__ == '__main__':
+    main()
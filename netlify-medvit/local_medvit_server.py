@@ -3,6 +3,7 @@ from flask_cors import CORS
 import sys
 import os
 import json
+import base64
 
 # Add current directory to path so we can import MedViT
 sys.path.append(os.getcwd())
@@ -24,10 +25,15 @@ CORS(app) # Enable CORS for all routes
 @app.route('/.netlify/functions/predict', methods=['POST', 'OPTIONS'])
 def predict_endpoint():
     # Mock the event object expected by the handler
+    # Binary uploads are base64-encoded in the event, as Netlify does
+    is_binary = request.mimetype in ('multipart/form-data', 'application/octet-stream')
+    body = request.get_data()
     event = {
         'httpMethod': request.method,
-        'body': request.get_data(as_text=True),
-        'headers': dict(request.headers)
+        'body': base64.b64encode(body).decode('ascii') if is_binary else body.decode('utf-8'),
+        'isBase64Encoded': is_binary,
+        'headers': dict(request.headers),
+        'queryStringParameters': request.args.to_dict()
     }
     
     context = {} # Mock context
@@ -1,28 +1,44 @@
 """
 MedViT Disease Detection - Netlify Serverless Function
 Optimized for Netlify's serverless environment with lightweight model
+
+Cold starts: build_snapshot.py serialises one BN-folded backbone snapshot (TorchScript or ONNX)
+shared by all datasets, plus a small NumPy classifier head per dataset, into snapshots/. Module
+import only pulls in the standard library, NumPy and Pillow; the first request imports the one
+runtime the backbone needs (torch or onnxruntime) and loads it, and each dataset then only loads
+its head. The backbone and the default dataset's head are loaded while the function initialises.
+The backbone does not fit Netlify's 50 MB function bundle, so deployments host the snapshot
+directory elsewhere and set MEDVIT_SNAPSHOT_URL; each function instance downloads the files it
+needs to /tmp once. Without snapshots the function falls back to building MedViT-Small from MedViT.py.
 """
 import json
 import base64
 import io
 import os
 import sys
+import time
 from typing import Dict, List
 
+import numpy as np
+from PIL import Image
+
 # Add parent directories to path to import MedViT
 current_dir = os.path.dirname(os.path.abspath(__file__))
 netlify_dir = os.path.dirname(os.path.dirname(current_dir))
 sys.path.insert(0, netlify_dir)
 
-try:
-    import torch
-    import torch.nn.functional as F
-    from torchvision import transforms
-    from PIL import Image
-    import numpy as np
-    from MedViT import MedViT_small
-except ImportError as e:
-    print(f"Import error: {e}")
+SNAPSHOT_DIR = os.environ.get('MEDVIT_SNAPSHOT_DIR', os.path.join(current_dir, 'snapshots'))
+MANIFEST_FILE = 'manifest.json'
+# Base URL of an uploaded snapshot directory (manifest.json, backbone, heads). When set, the files are
+# fetched from there into SNAPSHOT_CACHE_DIR (/tmp is the only writable path) instead of SNAPSHOT_DIR.
+SNAPSHOT_URL = os.environ.get('MEDVIT_SNAPSHOT_URL', '').rstrip('/')
+SNAPSHOT_CACHE_DIR = os.environ.get('MEDVIT_SNAPSHOT_CACHE_DIR', '/tmp/medvit-snapshots')
+DOWNLOAD_TIMEOUT = float(os.environ.get('MEDVIT_DOWNLOAD_TIMEOUT', '30'))
+DEFAULT_DATASET = os.environ.get('MEDVIT_DEFAULT_DATASET', 'PathMNIST')
+PRELOAD = os.environ.get('MEDVIT_PRELOAD', '1') != '0'
+
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(1, 3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(1, 3, 1, 1)
 
 # Dataset class labels
 CLASS_LABELS = {
@@ -61,45 +77,189 @@ CLASS_LABELS = {
 
 # Global model cache
 _model_cache = {}
+_manifest = None
+# Cold-start phases (milliseconds) of this function instance
+_timings = {}
+
+def _timed(name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    _timings[name] = (time.perf_counter() - start) * 1000
+    return result
+
+def _download(url, path):
+    import shutil
+    import urllib.request
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.part'
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(partial, 'wb') as f:
+        shutil.copyfileobj(response, f, 1 << 20)
+    os.replace(partial, path)
+
+def snapshot_path(file_name: str) -> str:
+    """Local path of a snapshot file, downloaded from MEDVIT_SNAPSHOT_URL on first use when it is set"""
+    if not SNAPSHOT_URL:
+        return os.path.join(SNAPSHOT_DIR, file_name)
+    path = os.path.join(SNAPSHOT_CACHE_DIR, file_name)
+    if not os.path.exists(path):
+        _timed(f"download_{file_name}", _download, f"{SNAPSHOT_URL}/{file_name}", path)
+    return path
+
+def load_manifest() -> Dict:
+    """Snapshots written by build_snapshot.py: the shared backbone and the heads keyed by dataset"""
+    global _manifest
+    if _manifest is None:
+        path = snapshot_path(MANIFEST_FILE)
+        manifest = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+        _manifest = manifest
+    return _manifest
+
+def _load_torchscript(path):
+    import torch
+
+    torch.set_grad_enabled(False)
+    module = torch.jit.load(path, map_location='cpu')
+    return lambda x: module(torch.from_numpy(x)).numpy()
+
+def _load_onnx(path):
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    return lambda x: session.run(None, {input_name: x})[0]
+
+def load_backbone():
+    """Return (run, backbone info) for the shared backbone snapshot, or None if it was not built"""
+    if 'backbone' in _model_cache:
+        return _model_cache['backbone']
+
+    info = load_manifest().get('backbone')
+    if info is None:
+        return None
+    loader = _load_onnx if info['format'] == 'onnx' else _load_torchscript
+    path = snapshot_path(info['file'])
+    run = _timed('load_backbone', loader, path)
+    _model_cache['backbone'] = (run, info)
+    return _model_cache['backbone']
+
+def _load_head(path):
+    with np.load(path) as head:
+        weight, bias = head['weight'].T.copy(), head['bias']
+    return lambda features: features @ weight + bias
+
+def load_snapshot(dataset: str):
+    """Return (run, snapshot info) for the backbone plus the dataset's head, or None if they were not built"""
+    cache_key = f"snapshot_{dataset}"
+    if cache_key in _model_cache:
+        return _model_cache[cache_key]
+
+    head_info = load_manifest().get('heads', {}).get(dataset)
+    backbone = load_backbone() if head_info is not None else None
+    if backbone is None:
+        return None
+    features, info = backbone
+    head = _timed(f"load_{dataset}_head", _load_head, snapshot_path(head_info['file']))
+    info = dict(info, head=head_info['file'], pretrained=info['pretrained'] and head_info['pretrained'])
+    _model_cache[cache_key] = (lambda x: head(features(x)), info)
+    return _model_cache[cache_key]
 
 def get_model(num_classes: int):
-    """Load lightweight MedViT-Small model"""
+    """Load lightweight MedViT-Small model (fallback when no snapshot was built)"""
     cache_key = f"medvit_small_{num_classes}"
     
     if cache_key in _model_cache:
         return _model_cache[cache_key]
     
+    import torch
+    from MedViT import MedViT_small
+
     # Use only MedViT-Small for Netlify (smallest model)
     model = MedViT_small(num_classes=num_classes)
     model.eval()
-    _model_cache[cache_key] = model
-    return model
+
+    def run(x):
+        with torch.no_grad():
+            return model(torch.from_numpy(x)).numpy()
+
+    _model_cache[cache_key] = run
+    return run
 
 def preprocess_image(image, size=224):
-    """Preprocess image for inference"""
-    transform = transforms.Compose([
-        transforms.Resize((size, size)),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225]
-        )
-    ])
-    
+    """Preprocess image for inference: (1, 3, size, size) float32, ImageNet-normalised"""
     if image.mode != 'RGB':
         image = image.convert('RGB')
     
-    return transform(image).unsqueeze(0)
+    image = image.resize((size, size), Image.BILINEAR)
+    x = np.asarray(image, dtype=np.float32).transpose(2, 0, 1)[None] / 255.0
+    return np.ascontiguousarray((x - MEAN) / STD)
 
-def decode_base64_image(base64_string):
-    """Decode base64 image string to PIL Image"""
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def preload():
+    """Load the backbone and the default dataset's head while the function instance initialises"""
+    try:
+        load_snapshot(DEFAULT_DATASET)
+    except Exception as e:
+        print(f"Preload of {DEFAULT_DATASET} snapshot failed: {e}")
+
+def decode_base64_bytes(base64_string):
+    """Decode base64 image string to raw image bytes"""
     if ',' in base64_string:
         base64_string = base64_string.split(',')[1]
     
-    image_data = base64.b64decode(base64_string)
+    return base64.b64decode(base64_string)
+
+def decode_base64_image(base64_string):
+    """Decode base64 image string to PIL Image"""
+    image_data = decode_base64_bytes(base64_string)
     image = Image.open(io.BytesIO(image_data))
     return image
 
+def parse_multipart(body: bytes, content_type: str) -> Dict:
+    """Parse a multipart/form-data body into {field name: bytes}"""
+    from email.parser import BytesParser
+    from email.policy import HTTP
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = part.get_payload(decode=True)
+    return fields
+
+def read_event_image(event):
+    """
+    Extract (image bytes, params) from the function event. JSON bodies carry a base64 image;
+    multipart/form-data and application/octet-stream bodies carry the raw image bytes, which
+    Netlify delivers base64-encoded once (isBase64Encoded).
+    """
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    content_type = headers.get('content-type', 'application/json')
+    mimetype = content_type.split(';')[0].strip().lower()
+    body = event.get('body') or ''
+
+    if mimetype in ('multipart/form-data', 'application/octet-stream'):
+        raw = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode('latin-1')
+        if mimetype == 'application/octet-stream':
+            return raw or None, event.get('queryStringParameters') or {}
+        fields = parse_multipart(raw, content_type)
+        image_data = fields.pop('image', None)
+        return image_data, {k: v.decode('utf-8') for k, v in fields.items()}
+
+    data = json.loads(body)
+    if 'image' not in data:
+        return None, data
+    return decode_base64_bytes(data['image']), data
+
 def handler(event, context):
     """Netlify serverless function handler"""
     
@@ -127,10 +287,10 @@ def handler(event, context):
                 'body': json.dumps({'error': 'No request body provided'})
             }
         
-        data = json.loads(event['body'])
+        image_data, data = read_event_image(event)
         
         # Validate required fields
-        if 'image' not in data:
+        if not image_data:
             return {
                 'statusCode': 400,
                 'headers': headers,
@@ -138,38 +298,48 @@ def handler(event, context):
             }
         
         # Extract parameters
-        image_b64 = data['image']
         dataset = data.get('dataset', 'PathMNIST')
-        image_size = data.get('image_size', 224)
+        requested_size = data.get('image_size')
+        image_size = int(requested_size or 224)
         
         # Get class labels
         class_labels = CLASS_LABELS.get(dataset, [f"Class {i}" for i in range(9)])
         num_classes = len(class_labels)
         
+        # Load model: the prebuilt snapshot if there is one
+        snapshot = load_snapshot(dataset) if dataset in CLASS_LABELS else None
+        if snapshot is not None:
+            run, snapshot_info = snapshot
+            # The snapshot is traced for one input size
+            if requested_size and image_size != snapshot_info['image_size']:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'error': f"image_size {image_size} is not supported; this deployment serves "
+                                 f"{snapshot_info['image_size']}x{snapshot_info['image_size']} inputs"
+                    })
+                }
+            image_size = snapshot_info['image_size']
+        else:
+            run, snapshot_info = get_model(num_classes), None
+        
         # Decode and preprocess image
-        image = decode_base64_image(image_b64)
+        image = Image.open(io.BytesIO(image_data))
         image_tensor = preprocess_image(image, image_size)
         
-        # Load model
-        model = get_model(num_classes)
-        
         # Make prediction
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            probs = F.softmax(outputs, dim=1)
-            
-            # Get top 5 predictions
-            top_k = min(5, num_classes)
-            top_probs, top_indices = torch.topk(probs, top_k, dim=1)
-            
-            results = []
-            for idx, prob in zip(top_indices[0], top_probs[0]):
-                idx_val = idx.item()
-                class_label = class_labels[idx_val] if idx_val < len(class_labels) else f"Class {idx_val}"
-                results.append({
-                    'class': class_label,
-                    'confidence': float(prob.item() * 100)
-                })
+        probs = softmax(run(image_tensor))[0]
+        
+        # Get top 5 predictions
+        top_k = min(5, num_classes)
+        results = []
+        for idx_val in np.argsort(-probs)[:top_k].tolist():
+            class_label = class_labels[idx_val] if idx_val < len(class_labels) else f"Class {idx_val}"
+            results.append({
+                'class': class_label,
+                'confidence': float(probs[idx_val] * 100)
+            })
         
         # Determine severity
         top_confidence = results[0]['confidence']
@@ -189,9 +359,13 @@ def handler(event, context):
             'description': 'AI-based medical image analysis. Please consult a healthcare professional for confirmation.',
             'model_used': 'MedViT-Small',
             'dataset': dataset,
-            'using_pretrained': False,
-            'warning': '⚠️ Lightweight model without pretrained weights. For production accuracy, use the full deployment.'
+            'image_size': image_size,
+            'using_pretrained': bool(snapshot_info and snapshot_info['pretrained']),
+            'snapshot': {'backbone': snapshot_info['file'], 'head': snapshot_info['head']} if snapshot_info else None,
+            'cold_start_ms': dict(_timings)
         }
+        if not response_data['using_pretrained']:
+            response_data['warning'] = '⚠️ Lightweight model without pretrained weights. For production accuracy, use the full deployment.'
         
         return {
             'statusCode': 200,
@@ -209,3 +383,6 @@ def handler(event, context):
                 'message': 'Internal server error'
             })
         }
+
+if PRELOAD:
+    preload()
@@ -0,0 +1,89 @@
+"""
+Cold-start profile of the predict function.
+
+Each measurement runs in a fresh interpreter, like a new function instance:
+    * ``python -X importtime`` of the predict module (without preloading), listing the modules
+      with the largest cumulative import time,
+    * wall time of importing the module with the default dataset preloaded, then of the first and
+      second request.
+
+    python profile_cold_start.py
+    python profile_cold_start.py --dataset ChestMNIST --no-preload --top 25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.join(CURRENT_DIR, 'netlify', 'functions')
+
+REQUEST_SCRIPT = r'''
+import base64, io, json, sys, time
+start = time.perf_counter()
+import predict
+import_ms = (time.perf_counter() - start) * 1000
+from PIL import Image
+buffer = io.BytesIO()
+Image.new('RGB', (256, 256), (128, 96, 160)).save(buffer, 'PNG')
+event = {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'},
+         'body': json.dumps({'image': base64.b64encode(buffer.getvalue()).decode(), 'dataset': sys.argv[1]})}
+requests_ms = []
+for _ in range(2):
+    start = time.perf_counter()
+    response = predict.handler(event, None)
+    requests_ms.append((time.perf_counter() - start) * 1000)
+body = json.loads(response['body'])
+print(json.dumps({'import_ms': import_ms, 'first_request_ms': requests_ms[0], 'second_request_ms': requests_ms[1],
+                  'status': response['statusCode'], 'snapshot': body.get('snapshot'),
+                  'cold_start_ms': body.get('cold_start_ms'), 'error': body.get('error')}))
+'''
+
+
+def import_profile(env, top=15):
+    """``(module, cumulative ms)`` of the slowest imports of the predict module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import predict'], cwd=FUNCTIONS_DIR,
+                            env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(cumulative) / 1000.0))
+    return sorted(modules, key=lambda item: -item[1])[:top]
+
+
+def request_profile(env, dataset):
+    result = subprocess.run([sys.executable, '-c', REQUEST_SCRIPT, dataset], cwd=FUNCTIONS_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile cold starts of the Netlify predict function')
+    parser.add_argument('--dataset', default=None, help='dataset requested (default: the preloaded one)')
+    parser.add_argument('--no-preload', action='store_true', help='do not preload the default dataset')
+    parser.add_argument('--top', type=int, default=15, help='number of modules in the import profile')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MEDVIT_PRELOAD='0')
+    modules = import_profile(env, args.top)
+    print("=" * 60)
+    print("Import time of predict.py (cumulative, without preload)")
+    print("=" * 60)
+    for name, ms in modules:
+        print(f"  {name}: {ms:.1f} ms")
+
+    env['MEDVIT_PRELOAD'] = '0' if args.no_preload else '1'
+    dataset = args.dataset or env.get('MEDVIT_DEFAULT_DATASET', 'PathMNIST')
+    report = request_profile(env, dataset)
+    print("=" * 60)
+    print(f"Cold start - {dataset} ({'no preload' if args.no_preload else 'preload'})")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"  {key}: {value:.1f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,6 @@ import mediapipe as mp
 import numpy as np
 import asyncio
 import json
-import base64
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -19,6 +18,9 @@ import threading
 import time
 from datetime import datetime
 
+from frame_pipeline import acquire_camera, active_camera, pose_executor, release_camera, stream_frames
+from frame_protocol import PROTOCOL_VERSION, encode_frame, encode_landmarks
+
 # Import helpers (create if not exists)
 try:
     import sys
@@ -270,12 +272,14 @@ class ExerciseDetector:
         return False, angle, self.stage or "detecting"
 
 class ExerciseSession:
-    def __init__(self, session_id: str, exercise_type: str):
+    def __init__(self, session_id: str, exercise_type: str, mode: str = "frames"):
         self.session_id = session_id
+        # "landmarks": send only pose landmarks + rep state, no annotated JPEG
+        self.landmarks_only = mode == "landmarks"
         self.detector = ExerciseDetector(exercise_type)
         self.is_active = False
         self.start_time = None
-        self.cap = None
+        self.capture = None
         self.pose = None
         self.websocket = None
         self.frame_count = 0
@@ -286,10 +290,11 @@ class ExerciseSession:
         self.is_active = True
         self.start_time = datetime.now()
         
+        loop = asyncio.get_running_loop()
         try:
-            # Initialize camera
-            self.cap = cv2.VideoCapture(0)
-            if not self.cap.isOpened():
+            # Shared camera capture thread (opening the camera blocks)
+            self.capture = await loop.run_in_executor(None, acquire_camera, 0)
+            if not self.capture.is_opened():
                 await websocket.send_text(json.dumps({
                     "type": "error",
                     "message": "Camera not available"
@@ -304,16 +309,18 @@ class ExerciseSession:
                 }))
                 return False
             
-            self.pose = mp_pose.Pose(
+            self.pose = await loop.run_in_executor(pose_executor, lambda: mp_pose.Pose(
                 min_detection_confidence=0.7,
                 min_tracking_confidence=0.5,
                 model_complexity=1
-            )
+            ))
             
             await websocket.send_text(json.dumps({
                 "type": "session_started",
                 "exercise_type": self.detector.exercise_type,
-                "session_id": self.session_id
+                "session_id": self.session_id,
+                "protocol": PROTOCOL_VERSION,
+                "mode": "landmarks" if self.landmarks_only else "frames"
             }))
             
             # Start detection loop
@@ -327,81 +334,67 @@ class ExerciseSession:
             return False
     
     async def detection_loop(self):
-        """Main detection loop"""
+        """Main detection loop: capture and inference run off the event loop, this only sends"""
         try:
-            while self.is_active and self.cap and self.cap.isOpened():
-                ret, frame = self.cap.read()
-                if not ret:
-                    continue
-                
-                self.frame_count += 1
-                
-                # Flip frame horizontally
-                frame = cv2.flip(frame, 1)
-                
-                # Convert to RGB
-                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                image.flags.writeable = False
-                
-                # Process frame
-                results = self.pose.process(image)
-                
-                # Convert back to BGR
-                image.flags.writeable = True
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-                
-                # Prepare data to send
-                data = {
-                    "type": "frame_data",
-                    "timestamp": datetime.now().isoformat(),
-                    "frame_count": self.frame_count,
-                    "reps": self.detector.count,
-                    "stage": self.detector.stage,
-                    "angle": int(self.detector.last_angle),
-                    "posture_state": self.detector.posture_state,
-                    "exercise_type": self.detector.exercise_type,
-                    "pose_detected": False
-                }
-                
-                if results.pose_landmarks:
-                    data["pose_detected"] = True
-                    
-                    # Detect exercise
-                    rep_completed, angle, status = self.detector.detect_exercise(results.pose_landmarks.landmark)
-                    
-                    data.update({
-                        "reps": self.detector.count,
-                        "angle": int(angle),
-                        "stage": status,
-                        "posture_state": self.detector.posture_state,
-                        "rep_completed": rep_completed
-                    })
-                    
-                    # Draw landmarks on image
-                    mp_drawing.draw_landmarks(
-                        image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                        mp_drawing.DrawingSpec(color=(245, 117, 66), thickness=2, circle_radius=2),
-                        mp_drawing.DrawingSpec(color=(245, 66, 230), thickness=2)
-                    )
-                
-                # Encode frame as base64 for web transmission
-                _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                frame_base64 = base64.b64encode(buffer).decode('utf-8')
-                data["frame"] = frame_base64
-                
-                # Send data to frontend
-                try:
-                    await self.websocket.send_text(json.dumps(data))
-                except:
-                    break
-                
-                # Small delay to prevent overwhelming
-                await asyncio.sleep(0.03)  # ~30 FPS
-                
+            await stream_frames(self.capture, self.process_frame, self.websocket.send_bytes,
+                                lambda: self.is_active, interval=0.03)  # ~30 FPS
         except Exception as e:
             print(f"Detection loop error: {e}")
         finally:
             self.cleanup()
+
+    def process_frame(self, frame):
+        """Pose inference, rep counting, drawing and encoding of one frame (runs in the pose executor)"""
+        self.frame_count += 1
+
+        # Flip frame horizontally
+        frame = cv2.flip(frame, 1)
+
+        # Convert to RGB
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+
+        # Process frame
+        results = self.pose.process(image)
+
+        rep_completed = False
+        angle = self.detector.last_angle
+        stage = self.detector.stage
+
+        if results.pose_landmarks:
+            # Detect exercise
+            rep_completed, angle, stage = self.detector.detect_exercise(results.pose_landmarks.landmark)
+
+        state = dict(
+            frame_id=self.frame_count,
+            reps=self.detector.count,
+            stage=stage,
+            angle=angle,
+            posture_state=self.detector.posture_state,
+            pose_detected=results.pose_landmarks is not None,
+            rep_completed=rep_completed
+        )
+
+        # Landmarks-only sessions: the client draws the skeleton over its own video, so skip the
+        # conversion back to BGR, the drawing and the JPEG encoding
+        if self.landmarks_only:
+            return encode_landmarks(results.pose_landmarks.landmark if results.pose_landmarks else None, **state)
+
+        # Convert back to BGR
+        image.flags.writeable = True
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+        if results.pose_landmarks:
+            # Draw landmarks on image
+            mp_drawing.draw_landmarks(
+                image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
+                mp_drawing.DrawingSpec(color=(245, 117, 66), thickness=2, circle_radius=2),
+                mp_drawing.DrawingSpec(color=(245, 66, 230), thickness=2)
+            )
+
+        # Binary frame message: fixed header + raw JPEG bytes
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        return encode_frame(buffer, **state)
     
     def stop_session(self):
         """Stop the session"""
@@ -409,10 +402,13 @@ class ExerciseSession:
     
     def cleanup(self):
         """Clean up resources"""
-        if self.cap:
-            self.cap.release()
+        self.is_active = False
+        if self.capture:
+            release_camera(self.capture)
+            self.capture = None
         if self.pose:
             self.pose.close()
+            self.pose = None
 
 # API Routes
 @app.get("/")
@@ -433,8 +429,10 @@ async def get_exercises():
     return {"exercises": exercises}
 
 @app.get("/camera/test")
-async def test_camera():
-    """Test camera availability"""
+def test_camera():
+    """Test camera availability (sync route, runs in the threadpool)"""
+    if active_camera(0):
+        return {"status": "success", "message": "Camera working (in use by a session)"}
     try:
         cap = cv2.VideoCapture(0)
         if cap.isOpened():
@@ -451,11 +449,11 @@ async def test_camera():
 
 # WebSocket endpoint
 @app.websocket("/ws/exercise/{exercise_type}")
-async def websocket_endpoint(websocket: WebSocket, exercise_type: str):
+async def websocket_endpoint(websocket: WebSocket, exercise_type: str, mode: str = "frames"):
     await websocket.accept()
     
     session_id = f"session_{int(time.time())}"
-    session = ExerciseSession(session_id, exercise_type)
+    session = ExerciseSession(session_id, exercise_type, mode)
     active_sessions[session_id] = session
     
     try:
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Capture / inference / send pipeline shared by the exercise servers.
+
+OpenCV and MediaPipe calls block, so none of them run on the uvicorn event loop:
+- one capture thread per camera reads continuously and keeps only the newest frame,
+  shared by every session on that camera; it wakes the sessions' coroutines through
+  ``loop.call_soon_threadsafe`` instead of having executor threads block waiting for frames
+- each session's frame processing (pose inference, rep counting, drawing, JPEG encoding)
+  runs in the pose executor, one frame in flight per session; nothing else runs there
+- an async sender coroutine awaits the processed messages and sends them; when the socket is
+  slower than processing the stale message is dropped instead of queued
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import cv2
+
+# MediaPipe and OpenCV release the GIL in their native code, so threads run sessions in parallel
+# (a process pool would have to pickle every frame and cannot share a Pose graph).
+POSE_WORKERS = int(os.environ.get("POSE_WORKERS", min(8, (os.cpu_count() or 1) + 2)))
+pose_executor = ThreadPoolExecutor(max_workers=POSE_WORKERS, thread_name_prefix="pose")
+
+# Seconds a session waits for a new camera frame before re-checking whether it is still active
+FRAME_WAIT_TIMEOUT = 1.0
+
+
+class LatestFrameCapture:
+    """Reads a camera on a background thread and keeps only the latest frame"""
+
+    def __init__(self, source=0, width: Optional[int] = None, height: Optional[int] = None,
+                 fps: Optional[int] = None):
+        self.source = source
+        self.users = 0
+        self.frame_id = 0
+        self._frame = None
+        self._lock = threading.Lock()
+        self._listeners = set()
+
+        self.cap = cv2.VideoCapture(source)
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.running = self.cap.isOpened()
+        self._thread = threading.Thread(target=self._run, name=f"capture-{source}", daemon=True)
+        if self.running:
+            self._thread.start()
+        else:
+            self.cap.release()
+
+    def is_opened(self) -> bool:
+        return self.running
+
+    def _run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            with self._lock:
+                self._frame = frame
+                self.frame_id += 1
+            self._notify()
+        self.cap.release()
+
+    def _notify(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Call ``callback()`` from the capture thread after every new frame and when the capture stops"""
+        with self._lock:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback: Callable[[], None]):
+        with self._lock:
+            self._listeners.discard(callback)
+
+    def latest_frame(self, after_id: int = 0):
+        """
+        Return ``(frame_id, frame)`` for the newest frame if its id is above ``after_id``, else None.
+        Does not block. The frame is shared between sessions: do not modify it.
+        """
+        with self._lock:
+            if not self.running or self.frame_id <= after_id:
+                return None
+            return self.frame_id, self._frame
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+        self._notify()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def acquire_camera(source=0, width: Optional[int] = None, height: Optional[int] = None,
+                   fps: Optional[int] = None) -> LatestFrameCapture:
+    """
+    Shared capture of a camera, opened on first use. Blocks while the camera opens, so call it
+    through the loop's default executor from async code (not the pose executor, which is kept for
+    inference). Every call must be paired with ``release_camera``.
+    """
+    with _cameras_lock:
+        capture = _cameras.get(source)
+        if capture is None or not capture.running:
+            capture = LatestFrameCapture(source, width, height, fps)
+            if capture.running:
+                _cameras[source] = capture
+        capture.users += 1
+        return capture
+
+
+def release_camera(capture: LatestFrameCapture):
+    """Drop one user of a shared capture; the camera is closed with its last user"""
+    with _cameras_lock:
+        capture.users -= 1
+        if capture.users > 0:
+            return
+        if _cameras.get(capture.source) is capture:
+            del _cameras[capture.source]
+    capture.stop()
+
+
+def active_camera(source=0) -> Optional[LatestFrameCapture]:
+    """The running shared capture of a camera, if any session holds it"""
+    with _cameras_lock:
+        capture = _cameras.get(source)
+        return capture if capture is not None and capture.running else None
+
+
+async def stream_frames(capture: LatestFrameCapture, process_frame: Callable, send: Callable,
+                        is_active: Callable[[], bool], interval: float = 0.0, frame_skip: int = 1):
+    """
+    Process the newest frames of ``capture`` with ``process_frame(frame)`` in the pose executor and
+    ``await send(message)`` its results from a separate sender coroutine. ``process_frame`` may
+    return None to send nothing for a frame. At most one frame per ``interval`` seconds is
+    processed, and only frames at least ``frame_skip`` ids after the previous one.
+
+    Returns when ``is_active()`` turns false, the camera stops or a send fails.
+    """
+    loop = asyncio.get_running_loop()
+    outbox = asyncio.Queue(maxsize=1)
+    send_failed = asyncio.Event()
+    frame_ready = asyncio.Event()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(frame_ready.set)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    async def next_frame(after_id):
+        item = capture.latest_frame(after_id)
+        if item is None:
+            # Clear before re-checking: a frame arriving after the check schedules a set() after this clear()
+            frame_ready.clear()
+            item = capture.latest_frame(after_id)
+        if item is None:
+            try:
+                await asyncio.wait_for(frame_ready.wait(), FRAME_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            item = capture.latest_frame(after_id)
+        return item
+
+    def post(message):
+        if outbox.full():
+            outbox.get_nowait()
+        outbox.put_nowait(message)
+
+    async def infer():
+        frame_id, next_time = 0, 0.0
+        capture.add_listener(wake)
+        try:
+            while is_active() and not send_failed.is_set():
+                delay = next_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                item = await next_frame(frame_id + frame_skip - 1)
+                if item is None:
+                    if not capture.running:
+                        break
+                    continue
+                frame_id, frame = item
+                next_time = loop.time() + interval
+                message = await loop.run_in_executor(pose_executor, process_frame, frame)
+                if message is not None:
+                    post(message)
+        finally:
+            capture.remove_listener(wake)
+            post(None)
+
+    async def sender():
+        while True:
+            message = await outbox.get()
+            if message is None:
+                return
+            try:
+                await send(message)
+            except Exception:
+                send_failed.set()
+                return
+
+    await asyncio.gather(infer(), sender())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Binary WebSocket frame protocol shared by the exercise servers.
+
+Video frames travel as binary WebSocket messages in both directions: a fixed little-endian
+header followed by the raw JPEG bytes (no base64, no JSON). JSON text messages are only used for
+control messages (session_started, error, get_exercises, reset_counter, ...).
+
+In landmarks-only sessions the server sends MSG_LANDMARKS instead: the same header followed by
+the 33 MediaPipe pose landmarks (when a pose is detected) and no image; the client draws the
+skeleton over its own video.
+
+Header (version 1, 23 bytes):
+    offset  size  field
+    0       1     version        PROTOCOL_VERSION
+    1       1     message type   MSG_FRAME / MSG_LANDMARKS (server -> client), MSG_CLIENT_FRAME (client -> server)
+    2       1     flags          FLAG_POSE_DETECTED | FLAG_REP_COMPLETED | FLAG_HAS_IMAGE | FLAG_HAS_LANDMARKS
+    3       1     stage          index into STAGES
+    4       1     posture        index into POSTURES
+    5       4     frame id       uint32
+    9       8     timestamp      float64, seconds since the epoch
+    17      2     reps           uint16
+    19      4     angle          float32, degrees
+
+Payload, in order: the landmarks block if FLAG_HAS_LANDMARKS (33 x (x, y, z, visibility) int16,
+each value multiplied by LANDMARK_SCALE; x / y are normalised to the mirrored frame), then the
+JPEG if FLAG_HAS_IMAGE.
+
+Keep client/lib/frameProtocol.ts in sync with this module.
+"""
+
+import struct
+import time
+from typing import NamedTuple, Optional, Tuple
+
+PROTOCOL_VERSION = 1
+
+MSG_FRAME = 1
+MSG_CLIENT_FRAME = 2
+MSG_LANDMARKS = 3
+
+FLAG_POSE_DETECTED = 0x01
+FLAG_REP_COMPLETED = 0x02
+FLAG_HAS_IMAGE = 0x04
+FLAG_HAS_LANDMARKS = 0x08
+
+# Unknown values are sent as index 0
+STAGES = ("detecting", "up", "down", "completed", "no_pose", "active", "rest", "error")
+POSTURES = ("good", "ok", "bad")
+
+HEADER = struct.Struct("<BBBBBIdHf")
+
+LANDMARK_COUNT = 33
+LANDMARK_SCALE = 10000  # int16 covers +-3.27 in normalised units
+LANDMARKS = struct.Struct(f"<{LANDMARK_COUNT * 4}h")
+
+
+class FrameMessage(NamedTuple):
+    type: int
+    frame_id: int
+    timestamp: float
+    reps: int
+    stage: str
+    angle: float
+    posture_state: str
+    pose_detected: bool
+    rep_completed: bool
+    image: Optional[bytes]
+    landmarks: Optional[Tuple[Tuple[float, float, float, float], ...]] = None
+
+
+def _index(values, value) -> int:
+    try:
+        return values.index(value)
+    except ValueError:
+        return 0
+
+
+def _quantise(value) -> int:
+    return min(max(int(round(value * LANDMARK_SCALE)), -32768), 32767)
+
+
+def pack_landmarks(landmarks) -> bytes:
+    """Quantise MediaPipe landmarks (objects with x, y, z, visibility) to the int16 block"""
+    values = []
+    for landmark in landmarks:
+        values += (_quantise(landmark.x), _quantise(landmark.y), _quantise(landmark.z),
+                   _quantise(landmark.visibility))
+    if len(values) != LANDMARKS.size // 2:
+        raise ValueError(f"Expected {LANDMARK_COUNT} landmarks, got {len(values) // 4}")
+    return LANDMARKS.pack(*values)
+
+
+def encode_frame(image=None, frame_id: int = 0, reps: int = 0, stage: Optional[str] = None,
+                 angle: float = 0.0, posture_state: Optional[str] = None, pose_detected: bool = False,
+                 rep_completed: bool = False, timestamp: Optional[float] = None,
+                 message_type: int = MSG_FRAME, landmarks=None) -> bytes:
+    """
+    Binary frame message; ``image`` is the encoded JPEG (bytes or a numpy buffer from
+    cv2.imencode), ``landmarks`` the MediaPipe pose landmarks to attach
+    """
+    flags = (FLAG_POSE_DETECTED if pose_detected else 0) | (FLAG_REP_COMPLETED if rep_completed else 0)
+    payload = b""
+    if landmarks is not None:
+        flags |= FLAG_HAS_LANDMARKS
+        payload += pack_landmarks(landmarks)
+    if image is not None:
+        flags |= FLAG_HAS_IMAGE
+        payload += bytes(image)
+    header = HEADER.pack(
+        PROTOCOL_VERSION, message_type, flags, _index(STAGES, stage), _index(POSTURES, posture_state),
+        frame_id & 0xFFFFFFFF, time.time() if timestamp is None else timestamp,
+        min(max(int(reps), 0), 0xFFFF), float(angle)
+    )
+    return header + payload
+
+
+def encode_landmarks(landmarks=None, **state) -> bytes:
+    """Landmarks-only message (no image): rep state plus the pose landmarks, if any"""
+    return encode_frame(message_type=MSG_LANDMARKS, landmarks=landmarks, **state)
+
+
+def decode_frame(message: bytes) -> FrameMessage:
+    """Parse a binary frame message; raises ValueError for a truncated or unsupported message"""
+    if len(message) < HEADER.size:
+        raise ValueError(f"Frame message too short ({len(message)} bytes)")
+    version, message_type, flags, stage, posture, frame_id, timestamp, reps, angle = HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported frame protocol version {version}")
+    offset, landmarks = HEADER.size, None
+    if flags & FLAG_HAS_LANDMARKS:
+        if len(message) < offset + LANDMARKS.size:
+            raise ValueError("Frame message truncated in the landmarks block")
+        values = [v / LANDMARK_SCALE for v in LANDMARKS.unpack_from(message, offset)]
+        landmarks = tuple(tuple(values[i:i + 4]) for i in range(0, len(values), 4))
+        offset += LANDMARKS.size
+    image = bytes(message[offset:]) if flags & FLAG_HAS_IMAGE else None
+    return FrameMessage(
+        type=message_type,
+        frame_id=frame_id,
+        timestamp=timestamp,
+        reps=reps,
+        stage=STAGES[stage] if stage < len(STAGES) else STAGES[0],
+        angle=angle,
+        posture_state=POSTURES[posture] if posture < len(POSTURES) else POSTURES[0],
+        pose_detected=bool(flags & FLAG_POSE_DETECTED),
+        rep_completed=bool(flags & FLAG_REP_COMPLETED),
+        image=image,
+        landmarks=landmarks,
+    )
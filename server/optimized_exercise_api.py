@@ -9,7 +9,6 @@ import mediapipe as mp
 import numpy as np
 import asyncio
 import json
-import base64
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -21,6 +20,9 @@ from datetime import datetime
 from collections import deque
 import logging
 
+from frame_pipeline import acquire_camera, active_camera, pose_executor, release_camera, stream_frames
+from frame_protocol import PROTOCOL_VERSION, encode_frame, encode_landmarks
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -285,12 +287,14 @@ class OptimizedExerciseDetector:
         return False, smoothed_angle, self.stage or "detecting"
 
 class OptimizedExerciseSession:
-    def __init__(self, session_id: str, exercise_type: str):
+    def __init__(self, session_id: str, exercise_type: str, mode: str = "frames"):
         self.session_id = session_id
+        # "landmarks": send only pose landmarks + rep state, no annotated JPEG
+        self.landmarks_only = mode == "landmarks"
         self.detector = OptimizedExerciseDetector(exercise_type)
         self.is_active = False
         self.start_time = None
-        self.cap = None
+        self.capture = None
         self.pose = None
         self.websocket = None
         self.frame_count = 0
@@ -302,9 +306,7 @@ class OptimizedExerciseSession:
         self.frame_width = 480  # Reduced resolution
         self.frame_height = 360
         
-        # Frame buffer for smooth streaming
-        self.frame_buffer = deque(maxlen=3)
-        self.last_send_time = 0
+        # Rate limiting for WebSocket sends
         self.send_interval = 1.0 / self.target_fps
         
     async def start_session(self, websocket: WebSocket):
@@ -313,22 +315,19 @@ class OptimizedExerciseSession:
         self.is_active = True
         self.start_time = datetime.now()
         
+        loop = asyncio.get_running_loop()
         try:
-            # Initialize camera with optimized settings
-            self.cap = cv2.VideoCapture(0)
-            if not self.cap.isOpened():
+            # Shared camera capture thread with optimized settings (opening the camera blocks)
+            self.capture = await loop.run_in_executor(
+                None, acquire_camera, 0, self.frame_width, self.frame_height, 30
+            )
+            if not self.capture.is_opened():
                 await websocket.send_text(json.dumps({
                     "type": "error",
                     "message": "Camera not available"
                 }))
                 return False
             
-            # Optimize camera settings for performance
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
-            self.cap.set(cv2.CAP_PROP_FPS, 30)
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            
             # Initialize MediaPipe with optimized settings
             if not MEDIAPIPE_AVAILABLE:
                 await websocket.send_text(json.dumps({
@@ -337,19 +336,21 @@ class OptimizedExerciseSession:
                 }))
                 return False
             
-            self.pose = mp_pose.Pose(
+            self.pose = await loop.run_in_executor(pose_executor, lambda: mp_pose.Pose(
                 min_detection_confidence=0.6,  # Slightly reduced for performance
                 min_tracking_confidence=0.4,   # Reduced for performance
                 model_complexity=0,            # Use fastest model
                 smooth_landmarks=True,         # Enable smoothing
                 enable_segmentation=False,     # Disable segmentation for speed
                 smooth_segmentation=False
-            )
+            ))
             
             await websocket.send_text(json.dumps({
                 "type": "session_started",
                 "exercise_type": self.detector.exercise_type,
-                "session_id": self.session_id
+                "session_id": self.session_id,
+                "protocol": PROTOCOL_VERSION,
+                "mode": "landmarks" if self.landmarks_only else "frames"
             }))
             
             # Start optimized detection loop
@@ -363,106 +364,81 @@ class OptimizedExerciseSession:
             return False
     
     async def optimized_detection_loop(self):
-        """Highly optimized detection loop with frame skipping and buffering"""
+        """Detection pipeline: capture and inference run off the event loop, rate limited and frame skipping"""
         try:
-            frame_skip_counter = 0
-            last_detection_data = None
-            
-            while self.is_active and self.cap and self.cap.isOpened():
-                ret, frame = self.cap.read()
-                if not ret:
-                    continue
-                
-                self.frame_count += 1
-                frame_skip_counter += 1
-                
-                # Skip frames for performance
-                if frame_skip_counter < self.frame_skip:
-                    continue
-                
-                frame_skip_counter = 0
-                current_time = time.time()
-                
-                # Rate limiting for WebSocket sends
-                if current_time - self.last_send_time < self.send_interval:
-                    continue
-                
-                # Resize frame for performance
-                frame = cv2.resize(frame, (self.frame_width, self.frame_height))
-                frame = cv2.flip(frame, 1)
-                
-                # Convert to RGB (optimized)
-                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                image.flags.writeable = False
-                
-                # Process frame with MediaPipe
-                results = self.pose.process(image)
-                
-                # Convert back to BGR
-                image.flags.writeable = True
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-                
-                # Prepare lightweight data packet
-                data = {
-                    "type": "frame_data",
-                    "timestamp": current_time,
-                    "frame_count": self.frame_count,
-                    "reps": self.detector.count,
-                    "stage": self.detector.stage or "detecting",
-                    "angle": int(self.detector.last_angle),
-                    "posture_state": self.detector.posture_state,
-                    "exercise_type": self.detector.exercise_type,
-                    "pose_detected": False,
-                    "rep_completed": False
-                }
-                
-                if results.pose_landmarks:
-                    data["pose_detected"] = True
-                    
-                    # Detect exercise (optimized)
-                    rep_completed, angle, status = self.detector.detect_exercise(results.pose_landmarks.landmark)
-                    
-                    data.update({
-                        "reps": self.detector.count,
-                        "angle": int(angle),
-                        "stage": status,
-                        "posture_state": self.detector.posture_state,
-                        "rep_completed": rep_completed
-                    })
-                    
-                    # Draw landmarks (simplified for performance)
-                    if self.frame_count % 3 == 0:  # Draw landmarks every 3rd frame
-                        mp_drawing.draw_landmarks(
-                            image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                            mp_drawing.DrawingSpec(color=(245, 117, 66), thickness=1, circle_radius=1),
-                            mp_drawing.DrawingSpec(color=(245, 66, 230), thickness=1)
-                        )
-                
-                # Encode frame with optimized quality
-                encode_params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
-                _, buffer = cv2.imencode('.jpg', image, encode_params)
-                frame_base64 = base64.b64encode(buffer).decode('utf-8')
-                
-                # Only send frame every few iterations to reduce bandwidth
-                if self.frame_count % 2 == 0:
-                    data["frame"] = frame_base64
-                
-                # Send data with error handling
-                try:
-                    await self.websocket.send_text(json.dumps(data))
-                    self.last_send_time = current_time
-                    last_detection_data = data
-                except Exception as e:
-                    logger.error(f"WebSocket send error: {e}")
-                    break
-                
-                # Minimal delay to prevent overwhelming
-                await asyncio.sleep(0.01)
-                
+            await stream_frames(self.capture, self.process_frame, self.send_frame, lambda: self.is_active,
+                                interval=self.send_interval, frame_skip=self.frame_skip)
         except Exception as e:
             logger.error(f"Detection loop error: {e}")
         finally:
             self.cleanup()
+
+    def process_frame(self, frame):
+        """Pose inference, rep counting, drawing and encoding of one frame (runs in the pose executor)"""
+        self.frame_count += 1
+
+        # Resize frame for performance
+        frame = cv2.resize(frame, (self.frame_width, self.frame_height))
+        frame = cv2.flip(frame, 1)
+
+        # Convert to RGB (optimized)
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+
+        # Process frame with MediaPipe
+        results = self.pose.process(image)
+
+        rep_completed = False
+        angle = self.detector.last_angle
+        stage = self.detector.stage
+
+        if results.pose_landmarks:
+            # Detect exercise (optimized)
+            rep_completed, angle, stage = self.detector.detect_exercise(results.pose_landmarks.landmark)
+
+        state = dict(
+            frame_id=self.frame_count,
+            reps=self.detector.count,
+            stage=stage,
+            angle=angle,
+            posture_state=self.detector.posture_state,
+            pose_detected=results.pose_landmarks is not None,
+            rep_completed=rep_completed
+        )
+
+        # Landmarks-only sessions: the client draws the skeleton over its own video, so skip the
+        # conversion back to BGR, the drawing and the JPEG encoding
+        if self.landmarks_only:
+            return encode_landmarks(results.pose_landmarks.landmark if results.pose_landmarks else None, **state)
+
+        # Convert back to BGR
+        image.flags.writeable = True
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+        if results.pose_landmarks:
+            # Draw landmarks (simplified for performance)
+            if self.frame_count % 3 == 0:  # Draw landmarks every 3rd frame
+                mp_drawing.draw_landmarks(
+                    image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
+                    mp_drawing.DrawingSpec(color=(245, 117, 66), thickness=1, circle_radius=1),
+                    mp_drawing.DrawingSpec(color=(245, 66, 230), thickness=1)
+                )
+
+        # Only send (and encode) the frame every few iterations to reduce bandwidth
+        buffer = None
+        if self.frame_count % 2 == 0:
+            _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+
+        # Lightweight binary packet: fixed header + raw JPEG bytes
+        return encode_frame(buffer, **state)
+
+    async def send_frame(self, message: bytes):
+        """Send one binary frame packet; a failure ends the pipeline"""
+        try:
+            await self.websocket.send_bytes(message)
+        except Exception as e:
+            logger.error(f"WebSocket send error: {e}")
+            raise
     
     def stop_session(self):
         """Stop the session"""
@@ -470,10 +446,13 @@ class OptimizedExerciseSession:
     
     def cleanup(self):
         """Clean up resources"""
-        if self.cap:
-            self.cap.release()
+        self.is_active = False
+        if self.capture:
+            release_camera(self.capture)
+            self.capture = None
         if self.pose:
             self.pose.close()
+            self.pose = None
 
 # API Routes (same as before but with optimized session class)
 @app.get("/")
@@ -483,7 +462,7 @@ async def root():
         "status": "running", 
         "mediapipe": MEDIAPIPE_AVAILABLE,
         "version": "2.0.0",
-        "optimizations": ["frame_skipping", "reduced_resolution", "optimized_pose_model", "rate_limiting"]
+        "optimizations": ["frame_skipping", "reduced_resolution", "optimized_pose_model", "rate_limiting", "landmarks_mode"]
     }
 
 @app.get("/exercises")
@@ -500,8 +479,10 @@ async def get_exercises():
     return {"exercises": exercises}
 
 @app.get("/camera/test")
-async def test_camera():
-    """Test camera availability"""
+def test_camera():
+    """Test camera availability (sync route, runs in the threadpool)"""
+    if active_camera(0):
+        return {"status": "success", "message": "Camera working (in use by a session)"}
     try:
         cap = cv2.VideoCapture(0)
         if cap.isOpened():
@@ -535,11 +516,11 @@ async def get_performance_info():
 
 # Optimized WebSocket endpoint
 @app.websocket("/ws/exercise/{exercise_type}")
-async def websocket_endpoint(websocket: WebSocket, exercise_type: str):
+async def websocket_endpoint(websocket: WebSocket, exercise_type: str, mode: str = "frames"):
     await websocket.accept()
     
     session_id = f"session_{int(time.time())}"
-    session = OptimizedExerciseSession(session_id, exercise_type)
+    session = OptimizedExerciseSession(session_id, exercise_type, mode)
     active_sessions[session_id] = session
     
     try:
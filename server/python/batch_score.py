@@ -0,0 +1,261 @@
+"""
+Offline batch scoring of image folders and tar shards with MedViT.
+
+Images are streamed from a directory tree or a tar shard (read sequentially, never extracted),
+decoded and preprocessed by a thread pool, grouped into fixed-size batches and classified with
+the same ``get_model`` / ``preprocess_image`` / ``CLASS_LABELS`` as the API. Predictions are written
+incrementally to CSV or Parquet; rerunning the same command resumes after the rows already
+written.
+
+    python batch_score.py --input data/archive --output scores.csv --dataset PathMNIST
+    python batch_score.py --input shard-000.tar --output scores_parquet/ --format parquet
+
+Parquet output is a directory of part files, each closed after ``--flush-rows`` rows so that an
+interrupted run never leaves a partial file behind.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.nn.functional as F
+
+from quantization import IMAGE_EXTENSIONS, list_images
+
+COLUMNS = ['path', 'label', 'prediction', 'confidence', 'top_k', 'error']
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def iter_directory(folder):
+    """Yield ``(key, label, read_bytes)`` for every image below ``folder``"""
+    for path, label in list_images(folder):
+        yield path, label, lambda path=path: _read_file(path)
+
+
+def iter_tar(path):
+    """Yield ``(key, label, read_bytes)`` for every image in a tar shard, read as a stream"""
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            data = tar.extractfile(member).read()
+            label = os.path.basename(os.path.dirname(member.name)) or None
+            yield member.name, label, lambda data=data: data
+
+
+class CsvWriter(object):
+    def __init__(self, path):
+        self.path = path
+
+    def done_keys(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, 'rb+') as f:
+            # Drop a partially written last line
+            content = f.read()
+            end = content.rfind(b'\n') + 1
+            f.truncate(end)
+        with open(self.path, newline='') as f:
+            return {row['path'] for row in csv.DictReader(f)}
+
+    def open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(object):
+    def __init__(self, path, flush_rows=4096):
+        self.path = path
+        self.flush_rows = flush_rows
+        self._rows = []
+
+    def done_keys(self):
+        import pyarrow.parquet as pq
+
+        keys = set()
+        for part in sorted(glob.glob(os.path.join(self.path, 'part-*.parquet'))):
+            keys.update(pq.read_table(part, columns=['path']).column('path').to_pylist())
+        return keys
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._part = len(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_rows:
+            self._flush()
+
+    def close(self):
+        self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._rows:
+            return
+        table = pa.Table.from_pylist(self._rows)
+        final_path = os.path.join(self.path, f'part-{self._part:05d}.parquet')
+        pq.write_table(table, final_path + '.tmp')
+        os.replace(final_path + '.tmp', final_path)
+        self._part += 1
+        self._rows = []
+
+
+class Throughput(object):
+    """Images/s plus time spent waiting for preprocessing vs running the model"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.images = 0
+        self.errors = 0
+        self.wait_seconds = 0.0
+        self.model_seconds = 0.0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            'images': self.images,
+            'errors': self.errors,
+            'seconds': elapsed,
+            'images_per_second': self.images / elapsed if elapsed else 0.0,
+            'preprocess_wait_seconds': self.wait_seconds,
+            'model_seconds': self.model_seconds,
+        }
+
+
+def score(source, writer, model, class_labels, preprocess, image_size=224, batch_size=32, workers=4,
+          top_k=5, report_every=10):
+    """Run the streaming pipeline; returns the throughput report"""
+    done = writer.done_keys()
+    if done:
+        print(f"✓ Resuming: {len(done)} images already scored")
+    writer.open()
+    stats = Throughput()
+    correct = labelled = 0
+
+    def load(key, read_bytes):
+        try:
+            return preprocess(read_bytes(), image_size), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def run_batch(batch):
+        nonlocal correct, labelled
+        rows, tensors = [], []
+        for key, label, future in batch:
+            start = time.perf_counter()
+            tensor, error = future.result()
+            stats.wait_seconds += time.perf_counter() - start
+            rows.append({'path': key, 'label': label, 'prediction': None, 'confidence': None,
+                         'top_k': None, 'error': error})
+            if tensor is not None:
+                tensors.append(tensor)
+        if tensors:
+            start = time.perf_counter()
+            x = torch.cat(tensors, dim=0)
+            if len(tensors) < batch_size:
+                # Keep the batch shape fixed (e.g. for compiled models); padding rows are discarded
+                x = torch.cat([x, x.new_zeros(batch_size - len(tensors), *x.shape[1:])])
+            with torch.no_grad():
+                probs = F.softmax(model(x)[:len(tensors)], dim=1)
+            top_probs, top_indices = torch.topk(probs, min(top_k, probs.shape[1]), dim=1)
+            stats.model_seconds += time.perf_counter() - start
+            predictions = iter(zip(top_probs.tolist(), top_indices.tolist()))
+            for row in rows:
+                if row['error'] is not None:
+                    continue
+                row_probs, row_indices = next(predictions)
+                names = [class_labels[i] if i < len(class_labels) else f"Class {i}" for i in row_indices]
+                row['prediction'] = names[0]
+                row['confidence'] = row_probs[0] * 100
+                row['top_k'] = json.dumps([[name, p * 100] for name, p in zip(names, row_probs)])
+                if row['label'] in class_labels:
+                    labelled += 1
+                    correct += row['label'] == names[0]
+        writer.write(rows)
+        stats.images += len(rows)
+        stats.errors += sum(row['error'] is not None for row in rows)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Bounded read-ahead: at most two batches are being decoded ahead of the model
+            pending = deque()
+            batches_run = 0
+            for key, label, read_bytes in source:
+                if key in done:
+                    continue
+                pending.append((key, label, pool.submit(load, key, read_bytes)))
+                if len(pending) >= 2 * batch_size:
+                    run_batch([pending.popleft() for _ in range(batch_size)])
+                    batches_run += 1
+                    if batches_run % report_every == 0:
+                        report = stats.report()
+                        print(f"  {report['images']} images, {report['images_per_second']:.1f} img/s")
+            while pending:
+                run_batch([pending.popleft() for _ in range(min(batch_size, len(pending)))])
+    finally:
+        writer.close()
+
+    report = stats.report()
+    if labelled:
+        report['accuracy'] = correct / labelled
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score an image folder or tar shard with MedViT')
+    parser.add_argument('--input', required=True, help='image folder or .tar / .tar.gz shard')
+    parser.add_argument('--output', required=True, help='.csv file, or directory for --format parquet')
+    parser.add_argument('--format', default=None, choices=['csv', 'parquet'],
+                        help='defaults to csv unless --output has no .csv extension')
+    parser.add_argument('--dataset', default='PathMNIST')
+    parser.add_argument('--model-type', default='MedViT-Large')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4, help='decode / preprocess threads')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--flush-rows', type=int, default=4096, help='rows per Parquet part file')
+    args = parser.parse_args()
+
+    from medvit_api import CLASS_LABELS, get_model, preprocess_image
+
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'parquet')
+    writer = CsvWriter(args.output) if output_format == 'csv' else ParquetWriter(args.output, args.flush_rows)
+    source = iter_directory(args.input) if os.path.isdir(args.input) else iter_tar(args.input)
+
+    class_labels = CLASS_LABELS.get(args.dataset, [f"Class {i}" for i in range(10)])
+    model = get_model(args.model_type, len(class_labels), dataset=args.dataset)
+    report = score(source, writer, model, class_labels, preprocess_image, args.image_size, args.batch_size,
+                   args.workers, args.top_k)
+
+    print("=" * 60)
+    print(f"Batch scoring - {args.model_type} / {args.dataset} -> {args.output}")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Dynamic micro-batching for MedViT inference.
+
+Requests that share a key (model type, dataset and image size) are queued and gathered into a
+single batch, up to ``max_batch_size`` images or until ``max_wait_ms`` has passed since the first
+queued request. One forward pass is run per batch and each caller receives its own top-k slice.
+A key's queue and worker threads are removed after ``idle_timeout`` seconds without requests.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+
+def top_k_predictions(outputs, top_ks):
+    """Default postprocessing: softmax over logits and each request's top-k ``(probs, indices)`` lists"""
+    probs = F.softmax(outputs, dim=1)
+    max_k = min(max(top_ks), probs.shape[1])
+    top_probs, top_indices = torch.topk(probs, max_k, dim=1)
+    top_probs, top_indices = top_probs.tolist(), top_indices.tolist()
+    return [(top_probs[i][:k], top_indices[i][:k]) for i, k in enumerate(top_ks)]
+
+
+class _Request(object):
+    __slots__ = ('tensor', 'top_k', 'future')
+
+    def __init__(self, tensor, top_k):
+        self.tensor = tensor
+        self.top_k = top_k
+        self.future = Future()
+
+
+class MicroBatcher(object):
+    """
+    Batching scheduler in front of a model loader.
+
+    :param load_model: callable taking a key and returning the model to run for that key.
+    :param max_batch_size: maximum number of images per forward pass.
+    :param max_wait_ms: maximum time the first request of a batch waits for more requests.
+    :param concurrency: number of batches per key that may run at the same time, e.g. one per
+        inference worker process.
+    :param collate: callable turning the list of queued tensors into one model input batch,
+        defaults to concatenating ``(1, 3, H, W)`` tensors.
+    :param postprocess: callable taking the batch outputs and the requests' ``top_k`` values and
+        returning one result per request, defaults to ``top_k_predictions``.
+    :param idle_timeout: seconds without requests after which a key's worker threads exit.
+    """
+
+    def __init__(self, load_model, max_batch_size=8, max_wait_ms=10, concurrency=1, collate=None,
+                 postprocess=top_k_predictions, idle_timeout=60.0):
+        self.load_model = load_model
+        self.collate = collate or (lambda tensors: torch.cat(tensors, dim=0))
+        self.postprocess = postprocess
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self.idle_timeout = idle_timeout
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.requests_served = 0
+
+    def submit(self, key, tensor, top_k):
+        """
+        Queue a preprocessed tensor (``(1, 3, H, W)`` with the default collate). Returns a Future resolving to
+        this request's result, ``(top_probs, top_indices)`` lists with the default postprocessing.
+        """
+        request = _Request(tensor, top_k)
+        # Under the lock, so an idle worker cannot retire the queue between lookup and put
+        with self._lock:
+            self._get_queue(key).put(request)
+        return request.future
+
+    def predict(self, key, tensor, top_k, timeout=None):
+        """Blocking convenience wrapper around ``submit``"""
+        return self.submit(key, tensor, top_k).result(timeout=timeout)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'concurrency': self.concurrency,
+            'active_queues': len(self._queues),
+            'batches_run': self.batches_run,
+            'requests_served': self.requests_served,
+            'avg_batch_size': self.requests_served / self.batches_run if self.batches_run else 0.0,
+        }
+
+    def _get_queue(self, key):
+        """Queue of ``key``, started with its worker threads on first use; call with the lock held"""
+        if key not in self._queues:
+            q = queue.Queue()
+            for i in range(self.concurrency):
+                worker = threading.Thread(target=self._worker, args=(key, q), daemon=True,
+                                          name='medvit-batcher-{}-{}'.format(key, i))
+                worker.start()
+            self._queues[key] = q
+        return self._queues[key]
+
+    def _retire(self, key, q):
+        """Whether an idle worker of ``q`` should exit; drops the queue once it is empty"""
+        with self._lock:
+            if self._queues.get(key) is q and q.empty():
+                del self._queues[key]
+            return self._queues.get(key) is not q
+
+    def _gather(self, key, q):
+        while True:
+            try:
+                batch = [q.get(timeout=self.idle_timeout)]
+                break
+            except queue.Empty:
+                if self._retire(key, q):
+                    return None
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, key, q):
+        while True:
+            batch = self._gather(key, q)
+            if batch is None:
+                return
+            try:
+                model = self.load_model(key)
+                with torch.no_grad():
+                    outputs = model(self.collate([r.tensor for r in batch]))
+                    results = self.postprocess(outputs, [r.top_k for r in batch])
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches_run += 1
+                self.requests_served += len(batch)
+            for r, result in zip(batch, results):
+                r.future.set_result(result)
@@ -0,0 +1,107 @@
+"""
+End-to-end CPU latency benchmark for MedViT inference modes.
+
+Every mode starts from the same BN-folded model. Speedups are relative to the first mode listed and
+logit differences are measured against the NCHW eager model, relative to its largest logit.
+
+Usage:
+    python benchmark_medvit.py --model-type MedViT-Small --batch-sizes 1 8 --modes eager channels_last
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from checkpoint_loading import MODEL_BUILDERS
+
+
+def prepare_eager(model):
+    return model
+
+
+def prepare_channels_last(model):
+    return model.to_channels_last()
+
+
+def prepare_inference(model):
+    return model.to_inference()
+
+
+def prepare_inference_channels_last(model):
+    return model.to_inference().to_channels_last()
+
+
+MODES = {
+    'eager': prepare_eager,
+    'channels_last': prepare_channels_last,
+    'inference': prepare_inference,
+    'inference_channels_last': prepare_inference_channels_last,
+}
+
+
+@torch.no_grad()
+def time_model(model, x, warmup=3, iterations=10):
+    """Median seconds per forward pass"""
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+@torch.no_grad()
+def benchmark(model, modes, batch_sizes, image_size=224, warmup=3, iterations=10):
+    """Return one result dict per (mode, batch size)"""
+    model.eval()
+    model.merge_bn()
+    results = []
+    prepared = {mode: MODES[mode](copy.deepcopy(model)) for mode in modes}
+    for batch_size in batch_sizes:
+        x = torch.randn(batch_size, 3, image_size, image_size)
+        reference = model(x)
+        baseline = None
+        for mode, prepared_model in prepared.items():
+            seconds = time_model(prepared_model, x, warmup, iterations)
+            baseline = baseline or seconds
+            rel_diff = ((prepared_model(x) - reference).abs().max() / reference.abs().max()).item()
+            results.append({
+                'mode': mode,
+                'batch_size': batch_size,
+                'ms_per_batch': seconds * 1000.0,
+                'images_per_second': batch_size / seconds,
+                'speedup': baseline / seconds,
+                'rel_diff': rel_diff,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MedViT CPU inference modes')
+    parser.add_argument('--model-type', default='MedViT-Small', choices=list(MODEL_BUILDERS))
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = MODEL_BUILDERS[args.model_type]()
+    results = benchmark(model, args.modes, args.batch_sizes, args.image_size, args.warmup, args.iterations)
+
+    print("=" * 60)
+    print(f"{args.model_type} @ {args.image_size}px, {torch.get_num_threads()} threads")
+    print("=" * 60)
+    for r in results:
+        print(f"  {r['mode']:<24} batch {r['batch_size']:>3}: {r['ms_per_batch']:8.1f} ms "
+              f"({r['images_per_second']:6.1f} img/s, x{r['speedup']:.2f}, rel diff {r['rel_diff']:.1e})")
+
+
+if __name__ == '__main__':
+    main()
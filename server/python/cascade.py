@@ -0,0 +1,182 @@
+"""
+Small-to-large MedViT confidence cascade.
+
+An image is first classified by MedViT-Small. If the top-1 softmax margin (top-1 minus top-2
+probability) reaches the threshold for that dataset and stage, its prediction is returned;
+otherwise the image is escalated to MedViT-Base and finally MedViT-Large, which always answers.
+
+Thresholds are stored as JSON, ``{dataset: {model_type: threshold}}``, and can be fitted on a
+labelled image folder (one sub-folder per class) with:
+    python cascade.py --images data/pathmnist_val --dataset PathMNIST --output checkpoints/cascade_thresholds.json
+"""
+import argparse
+import json
+import os
+
+import torch
+
+CASCADE_STAGES = ('MedViT-Small', 'MedViT-Base', 'MedViT-Large')
+DEFAULT_THRESHOLD = 0.5
+
+
+def top1_margin(top_probs):
+    """Difference between the two highest probabilities (the top-1 probability for 1-class heads)"""
+    return top_probs[0] - (top_probs[1] if len(top_probs) > 1 else 0.0)
+
+
+class CascadeThresholds(object):
+    """Per-dataset, per-stage margin thresholds, optionally loaded from a JSON file"""
+
+    def __init__(self, path=None, default=DEFAULT_THRESHOLD):
+        self.path = path
+        self.default = default
+        self.thresholds = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.thresholds = json.load(f)
+            print(f"✓ Loaded cascade thresholds for {len(self.thresholds)} datasets from {path}")
+
+    def get(self, dataset, model_type):
+        return self.thresholds.get(dataset, {}).get(model_type, self.default)
+
+    def stats(self):
+        return {'path': self.path, 'default': self.default, 'datasets': sorted(self.thresholds)}
+
+
+def run_cascade(predict_stage, dataset, thresholds, stages=CASCADE_STAGES):
+    """
+    Run ``predict_stage(model_type)`` -> ``(top_probs, top_indices)`` for each stage until one is
+    confident enough. Returns ``(top_probs, top_indices, info)`` where ``info`` describes the
+    answering stage and the margin observed at every stage that ran.
+    """
+    margins = []
+    for index, model_type in enumerate(stages):
+        top_probs, top_indices = predict_stage(model_type)
+        margins.append(top1_margin(top_probs))
+        if index == len(stages) - 1 or margins[-1] >= thresholds.get(dataset, model_type):
+            break
+    info = {
+        'stage': model_type,
+        'stage_index': index,
+        'stages_run': list(stages[:index + 1]),
+        'margins': margins,
+    }
+    return top_probs, top_indices, info
+
+
+def fit_threshold(margins, correct, reference_correct, max_accuracy_drop=0.01):
+    """
+    Smallest margin threshold for which the images a stage would answer are classified at most
+    ``max_accuracy_drop`` worse than the reference (final-stage) model classifies the same images.
+    Returns ``None`` when no threshold qualifies, i.e. the stage should always escalate.
+    """
+    order = torch.argsort(margins, descending=True)
+    margins, correct, reference_correct = margins[order], correct[order].float(), reference_correct[order].float()
+    counts = torch.arange(1, len(margins) + 1, dtype=torch.float32)
+    accuracy = correct.cumsum(0) / counts
+    reference_accuracy = reference_correct.cumsum(0) / counts
+
+    best = None
+    for i in range(len(margins)):
+        # Only cut between distinct margins, otherwise the threshold would accept more than i + 1 images
+        if i + 1 < len(margins) and margins[i + 1] == margins[i]:
+            continue
+        if accuracy[i] >= reference_accuracy[i] - max_accuracy_drop:
+            best = margins[i].item()
+    return best
+
+
+@torch.no_grad()
+def calibrate(models, batches, target, max_accuracy_drop=0.01):
+    """
+    Fit thresholds for every stage but the last. ``models`` maps model_type -> model, in cascade
+    order. Returns ``(thresholds, report)``.
+    """
+    import time
+
+    probs, seconds = {}, {}
+    for model_type, model in models.items():
+        start = time.perf_counter()
+        probs[model_type] = torch.cat([model(batch).softmax(dim=1) for batch in batches])
+        seconds[model_type] = time.perf_counter() - start
+
+    stages = list(models)
+    correct = {model_type: p.argmax(1) == target for model_type, p in probs.items()}
+    reference = correct[stages[-1]]
+
+    thresholds, report = {}, {'images': len(target)}
+    remaining = torch.ones(len(target), dtype=torch.bool)
+    answered = torch.zeros(len(target), dtype=torch.bool)
+    cascade_seconds = 0.0
+    for model_type in stages:
+        report[f'{model_type}_accuracy'] = correct[model_type].float().mean().item()
+        cascade_seconds += seconds[model_type] * remaining.float().mean().item()
+        if model_type == stages[-1]:
+            thresholds[model_type] = 0.0
+            answered |= remaining & correct[model_type]
+            report[f'{model_type}_answered'] = remaining.float().mean().item()
+            break
+        top2 = torch.topk(probs[model_type], min(2, probs[model_type].shape[1]), dim=1).values
+        margins = top2[:, 0] - (top2[:, 1] if top2.shape[1] > 1 else 0.0)
+        threshold = fit_threshold(margins[remaining], correct[model_type][remaining], reference[remaining],
+                                  max_accuracy_drop)
+        # A threshold above any possible margin sends everything to the next stage
+        thresholds[model_type] = threshold if threshold is not None else 1.01
+        accepted = remaining & (margins >= thresholds[model_type])
+        answered |= accepted & correct[model_type]
+        report[f'{model_type}_answered'] = accepted.float().mean().item()
+        remaining &= ~accepted
+
+    report['cascade_accuracy'] = answered.float().mean().item()
+    report['cascade_seconds'] = cascade_seconds
+    report[f'{stages[-1]}_seconds'] = seconds[stages[-1]]
+    return thresholds, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit MedViT cascade thresholds on a labelled image folder')
+    parser.add_argument('--images', required=True, help='image folder with one sub-folder per class')
+    parser.add_argument('--dataset', default='PathMNIST')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help='allowed accuracy loss of early answers relative to MedViT-Large')
+    parser.add_argument('--output', default=os.path.join('checkpoints', 'cascade_thresholds.json'))
+    args = parser.parse_args()
+
+    from medvit_api import CLASS_LABELS, get_model, preprocess_image
+    from quantization import list_images, load_batches
+
+    class_labels = CLASS_LABELS.get(args.dataset)
+    items = list_images(args.images)
+    if not items:
+        raise SystemExit(f"No images found in {args.images}")
+    if not class_labels or not all(label in class_labels for _, label in items):
+        raise SystemExit(f"Sub-folder names must be {args.dataset} class labels: {class_labels}")
+
+    target = torch.tensor([class_labels.index(label) for _, label in items])
+    batches = load_batches(items, preprocess_image, args.image_size, args.batch_size)
+    models = {model_type: get_model(model_type, len(class_labels), dataset=args.dataset)
+              for model_type in CASCADE_STAGES}
+    thresholds, report = calibrate(models, batches, target, args.max_accuracy_drop)
+
+    existing = {}
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            existing = json.load(f)
+    existing[args.dataset] = thresholds
+    with open(args.output, 'w') as f:
+        json.dump(existing, f, indent=2)
+
+    print("=" * 60)
+    print(f"Cascade thresholds - {args.dataset}")
+    print("=" * 60)
+    for model_type, threshold in thresholds.items():
+        print(f"  {model_type}: {threshold:.4f}")
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+    print(f"✓ Wrote thresholds to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Fast MedViT checkpoint loading.
+
+The regular path builds a MedViT with random initialisation and then overwrites every weight with
+``torch.load`` + ``load_state_dict``. The fast path here:
+
+    * builds the model on the meta device, so no memory is allocated or initialised up front,
+    * loads the checkpoint memory-mapped (``torch.load(mmap=True)`` or safetensors), and
+    * assigns the mapped tensors directly to the module (``load_state_dict(assign=True)``).
+
+Worker processes that map the same file share its pages through the OS page cache as long as the
+weights are not written to. BatchNorm folding writes to most weights, so ``convert`` can store a
+snapshot that is already BN-folded; loading it only rebuilds the folded module structure.
+
+Usage (convert a downloaded checkpoint to a BN-folded safetensors snapshot):
+    python checkpoint_loading.py --model-type MedViT-Large \\
+        --input checkpoints/medvit_large_imagenet.pth --output checkpoints/medvit_large_imagenet.safetensors
+"""
+import argparse
+import os
+
+import torch
+
+from MedViT import MedViT_base, MedViT_large, MedViT_small
+
+MODEL_BUILDERS = {
+    'MedViT-Small': MedViT_small,
+    'MedViT-Base': MedViT_base,
+    'MedViT-Large': MedViT_large,
+}
+
+
+def _unwrap(checkpoint):
+    if 'model' in checkpoint:
+        return checkpoint['model']
+    if 'state_dict' in checkpoint:
+        return checkpoint['state_dict']
+    return checkpoint
+
+
+def read_state_dict(path, mmap=True):
+    """
+    Read a ``.pth`` or ``.safetensors`` checkpoint. Returns ``(state_dict, bn_merged)`` where
+    ``bn_merged`` tells whether the weights were saved from a BN-folded model.
+    """
+    if path.endswith('.safetensors'):
+        from safetensors import safe_open
+        from safetensors.torch import load_file
+
+        with safe_open(path, framework='pt') as f:
+            metadata = f.metadata() or {}
+        return load_file(path), metadata.get('bn_merged') == 'true'
+
+    try:
+        checkpoint = torch.load(path, map_location='cpu', mmap=mmap, weights_only=True)
+    except Exception:
+        # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+        checkpoint = torch.load(path, map_location='cpu')
+    bn_merged = bool(checkpoint.get('bn_merged', False)) if isinstance(checkpoint, dict) else False
+    return _unwrap(checkpoint), bn_merged
+
+
+def _materialize_missing(model):
+    """Allocate and initialise any parameters / buffers the checkpoint did not provide"""
+    materialized = []
+    for name, module in model.named_modules():
+        tensors = list(module.parameters(recurse=False)) + list(module.buffers(recurse=False))
+        if any(t.is_meta for t in tensors):
+            module.to_empty(device='cpu', recurse=False)
+            if hasattr(module, 'reset_parameters'):
+                module.reset_parameters()
+            materialized.append(name)
+    return materialized
+
+
+def build_from_checkpoint(build_model, path, mmap=True):
+    """
+    Build a MedViT on the meta device and assign the (memory-mapped) checkpoint tensors to it.
+
+    :param build_model: callable returning an uninitialised MedViT, called with ``init_weights=False``.
+    """
+    state_dict, bn_merged = read_state_dict(path, mmap=mmap)
+    with torch.device('meta'):
+        model = build_model(init_weights=False)
+        if bn_merged:
+            # Only the module structure changes here; the folded values come from the checkpoint
+            model.merge_bn()
+    model.load_state_dict(state_dict, strict=False, assign=True)
+
+    materialized = _materialize_missing(model)
+    if materialized:
+        print(f"⚠ Warning: {len(materialized)} modules were not in the checkpoint and were freshly initialised")
+    return model.eval()
+
+
+@torch.no_grad()
+def convert(model_type, input_path, output_path, merge_bn=True):
+    """Convert a checkpoint to safetensors (or zipfile ``.pth``), optionally BN-folded"""
+    model = MODEL_BUILDERS[model_type](init_weights=False)
+    state_dict, bn_merged = read_state_dict(input_path, mmap=False)
+    model.load_state_dict(state_dict, strict=False)
+    model.eval()
+    if merge_bn and not bn_merged:
+        model.merge_bn()
+    bn_merged = model.is_bn_merged
+
+    state_dict = {k: v.contiguous() for k, v in model.state_dict().items()}
+    if output_path.endswith('.safetensors'):
+        from safetensors.torch import save_file
+        save_file(state_dict, output_path, metadata={'model_type': model_type,
+                                                      'bn_merged': 'true' if bn_merged else 'false'})
+    else:
+        torch.save({'model': state_dict, 'bn_merged': bn_merged}, output_path)
+    print(f"✓ Wrote {'BN-folded ' if bn_merged else ''}{model_type} checkpoint to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert MedViT checkpoints for fast loading')
+    parser.add_argument('--model-type', required=True, choices=list(MODEL_BUILDERS))
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--output', required=True, help='.safetensors or .pth')
+    parser.add_argument('--no-merge-bn', action='store_true', help='keep BatchNorm layers unfolded')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        raise SystemExit(f"Checkpoint not found: {args.input}")
+    convert(args.model_type, args.input, args.output, merge_bn=not args.no_merge_bn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+torch.compile (inductor, CPU) for MedViT serving.
+
+The backbone's ``forward_features`` is compiled once per backbone and shared by every dataset head;
+heads are single linear layers and stay eager. Dynamo guards specialise the graph per input size
+and recompile with a dynamic batch dimension the first time a second batch size is seen, so
+``warm_up`` runs batch size 1 and the batcher's maximum for every served image size.
+
+Compiled kernels are cached on disk (inductor FX graph cache) in the configured cache directory,
+so a restarted server reuses them instead of generating and compiling C++ again. If compilation
+fails the model keeps serving in eager mode.
+"""
+import os
+import time
+
+import torch
+
+
+def configure_cache(cache_dir):
+    """Persist inductor's compiled artefacts in ``cache_dir``; call before the first compilation"""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ['TORCHINDUCTOR_CACHE_DIR'] = cache_dir
+    import torch._inductor.config as inductor_config
+
+    if hasattr(inductor_config, 'fx_graph_cache'):
+        inductor_config.fx_graph_cache = True
+
+
+class CompiledForward(object):
+    """``torch.compile``-d callable that falls back to the eager function if compilation fails"""
+
+    def __init__(self, forward, mode=None, dynamic=None):
+        self.eager = forward
+        self.compiled = torch.compile(forward, backend='inductor', mode=mode, dynamic=dynamic)
+        self.error = None
+
+    def __call__(self, x, **kwargs):
+        if self.error is None:
+            try:
+                return self.compiled(x, **kwargs)
+            except Exception as e:
+                # Errors the eager model raises too (e.g. bad inputs) keep the compiled path
+                output = self.eager(x, **kwargs)
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"⚠ Warning: torch.compile failed, falling back to eager mode: {self.error}")
+                return output
+        return self.eager(x, **kwargs)
+
+    def stats(self):
+        return {'compiled': self.error is None, 'error': self.error}
+
+
+def compile_backbone(backbone, mode=None, dynamic=None):
+    """Replace ``backbone.forward_features`` with a compiled version (idempotent)"""
+    if not isinstance(backbone.forward_features, CompiledForward):
+        backbone.forward_features = CompiledForward(backbone.forward_features, mode=mode, dynamic=dynamic)
+    return backbone
+
+
+@torch.no_grad()
+def warm_up(model, image_sizes, batch_sizes=(1,)):
+    """Run ``model`` once per (image size, batch size) so compilation happens before serving"""
+    timings = {}
+    for image_size in image_sizes:
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            model(torch.randn(batch_size, 3, image_size, image_size))
+            timings[(image_size, batch_size)] = time.perf_counter() - start
+    return timings
@@ -0,0 +1,264 @@
+"""
+Early-exit classifier heads at MedViT stage boundaries.
+
+Small heads (LayerNorm + Linear on the pooled stage output) sit after stages 0-2, at
+``stage_out_idx``. At inference the trunk runs block by block; at each boundary with a head, the
+images whose top-1 softmax confidence reaches that exit's threshold are answered there and only
+the remaining images continue through the deeper blocks. Images that never exit get the final
+``proj_head`` / dataset head prediction.
+
+Heads are distilled from the served model's final head (plus cross-entropy when the folders are
+labelled) on pooled stage features, so fitting only needs one trunk pass over the images:
+    python early_exit.py --images data/pathmnist_val --dataset PathMNIST --model-type MedViT-Large
+
+The heads and thresholds are written to ``<checkpoint stem>_<dataset>_exits.pth`` next to the
+checkpoints, where ``medvit_api.py`` picks them up when EARLY_EXIT is enabled.
+"""
+import argparse
+import os
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+EXIT_STAGES = (0, 1, 2)
+
+
+class ExitHead(nn.Module):
+    def __init__(self, in_channels, num_classes):
+        super(ExitHead, self).__init__()
+        self.norm = nn.LayerNorm(in_channels)
+        self.fc = nn.Linear(in_channels, num_classes)
+
+    def forward(self, x):
+        """``x`` is a ``(B, C, H, W)`` stage map or already pooled ``(B, C)`` features"""
+        if x.dim() == 4:
+            x = torch.flatten(F.adaptive_avg_pool2d(x, 1), 1)
+        return self.fc(self.norm(x))
+
+
+class EarlyExitMedViT(nn.Module):
+    """
+    A served MedViT model (backbone + dataset head) with exit heads.
+
+    :param model: ``MedViTWithHead`` (or a MedViT) whose final prediction is used when no exit fires.
+    :param exit_heads: ``{stage: ExitHead}``.
+    :param thresholds: ``{stage: confidence}`` in [0, 1]; an exit without a threshold is never taken.
+    """
+
+    def __init__(self, model, exit_heads, thresholds):
+        super(EarlyExitMedViT, self).__init__()
+        self.backbone = model.backbone if hasattr(model, 'backbone') else model
+        self.head = model.head if hasattr(model, 'head') else model.proj_head
+        self.exit_heads = nn.ModuleDict({str(stage): head for stage, head in exit_heads.items()})
+        self.thresholds = {int(stage): float(t) for stage, t in thresholds.items() if t is not None}
+        self.exit_layers = {self.backbone.stage_out_idx[int(stage)]: int(stage) for stage in exit_heads}
+        self.exit_counts = {f'exit{stage}': 0 for stage in self.thresholds}
+        self.exit_counts['final'] = 0
+        self._lock = threading.Lock()
+
+    @torch.no_grad()
+    def forward(self, x):
+        backbone = self.backbone
+        if backbone.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = backbone.stem(x)
+        logits = None
+        active = torch.arange(x.shape[0])
+        for idx, layer in enumerate(backbone.features):
+            x = layer(x)
+            stage = self.exit_layers.get(idx)
+            if stage is None or stage not in self.thresholds:
+                continue
+            exit_logits = self.exit_heads[str(stage)](x)
+            if logits is None:
+                logits = exit_logits.new_empty(len(active), exit_logits.shape[1])
+            confident = F.softmax(exit_logits, dim=1).max(dim=1).values >= self.thresholds[stage]
+            if confident.any():
+                logits[active[confident]] = exit_logits[confident]
+                self._count(f'exit{stage}', int(confident.sum()))
+                active, x = active[~confident], x[~confident]
+                if len(active) == 0:
+                    return logits
+                if backbone.channels_last:
+                    x = x.contiguous(memory_format=torch.channels_last)
+
+        x = torch.flatten(backbone.avgpool(backbone.norm(x)), 1)
+        final_logits = self.head(x)
+        if logits is None:
+            return final_logits
+        logits[active] = final_logits
+        self._count('final', len(active))
+        return logits
+
+    def stats(self):
+        return {'thresholds': {f'exit{stage}': t for stage, t in self.thresholds.items()},
+                'exits': dict(self.exit_counts)}
+
+    def _count(self, name, n):
+        with self._lock:
+            self.exit_counts[name] += n
+
+
+def exits_path(checkpoint_dir, checkpoint_file, dataset):
+    stem = os.path.splitext(os.path.basename(checkpoint_file))[0]
+    return os.path.join(checkpoint_dir, f"{stem}_{dataset.lower()}_exits.pth")
+
+
+def save_exits(path, exit_heads, thresholds):
+    torch.save({
+        'heads': {stage: head.state_dict() for stage, head in exit_heads.items()},
+        'channels': {stage: head.fc.in_features for stage, head in exit_heads.items()},
+        'thresholds': thresholds,
+    }, path)
+
+
+def load_exits(path, num_classes):
+    """Return ``(exit_heads, thresholds)`` saved by ``save_exits``"""
+    checkpoint = torch.load(path, map_location='cpu')
+    exit_heads = {}
+    for stage, state_dict in checkpoint['heads'].items():
+        head = ExitHead(checkpoint['channels'][stage], num_classes)
+        head.load_state_dict(state_dict)
+        exit_heads[int(stage)] = head.eval()
+    thresholds = {int(stage): t for stage, t in checkpoint['thresholds'].items() if t is not None}
+    return exit_heads, thresholds
+
+
+@torch.no_grad()
+def extract(model, batches, stages=EXIT_STAGES):
+    """Pooled stage features and final logits of the served model for every image"""
+    features = {stage: [] for stage in stages}
+    logits = []
+    for batch in batches:
+        pooled, stage_maps = model.backbone.forward_features(batch, stages=stages)
+        logits.append(model.head(pooled))
+        for stage in stages:
+            features[stage].append(torch.flatten(F.adaptive_avg_pool2d(stage_maps[stage], 1), 1))
+    return {stage: torch.cat(f) for stage, f in features.items()}, torch.cat(logits)
+
+
+def train_exit_head(features, teacher_logits, labels=None, epochs=200, lr=1e-2, temperature=2.0, alpha=0.5):
+    """Distil the final head into an exit head on pooled stage features (full-batch Adam)"""
+    head = ExitHead(features.shape[1], teacher_logits.shape[1])
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=1e-4)
+    soft_targets = F.softmax(teacher_logits / temperature, dim=1)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        logits = head(features)
+        loss = F.kl_div(F.log_softmax(logits / temperature, dim=1), soft_targets,
+                        reduction='batchmean') * temperature ** 2
+        if labels is not None:
+            loss = alpha * loss + (1 - alpha) * F.cross_entropy(logits, labels)
+        loss.backward()
+        optimizer.step()
+    return head.eval()
+
+
+@torch.no_grad()
+def stage_latencies(backbone, image_size=224, iterations=5):
+    """Median seconds for a batch-1 pass through the trunk up to the end of each stage"""
+    x = torch.randn(1, 3, image_size, image_size)
+    if backbone.channels_last:
+        x = x.contiguous(memory_format=torch.channels_last)
+    runs = []
+    for _ in range(iterations + 1):
+        times, start = {}, time.perf_counter()
+        out = backbone.stem(x)
+        for idx, layer in enumerate(backbone.features):
+            out = layer(out)
+            if idx in backbone.stage_out_idx:
+                times[backbone.stage_out_idx.index(idx)] = time.perf_counter() - start
+        runs.append(times)
+    runs = runs[1:]
+    return {stage: sorted(run[stage] for run in runs)[len(runs) // 2] for stage in runs[0]}
+
+
+def fit(model, batches, labels=None, max_accuracy_drop=0.01, train_fraction=0.8, image_size=224):
+    """
+    Fit exit heads and confidence thresholds. Accuracy is measured against ``labels`` when given,
+    otherwise as agreement with the final head. Returns ``(exit_heads, thresholds, report)``.
+    """
+    from cascade import fit_threshold
+
+    features, teacher_logits = extract(model, batches)
+    count = teacher_logits.shape[0]
+    split = max(1, int(count * train_fraction)) if count > 1 else count
+    train, val = slice(0, split), slice(split if split < count else 0, count)
+    targets = labels if labels is not None else teacher_logits.argmax(1)
+    final_correct = teacher_logits[val].argmax(1) == targets[val]
+
+    latencies = stage_latencies(model.backbone, image_size)
+    final_latency = latencies[max(latencies)]
+    exit_heads, thresholds, report = {}, {}, {'images': count, 'val_images': int(final_correct.numel()),
+                                              'final_accuracy': final_correct.float().mean().item(),
+                                              'final_ms': final_latency * 1000.0}
+    remaining = torch.ones(final_correct.numel(), dtype=torch.bool)
+    expected_latency = 0.0
+    for stage in EXIT_STAGES:
+        head = train_exit_head(features[stage][train], teacher_logits[train],
+                               labels[train] if labels is not None else None)
+        with torch.no_grad():
+            probs = F.softmax(head(features[stage][val]), dim=1)
+        confidence, prediction = probs.max(dim=1)
+        correct = prediction == targets[val]
+        threshold = fit_threshold(confidence[remaining], correct[remaining], final_correct[remaining],
+                                  max_accuracy_drop) if remaining.any() else None
+        accepted = remaining & (confidence >= threshold) if threshold is not None else \
+            torch.zeros_like(remaining)
+        exit_heads[stage], thresholds[stage] = head, threshold
+        expected_latency += accepted.float().mean().item() * latencies[stage]
+        report[f'exit{stage}_accuracy'] = correct.float().mean().item()
+        report[f'exit{stage}_threshold'] = threshold
+        report[f'exit{stage}_taken'] = accepted.float().mean().item()
+        report[f'exit{stage}_ms'] = latencies[stage] * 1000.0
+        remaining &= ~accepted
+    expected_latency += remaining.float().mean().item() * final_latency
+    report['early_exit_ms'] = expected_latency * 1000.0
+    return exit_heads, thresholds, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit MedViT early-exit heads on a local image folder')
+    parser.add_argument('--images', required=True, help='image folder, optionally one sub-folder per class')
+    parser.add_argument('--dataset', default='PathMNIST')
+    parser.add_argument('--model-type', default='MedViT-Large')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help='allowed accuracy loss of early answers relative to the final head')
+    args = parser.parse_args()
+
+    from medvit_api import CHECKPOINT_DIR, CHECKPOINT_FILES, CLASS_LABELS, get_model, preprocess_image
+    from quantization import list_images, load_batches
+
+    class_labels = CLASS_LABELS.get(args.dataset)
+    items = list_images(args.images)
+    if not items:
+        raise SystemExit(f"No images found in {args.images}")
+    labels = None
+    if class_labels and all(label in class_labels for _, label in items):
+        labels = torch.tensor([class_labels.index(label) for _, label in items])
+    else:
+        print("⚠ Folder names are not class labels; fitting against the final head's predictions")
+
+    model = get_model(args.model_type, len(class_labels), dataset=args.dataset)
+    batches = load_batches(items, preprocess_image, args.image_size, args.batch_size)
+    exit_heads, thresholds, report = fit(model, batches, labels, args.max_accuracy_drop,
+                                         image_size=args.image_size)
+
+    path = exits_path(CHECKPOINT_DIR, CHECKPOINT_FILES[args.model_type], args.dataset)
+    save_exits(path, exit_heads, thresholds)
+
+    print("=" * 60)
+    print(f"Early exits - {args.model_type} / {args.dataset}")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+    print(f"✓ Wrote exit heads to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Export BN-folded MedViT models to ONNX and TorchScript.
+
+One artifact is written per model type and image size. It contains the shared backbone and every
+dataset head in CLASS_LABELS, has a dynamic batch axis, and returns one logits output per dataset
+(ONNX outputs are named after the datasets). The artifacts can be served by medvit_api through
+the 'onnxruntime' or 'torchscript' inference backend.
+
+Usage:
+    python export_medvit.py --model-type MedViT-Large --format onnx torchscript --image-size 224
+    python export_medvit.py --model-type all --verify
+"""
+import argparse
+import inspect
+import json
+import os
+
+import torch
+
+from model_registry import MultiHeadMedViT
+
+MODEL_TYPES = ['MedViT-Small', 'MedViT-Base', 'MedViT-Large']
+
+# Largest relative logit difference accepted by --verify
+VERIFY_RTOL = 1e-3
+
+
+def artifact_name(model_type, image_size, extension):
+    """File name of an exported artifact, e.g. medvit_large_224.onnx"""
+    return "{}_{}.{}".format(model_type.lower().replace('-', '_'), image_size, extension)
+
+
+def build_export_model(model_type, datasets=None):
+    """Assemble the shared backbone and the requested dataset heads as one module"""
+    from medvit_api import CLASS_LABELS, default_checkpoint, model_registry
+
+    # Straight from the registry: get_model may wrap the models in EarlyExitMedViT, and exit
+    # heads are not part of the exported artifacts
+    checkpoint_path = default_checkpoint(model_type)
+    datasets = datasets or list(CLASS_LABELS)
+    models = {name: model_registry.get(model_type, name, len(CLASS_LABELS[name]), checkpoint_path)
+              for name in datasets}
+    backbone = next(iter(models.values())).backbone
+    return MultiHeadMedViT(backbone, {name: model.head for name, model in models.items()}).eval()
+
+
+@torch.no_grad()
+def export_onnx(model, path, image_size=224, opset=17):
+    dummy = torch.randn(1, 3, image_size, image_size)
+    dynamic_axes = {'input': {0: 'batch'}}
+    dynamic_axes.update({name: {0: 'batch'} for name in model.datasets})
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript-based exporter supports dynamic_axes directly (the dynamo exporter is
+        # built around dynamic_shapes), keeping the batch axis of the input and every output dynamic
+        export_kwargs['dynamo'] = False
+    torch.onnx.export(model, dummy, path, input_names=['input'], output_names=model.datasets,
+                      dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True,
+                      **export_kwargs)
+    print(f"✓ Exported ONNX model to {path}")
+
+
+@torch.no_grad()
+def export_torchscript(model, path, image_size=224):
+    dummy = torch.randn(1, 3, image_size, image_size)
+    traced = torch.jit.trace(model, dummy, check_trace=False)
+    traced = torch.jit.freeze(traced)
+    extra_files = {'datasets.json': json.dumps(model.datasets)}
+    torch.jit.save(traced, path, _extra_files=extra_files)
+    print(f"✓ Exported TorchScript model to {path}")
+
+
+@torch.no_grad()
+def verify_artifact(model, path, image_size=224, batch_size=2):
+    """
+    Check an exported artifact against the eager model on a random batch. Returns
+    ``{dataset: relative diff}``.
+    """
+    from inference_backends import load_artifact
+
+    x = torch.randn(batch_size, 3, image_size, image_size)
+    reference = model(x)
+    outputs = load_artifact(path)(x)
+    diffs = {}
+    for name, expected in zip(model.datasets, reference):
+        rel_diff = ((outputs[name] - expected).abs().max() / expected.abs().max().clamp_min(1e-6)).item()
+        status = "✓" if rel_diff < VERIFY_RTOL else "✗"
+        print(f"  {status} {name}: relative diff {rel_diff:.2e}")
+        diffs[name] = rel_diff
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export MedViT to ONNX / TorchScript')
+    parser.add_argument('--model-type', default='MedViT-Large', choices=MODEL_TYPES + ['all'])
+    parser.add_argument('--format', nargs='+', default=['onnx', 'torchscript'], choices=['onnx', 'torchscript'])
+    parser.add_argument('--image-size', type=int, nargs='+', default=[224])
+    parser.add_argument('--datasets', nargs='+', default=None, help='dataset heads to include (default: all)')
+    parser.add_argument('--output-dir', default=None, help='default: checkpoints/exported')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--verify', action='store_true', help='compare each artifact against the eager model')
+    args = parser.parse_args()
+
+    from medvit_api import EXPORT_DIR
+
+    output_dir = args.output_dir or EXPORT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    model_types = MODEL_TYPES if args.model_type == 'all' else [args.model_type]
+    failed = []
+
+    for model_type in model_types:
+        model = build_export_model(model_type, args.datasets)
+        for image_size in args.image_size:
+            for fmt in args.format:
+                extension = 'onnx' if fmt == 'onnx' else 'pt'
+                path = os.path.join(output_dir, artifact_name(model_type, image_size, extension))
+                if fmt == 'onnx':
+                    export_onnx(model, path, image_size, args.opset)
+                else:
+                    export_torchscript(model, path, image_size)
+                if args.verify:
+                    diffs = verify_artifact(model, path, image_size)
+                    failed += [f"{os.path.basename(path)}/{name}" for name, diff in diffs.items()
+                               if not diff < VERIFY_RTOL]
+
+    if failed:
+        raise SystemExit(f"✗ Exported outputs differ from the eager model (relative diff >= {VERIFY_RTOL}): "
+                         f"{', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
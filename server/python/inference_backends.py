@@ -0,0 +1,127 @@
+"""
+Pluggable inference backends for the MedViT API.
+
+A backend turns ``(model_type, dataset, image_size)`` into a runner: a callable taking a
+preprocessed ``(B, 3, H, W)`` float tensor and returning ``(B, num_classes)`` logits.
+
+    torch:        eager PyTorch through the shared-backbone model registry (default)
+    onnxruntime:  artifacts written by export_medvit.py, run with onnxruntime on CPU
+    torchscript:  frozen TorchScript artifacts written by export_medvit.py
+"""
+import json
+import os
+import threading
+
+import torch
+
+from export_medvit import artifact_name
+
+
+class TorchBackend(object):
+    name = 'torch'
+
+    def __init__(self, get_model, class_labels):
+        self.get_model = get_model
+        self.class_labels = class_labels
+
+    def get_runner(self, model_type, dataset, image_size):
+        num_classes = len(self.class_labels.get(dataset, [f"Class {i}" for i in range(10)]))
+        return self.get_model(model_type, num_classes, dataset=dataset)
+
+
+class _ArtifactBackend(object):
+    """Loads one exported multi-head artifact per (model_type, image_size) and caches it"""
+    extension = None
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        self._artifacts = {}
+        self._lock = threading.Lock()
+
+    def get_runner(self, model_type, dataset, image_size):
+        path = os.path.join(self.export_dir, artifact_name(model_type, image_size, self.extension))
+        with self._lock:
+            if path not in self._artifacts:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"No exported {self.name} model at {path}; run export_medvit.py first")
+                self._artifacts[path] = self._load(path)
+                print(f"✓ Loaded {self.name} model from {path}")
+        return self._runner(self._artifacts[path], dataset)
+
+    def _load(self, path):
+        raise NotImplementedError
+
+    def _runner(self, artifact, dataset):
+        raise NotImplementedError
+
+
+class OnnxRuntimeBackend(_ArtifactBackend):
+    name = 'onnxruntime'
+    extension = 'onnx'
+
+    def __init__(self, export_dir, num_threads=None):
+        super(OnnxRuntimeBackend, self).__init__(export_dir)
+        self.num_threads = num_threads
+
+    def _load(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+    def _runner(self, session, dataset):
+        outputs = [output.name for output in session.get_outputs()]
+        if dataset not in outputs:
+            raise KeyError(f"Exported model has no head for dataset {dataset}")
+
+        def run(x):
+            logits = session.run([dataset], {'input': x.contiguous().numpy()})[0]
+            return torch.from_numpy(logits)
+        return run
+
+
+class TorchScriptBackend(_ArtifactBackend):
+    name = 'torchscript'
+    extension = 'pt'
+
+    def _load(self, path):
+        extra_files = {'datasets.json': ''}
+        module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        return module, json.loads(extra_files['datasets.json'])
+
+    def _runner(self, artifact, dataset):
+        module, datasets = artifact
+        if dataset not in datasets:
+            raise KeyError(f"Exported model has no head for dataset {dataset}")
+        index = datasets.index(dataset)
+
+        def run(x):
+            return module(x)[index]
+        return run
+
+
+def create_backend(name, get_model=None, class_labels=None, export_dir=None, num_threads=None):
+    """Create the inference backend selected by ``name``"""
+    if name == 'torch':
+        return TorchBackend(get_model, class_labels)
+    if name == 'onnxruntime':
+        return OnnxRuntimeBackend(export_dir, num_threads)
+    if name == 'torchscript':
+        return TorchScriptBackend(export_dir)
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+def load_artifact(path):
+    """Load an exported artifact and return a callable mapping inputs to ``{dataset: logits}``"""
+    backend = OnnxRuntimeBackend(os.path.dirname(path)) if path.endswith('.onnx') else \
+        TorchScriptBackend(os.path.dirname(path))
+    artifact = backend._load(path)
+    if isinstance(backend, OnnxRuntimeBackend):
+        datasets = [output.name for output in artifact.get_outputs()]
+    else:
+        datasets = artifact[1]
+    runners = {name: backend._runner(artifact, name) for name in datasets}
+    return lambda x: {name: run(x) for name, run in runners.items()}
@@ -6,6 +6,8 @@ import os
 import sys
 import base64
 import io
+import threading
+from functools import partial
 
 # Set UTF-8 encoding for console output
 if sys.stdout.encoding != 'utf-8':
@@ -16,7 +18,6 @@ from flask_cors import CORS
 from PIL import Image
 import torch
 import torch.nn.functional as F
-from torchvision import transforms
 import numpy as np
 
 # Add current directory to path (MedViT.py is in the same folder)
@@ -24,13 +25,27 @@ CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, CURRENT_DIR)
 
 try:
-    from MedViT import MedViT_small, MedViT_base, MedViT_large
+    from MedViT import MedViT, MedViT_small, MedViT_base, MedViT_large
     print(f"✓ Successfully imported MedViT from {CURRENT_DIR}")
 except ImportError as e:
     print(f"Error: Could not import MedViT from {CURRENT_DIR}")
     print(f"Error details: {e}")
     sys.exit(1)
 
+from batching import MicroBatcher
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, make_cache_key
+from inference_backends import create_backend
+from checkpoint_loading import build_from_checkpoint
+from worker_pool import WorkerPool
+from preprocessing import Preprocessor
+from cascade import CascadeThresholds, run_cascade
+from compilation import CompiledForward, compile_backbone, configure_cache, warm_up
+from vector_index import VectorIndex
+from early_exit import EarlyExitMedViT, exits_path, load_exits
+from pruning import load_students
+from tta import REDUCTIONS as TTA_REDUCTIONS, parse_views as parse_tta_views, predict_tta
+
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:8080", "http://127.0.0.1:8080", "http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:8082", "http://127.0.0.1:8082"])
 
@@ -69,36 +84,83 @@ CLASS_LABELS = {
     ]
 }
 
-# Global model cache
-model_cache = {}
+# Fold BatchNorm layers into the adjacent conv/linear weights after loading (inference only)
+MERGE_BN = True
+# Check each folded backbone against the unfolded one on a random batch at load time. Off on the
+# serving path (two extra forward passes per backbone); test_merge_bn.py covers the folding.
+VERIFY_BN_MERGE = False
 
-def get_model(model_type, num_classes, checkpoint_path=None):
-    """Load or retrieve cached model"""
-    cache_key = f"{model_type}_{num_classes}_{checkpoint_path}"
-    
-    if cache_key in model_cache:
-        return model_cache[cache_key]
-    
-    # Check for pretrained weights in checkpoints directory
-    if checkpoint_path is None:
-        checkpoint_dir = os.path.join(os.path.dirname(__file__), 'checkpoints')
-        if model_type == "MedViT-Small":
-            checkpoint_path = os.path.join(checkpoint_dir, 'medvit_small_imagenet.pth')
-        elif model_type == "MedViT-Base":
-            checkpoint_path = os.path.join(checkpoint_dir, 'medvit_base_imagenet.pth')
-        else:
-            checkpoint_path = os.path.join(checkpoint_dir, 'medvit_large_imagenet.pth')
-    
-    # Create model
+# Run E_MHSA through torch's fused scaled-dot-product attention with packed q/k/v projections
+USE_SDPA = True
+
+# Opt-in INT8 inference: None, 'dynamic' (Linear layers) or 'static' (Linear layers and 1x1 convs).
+# Static quantization calibrates on the images in QUANTIZE_CALIBRATION_DIR.
+QUANTIZE = None
+QUANTIZE_CALIBRATION_DIR = None
+QUANTIZE_CALIBRATION_IMAGES = 32
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), 'checkpoints')
+CHECKPOINT_FILES = {
+    'MedViT-Small': 'medvit_small_imagenet.pth',
+    'MedViT-Base': 'medvit_base_imagenet.pth',
+    'MedViT-Large': 'medvit_large_imagenet.pth'
+}
+
+# Pruned / distilled students written by pruning.py, served as additional model types. Each entry
+# holds the student's checkpoint file and MedViT architecture.
+STUDENTS_PATH = os.path.join(CHECKPOINT_DIR, 'students.json')
+STUDENT_MODELS = load_students(STUDENTS_PATH)
+CHECKPOINT_FILES.update({model_type: student['checkpoint'] for model_type, student in STUDENT_MODELS.items()})
+
+# Input sizes requests may ask for. Every (model type, dataset, image size) gets its own batcher queue
+# (and compiled graph), so model_type and image_size are checked before they become a key.
+IMAGE_SIZES = (224,)
+
+# Build on the meta device and assign memory-mapped checkpoint tensors instead of random init + copy.
+# A converted checkpoint (checkpoint_loading.py) with the same name and a .safetensors extension
+# is preferred over the .pth file.
+FAST_LOAD = True
+
+def model_builder(model_type):
+    """Return a constructor for the given MedViT variant with its ImageNet head"""
+    if model_type in STUDENT_MODELS:
+        return partial(MedViT, path_dropout=0., num_classes=1000, use_sdpa=USE_SDPA,
+                       **STUDENT_MODELS[model_type]['arch'])
     if model_type == "MedViT-Small":
-        model = MedViT_small(num_classes=1000)  # ImageNet pretrained
+        builder = MedViT_small  # ImageNet pretrained
     elif model_type == "MedViT-Base":
-        model = MedViT_base(num_classes=1000)
+        builder = MedViT_base
     else:
-        model = MedViT_large(num_classes=1000)
+        builder = MedViT_large
+    return partial(builder, num_classes=1000, use_sdpa=USE_SDPA)
+
+def find_fast_checkpoint(checkpoint_path):
+    """Prefer a converted .safetensors snapshot next to the .pth checkpoint"""
+    if not checkpoint_path:
+        return None
+    converted = os.path.splitext(checkpoint_path)[0] + '.safetensors'
+    if os.path.exists(converted):
+        return converted
+    return checkpoint_path if os.path.exists(checkpoint_path) else None
+
+def load_backbone(model_type, checkpoint_path, fast=True):
+    """
+    Build a MedViT with its ImageNet head and load its checkpoint if it exists. With ``fast`` (and
+    FAST_LOAD) a converted, possibly BN-folded .safetensors snapshot is preferred over the .pth.
+    """
+    fast_checkpoint = find_fast_checkpoint(checkpoint_path) if fast and FAST_LOAD else None
+    if fast_checkpoint:
+        try:
+            model = build_from_checkpoint(model_builder(model_type), fast_checkpoint)
+            print(f"✓ Loaded pretrained checkpoint from {fast_checkpoint} (memory-mapped)")
+            return model
+        except Exception as e:
+            print(f"⚠ Warning: Fast checkpoint load failed, falling back to regular load: {e}")
+    
+    # Create model
+    model = model_builder(model_type)()
     
     # Load checkpoint if exists
-    checkpoint_loaded = False
     if checkpoint_path and os.path.exists(checkpoint_path):
         try:
             checkpoint = torch.load(checkpoint_path, map_location='cpu')
@@ -109,58 +171,289 @@ def get_model(model_type, num_classes, checkpoint_path=None):
             else:
                 model.load_state_dict(checkpoint, strict=False)
             print(f"✓ Loaded pretrained checkpoint from {checkpoint_path}")
-            checkpoint_loaded = True
         except Exception as e:
             print(f"⚠ Warning: Could not load checkpoint: {e}")
     
     # Checkpoint loading is optional - model will work with or without pretrained weights
+    model.eval()
+    return model
+
+def quantize_backbone(backbone):
+    """Apply the configured INT8 quantization to a (BN-folded) backbone"""
+    from quantization import list_images, load_batches, quantize_model
     
-    # Adapt to target number of classes if different from ImageNet
-    if num_classes != 1000:
-        # Replace the final classifier layer
-        if hasattr(model, 'proj_head'):
-            # MedViT uses proj_head which is a Sequential with Linear layer
-            in_features = model.proj_head[0].in_features
-            model.proj_head = torch.nn.Sequential(
-                torch.nn.Linear(in_features, num_classes)
-            )
-        elif hasattr(model, 'head'):
-            in_features = model.head.in_features
-            model.head = torch.nn.Linear(in_features, num_classes)
-        elif hasattr(model, 'fc'):
-            in_features = model.fc.in_features
-            model.fc = torch.nn.Linear(in_features, num_classes)
+    calibration = None
+    if QUANTIZE == 'static':
+        items = list_images(QUANTIZE_CALIBRATION_DIR)[:QUANTIZE_CALIBRATION_IMAGES] if QUANTIZE_CALIBRATION_DIR else []
+        if not items:
+            raise ValueError("QUANTIZE='static' needs images in QUANTIZE_CALIBRATION_DIR")
+        calibration = load_batches(items, preprocess_image)
+    backbone = quantize_model(backbone, QUANTIZE, calibration)
+    print(f"✓ Quantized backbone to INT8 ({QUANTIZE})")
+    return backbone
+
+def quantize_head(head):
+    from quantization import quantize_model
+    return quantize_model(head, 'dynamic')
+
+# Serve eager FP32 backbones in channels_last (NHWC) layout with a fused conv + ReLU stem, which
+# is what oneDNN's CPU kernels prefer. Compare the layouts with benchmark_medvit.py. Ignored when
+# COMPILE is on: compiled backbones stay NCHW.
+CHANNELS_LAST = True
+
+# Compile eager FP32 backbones with torch.compile (inductor). Compilation runs at server start for
+# COMPILE_WARMUP_MODELS x COMPILE_IMAGE_SIZES and the kernels are cached in COMPILE_CACHE_DIR.
+# Only used when inference runs in the API process (WORKER_PROCESSES == 0).
+# The configuration that compiles is USE_SDPA = True with NCHW backbones, so CHANNELS_LAST is
+# skipped when compiling: inductor can fail on the channels_last graph and on the non-SDPA E_MHSA
+# ("Attempting to broadcast a dimension of length 49"), after which the backbone serves eager, and
+# where the channels_last graph does compile it takes about 5x longer. /health reports whether each
+# backbone actually runs compiled.
+COMPILE = False
+COMPILE_MODE = None  # e.g. 'max-autotune'
+COMPILE_IMAGE_SIZES = [224]
+COMPILE_WARMUP_MODELS = list(CHECKPOINT_FILES)
+COMPILE_CACHE_DIR = os.path.join(CHECKPOINT_DIR, 'compile_cache')
+if COMPILE:
+    configure_cache(COMPILE_CACHE_DIR)
+    if not USE_SDPA:
+        print("⚠ Warning: COMPILE needs USE_SDPA = True; the non-SDPA attention falls back to eager mode")
+
+def prepare_backbone(backbone):
+    """Transform applied to each backbone after BN folding"""
+    if QUANTIZE:
+        return quantize_backbone(backbone)
+    compile = COMPILE and WORKER_PROCESSES == 0
+    if MERGE_BN:
+        # Drop training-only modules and per-block checks (outputs unchanged)
+        backbone = backbone.to_inference()
+        if CHANNELS_LAST and not compile:
+            backbone = backbone.to_channels_last()
+    if compile:
+        backbone = compile_backbone(backbone, mode=COMPILE_MODE)
+    return backbone
+
+# One backbone per (model_type, checkpoint), shared by every dataset head
+model_registry = ModelRegistry(load_backbone, merge_bn=MERGE_BN, head_dir=CHECKPOINT_DIR,
+                               transform_backbone=prepare_backbone,
+                               transform_head=quantize_head if QUANTIZE else None,
+                               verify_merge=VERIFY_BN_MERGE)
+
+# Answer confident images at intermediate stage heads fitted with early_exit.py. Datasets without
+# a <checkpoint>_<dataset>_exits.pth file always run the full model.
+EARLY_EXIT = False
+early_exit_models = {}
+
+def default_checkpoint(model_type):
+    """Pretrained weights of a model type in the checkpoints directory"""
+    return os.path.join(CHECKPOINT_DIR, CHECKPOINT_FILES.get(model_type, CHECKPOINT_FILES['MedViT-Large']))
+
+def get_model(model_type, num_classes, checkpoint_path=None, dataset=None):
+    """Load or retrieve cached model for a dataset head on a shared backbone"""
+    if checkpoint_path is None:
+        checkpoint_path = default_checkpoint(model_type)
     
-    model.eval()
-    model_cache[cache_key] = model
+    model = model_registry.get(model_type, dataset, num_classes, checkpoint_path)
+    if EARLY_EXIT and dataset:
+        return with_early_exits(model, checkpoint_path, dataset, num_classes)
     return model
 
+def with_early_exits(model, checkpoint_path, dataset, num_classes):
+    """Wrap a served model with its fitted exit heads, if there are any"""
+    key = (checkpoint_path, dataset, num_classes)
+    if key not in early_exit_models:
+        path = exits_path(CHECKPOINT_DIR, checkpoint_path, dataset)
+        if os.path.exists(path):
+            exit_heads, thresholds = load_exits(path, num_classes)
+            early_exit_models[key] = EarlyExitMedViT(model, exit_heads, thresholds).eval()
+            print(f"✓ Loaded early exits for {dataset} from {path} (thresholds {thresholds})")
+        else:
+            early_exit_models[key] = model
+    return early_exit_models[key]
+
+# Inference backend: 'torch' (eager, shared-backbone registry), 'onnxruntime' or 'torchscript'.
+# The exported backends serve artifacts written to EXPORT_DIR by export_medvit.py.
+INFERENCE_BACKEND = 'torch'
+EXPORT_DIR = os.path.join(CHECKPOINT_DIR, 'exported')
+
+# Multi-process serving: run eager inference in WORKER_PROCESSES processes pinned to disjoint core
+# sets, with model weights placed in shared memory once. 0 keeps inference in the API process.
+# Capped at the number of available cores.
+WORKER_PROCESSES = 0
+WORKER_THREADS = None  # intra-op threads per worker, default: cores per worker
+WORKER_TIMEOUT = 60  # seconds a request waits for its worker; dead workers are restarted
+
+if WORKER_PROCESSES > 0:
+    inference_backend = WorkerPool(get_model, CLASS_LABELS, num_workers=WORKER_PROCESSES,
+                                   threads_per_worker=WORKER_THREADS, timeout=WORKER_TIMEOUT)
+else:
+    inference_backend = create_backend(INFERENCE_BACKEND, get_model=get_model, class_labels=CLASS_LABELS,
+                                       export_dir=EXPORT_DIR)
+
+def _load_batch_model(key):
+    """Model loader used by the micro-batcher; keys are (model_type, dataset, image_size)"""
+    model_type, dataset, image_size = key
+    return inference_backend.get_runner(model_type, dataset, image_size)
+
+# Resubmitted images are answered from cache without decoding or running the model.
+# Set PREDICTION_CACHE_PATH to a file path to keep cached predictions across restarts.
+PREDICTION_CACHE_SIZE = 1024
+PREDICTION_CACHE_TTL = 3600
+PREDICTION_CACHE_PATH = None
+prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL,
+                                   persist_path=PREDICTION_CACHE_PATH)
+
+# Images are decoded (JPEG at reduced resolution) and resized to uint8 in the request thread;
+# normalisation is fused and written straight into the batch buffer by the micro-batcher.
+preprocessor = Preprocessor()
+
+# Requests with the same (model_type, dataset, image_size) are gathered into one forward pass
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_MS = 10
+batcher = MicroBatcher(_load_batch_model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                       concurrency=inference_backend.num_workers if WORKER_PROCESSES > 0 else 1,
+                       collate=preprocessor.normalize)
+
+def _load_embed_model(key):
+    """Embedding loader for the micro-batcher; keys are (model_type, image_size, stages)"""
+    model_type, image_size, stages = key
+    model = get_model(model_type, 1000)
+    return partial(model.embed, stages=stages)
+
+def _embedding_rows(outputs, top_ks):
+    """Split a batch of embeddings (and pooled stage features) into numpy rows per request"""
+    if isinstance(outputs, tuple):
+        embeddings, stage_features = outputs
+    else:
+        embeddings, stage_features = outputs, {}
+    embeddings = embeddings.float().numpy()
+    stage_features = {stage: features.float().numpy() for stage, features in stage_features.items()}
+    return [(embeddings[i], {stage: features[i] for stage, features in stage_features.items()})
+            for i in range(len(embeddings))]
+
+# Embeddings always run on the eager backbones in the API process, batched like predictions
+embed_batcher = MicroBatcher(_load_embed_model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                             collate=preprocessor.normalize, postprocess=_embedding_rows)
+
+# model_type "cascade" runs MedViT-Small -> Base -> Large and stops at the first stage whose top-1
+# margin reaches its per-dataset threshold (fit them with cascade.py)
+CASCADE_MODEL_TYPE = 'cascade'
+CASCADE_THRESHOLDS_PATH = os.path.join(CHECKPOINT_DIR, 'cascade_thresholds.json')
+cascade_thresholds = CascadeThresholds(CASCADE_THRESHOLDS_PATH)
+
+def warm_up_compiled_models():
+    """Compile every warm-up model for each configured image size and batch size 1 / batch maximum"""
+    for model_type in COMPILE_WARMUP_MODELS:
+        model = get_model(model_type, 1000)
+        timings = warm_up(model, COMPILE_IMAGE_SIZES, batch_sizes=(1, BATCH_MAX_SIZE))
+        print(f"✓ Compiled {model_type} in {sum(timings.values()):.1f}s for image sizes {COMPILE_IMAGE_SIZES}")
+
 def preprocess_image(image, size=224):
     """Preprocess image for inference"""
-    transform = transforms.Compose([
-        transforms.Resize((size, size)),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225]
-        )
-    ])
-    
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    return transform(image).unsqueeze(0)
+    return preprocessor(image, size)
 
-def decode_base64_image(base64_string):
-    """Decode base64 image string to PIL Image"""
+def decode_base64_bytes(base64_string):
+    """Decode base64 image string to raw image bytes"""
     # Remove data URL prefix if present
     if ',' in base64_string:
         base64_string = base64_string.split(',')[1]
     
-    image_data = base64.b64decode(base64_string)
+    return base64.b64decode(base64_string)
+
+def decode_base64_image(base64_string):
+    """Decode base64 image string to PIL Image"""
+    image_data = decode_base64_bytes(base64_string)
     image = Image.open(io.BytesIO(image_data))
     return image
 
+# Similar-case lookup over MedViT embeddings. Build the index with vector_index.py or insert images
+# through /api/medvit/index; new indexes embed with VECTOR_INDEX_MODEL at VECTOR_INDEX_IMAGE_SIZE.
+VECTOR_INDEX_DIR = os.path.join(CHECKPOINT_DIR, 'vector_index')
+VECTOR_INDEX_MODEL = 'MedViT-Large'
+VECTOR_INDEX_IMAGE_SIZE = 224
+VECTOR_INDEX_NPROBE = 8
+_vector_index = None
+_vector_index_lock = threading.Lock()
+
+def get_vector_index(create=False, dim=None):
+    """Open the vector index on first use; with ``create`` a missing index is created"""
+    global _vector_index
+    with _vector_index_lock:
+        if _vector_index is None and os.path.exists(os.path.join(VECTOR_INDEX_DIR, 'meta.json')):
+            _vector_index = VectorIndex(VECTOR_INDEX_DIR)
+            print(f"✓ Opened vector index with {len(_vector_index)} cases from {VECTOR_INDEX_DIR}")
+        elif _vector_index is None and create:
+            _vector_index = VectorIndex(VECTOR_INDEX_DIR, dim=dim, metadata={
+                'model_type': VECTOR_INDEX_MODEL, 'image_size': VECTOR_INDEX_IMAGE_SIZE})
+        return _vector_index
+
+def index_embedding(image_data, meta):
+    """Embed image bytes with the model and image size the vector index was built with"""
+    model_type = meta.get('model_type', VECTOR_INDEX_MODEL)
+    image_size = meta.get('image_size', VECTOR_INDEX_IMAGE_SIZE)
+    image_tensor = preprocessor.load(image_data, image_size)
+    embedding, _ = embed_batcher.predict((model_type, image_size, None), image_tensor, None)
+    return embedding, model_type
+
+def parse_bool(value, default=False):
+    """Parse a boolean request parameter given as JSON bool or string"""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def parse_model_params(params, model_types):
+    """``(model_type, image_size)`` of a request; raises ValueError for a model type or size not served"""
+    model_type = params.get('model_type', 'MedViT-Large')
+    if model_type not in model_types:
+        raise ValueError(f"Unknown model_type: {model_type} (available: {', '.join(model_types)})")
+    try:
+        image_size = int(params.get('image_size', 224))
+    except (TypeError, ValueError):
+        raise ValueError("image_size must be an integer")
+    if image_size not in IMAGE_SIZES:
+        raise ValueError(f"Unsupported image_size: {image_size} (available: {', '.join(map(str, IMAGE_SIZES))})")
+    return model_type, image_size
+
+def parse_stages(value):
+    """Parse a stage list given as JSON list or comma-separated string; None if not requested"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    stages = tuple(sorted({int(stage) for stage in value}))
+    if any(stage < 0 or stage > 3 for stage in stages):
+        raise ValueError("stages must be between 0 and 3")
+    return stages
+
+def encode_embedding(vector, encoding):
+    """Encode a vector as float16, either base64 (little-endian bytes) or a JSON list"""
+    vector = vector.astype('<f2')
+    if encoding == 'list':
+        return vector.astype(np.float32).tolist()
+    return base64.b64encode(vector.tobytes()).decode('ascii')
+
+def read_predict_request():
+    """
+    Extract (image bytes, params) from a predict request. Binary uploads are read once from the
+    request stream; only JSON bodies go through base64 decoding.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            return None, request.form
+        return upload.stream.read(), request.form
+    
+    if request.mimetype == 'application/octet-stream':
+        image_data = request.get_data(cache=False)
+        return image_data or None, request.args
+    
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None, data or {}
+    return decode_base64_bytes(data['image']), data
+
 @app.route('/api/medvit/predict', methods=['POST'])
 def predict():
     """
@@ -173,49 +466,88 @@ def predict():
         "model_type": "MedViT-Large",
         "image_size": 224
     }
+    
+    model_type "cascade" answers with the smallest MedViT variant that is confident enough; the
+    answering stage is reported in "model_used" and "cascade".
+    
+    "tta": true (or a comma-separated list of views such as "identity,hflip,crop_tl") classifies
+    flipped / cropped views of the image in one batched forward pass and combines them with
+    "tta_reduction" ("mean", "geometric" or "max"); per-view results and agreement are in "tta".
+    
+    The image can also be sent as binary, with the other parameters as form fields or query string:
+        multipart/form-data:       "image" file field
+        application/octet-stream:  raw image bytes as the request body
     """
     try:
-        data = request.get_json()
+        image_data, params = read_predict_request()
         
-        if not data or 'image' not in data:
+        if not image_data:
             return jsonify({'error': 'No image provided'}), 400
         
         # Get parameters
-        image_b64 = data['image']
-        dataset = data.get('dataset', 'PathMNIST')
-        model_type = data.get('model_type', 'MedViT-Large')
-        image_size = data.get('image_size', 224)
+        dataset = params.get('dataset', 'PathMNIST')
+        try:
+            model_type, image_size = parse_model_params(params, list(CHECKPOINT_FILES) + [CASCADE_MODEL_TYPE])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Get class labels
         class_labels = CLASS_LABELS.get(dataset, [f"Class {i}" for i in range(10)])
         num_classes = len(class_labels)
         
-        # Decode image
-        image = decode_base64_image(image_b64)
-        
-        # Preprocess
-        image_tensor = preprocess_image(image, image_size)
-        
-        # Load model
-        model = get_model(model_type, num_classes)
-        
-        # Predict
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            probs = F.softmax(outputs, dim=1)
-            
-            # Get top 5 predictions
-            top_k = min(5, num_classes)
-            top_probs, top_indices = torch.topk(probs, top_k, dim=1)
-            
-            results = []
-            for idx, prob in zip(top_indices[0], top_probs[0]):
-                idx_val = idx.item()
-                class_label = class_labels[idx_val] if idx_val < len(class_labels) else f"Class {idx_val}"
-                results.append({
-                    'class': class_label,
-                    'confidence': float(prob.item() * 100)
-                })
+        # Test-time augmentation
+        tta, tta_views, tta_reduction = params.get('tta'), None, params.get('tta_reduction', 'mean')
+        if tta not in (None, '', False) and str(tta).lower() not in ('0', 'false', 'no'):
+            try:
+                tta_views = parse_tta_views(tta)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if tta_reduction not in TTA_REDUCTIONS:
+                return jsonify({'error': f'Unknown tta_reduction: {tta_reduction}'}), 400
+        
+        # Return cached prediction for an identical image and parameters
+        cache_options = f"tta={','.join(tta_views)}/{tta_reduction}" if tta_views else None
+        cache_key = make_cache_key(image_data, dataset, model_type, image_size, cache_options)
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(dict(cached, cached=True))
+        
+        # Decode and resize; normalisation happens when the batch is assembled
+        image_tensor = preprocessor.load(image_data, image_size)
+        
+        # Predict (batched with concurrent requests for the same model and dataset). With TTA, all
+        # views of this image form one batch of their own.
+        top_k = min(5, num_classes)
+        cascade_info = tta_info = None
+        if tta_views:
+            tta_input = preprocessor.normalize([image_tensor], out=torch.empty(1, 3, image_size, image_size))
+        
+        def predict_with(stage, k):
+            nonlocal tta_info
+            if not tta_views:
+                return batcher.predict((stage, dataset, image_size), image_tensor, k)
+            runner = inference_backend.get_runner(stage, dataset, image_size)
+            stage_probs, stage_indices, tta_info = predict_tta(runner, tta_input, tta_views, tta_reduction, k,
+                                                               class_labels)
+            return stage_probs, stage_indices
+        
+        if model_type == CASCADE_MODEL_TYPE:
+            # At least two classes are needed for the top-1 margin
+            stage_k = min(max(top_k, 2), num_classes)
+            top_probs, top_indices, cascade_info = run_cascade(
+                lambda stage: predict_with(stage, stage_k), dataset, cascade_thresholds)
+            top_probs, top_indices = top_probs[:top_k], top_indices[:top_k]
+            model_type = cascade_info['stage']
+        else:
+            top_probs, top_indices = predict_with(model_type, top_k)
+        
+        results = []
+        for idx_val, prob in zip(top_indices, top_probs):
+            class_label = class_labels[idx_val] if idx_val < len(class_labels) else f"Class {idx_val}"
+            results.append({
+                'class': class_label,
+                'confidence': float(prob * 100)
+            })
         
         # Determine severity based on confidence
         top_confidence = results[0]['confidence']
@@ -227,18 +559,12 @@ def predict():
             severity = "mild"
         
         # Check if using pretrained weights
-        checkpoint_dir = os.path.join(os.path.dirname(__file__), 'checkpoints')
-        checkpoint_files = {
-            'MedViT-Small': 'medvit_small_imagenet.pth',
-            'MedViT-Base': 'medvit_base_imagenet.pth',
-            'MedViT-Large': 'medvit_large_imagenet.pth'
-        }
-        checkpoint_path = os.path.join(checkpoint_dir, checkpoint_files.get(model_type, ''))
+        checkpoint_path = os.path.join(CHECKPOINT_DIR, CHECKPOINT_FILES.get(model_type, ''))
         using_pretrained = os.path.exists(checkpoint_path)
         
         warning = None
         
-        return jsonify({
+        response = {
             'success': True,
             'predictions': results,
             'top_prediction': results[0]['class'],
@@ -246,10 +572,15 @@ def predict():
             'severity': severity,
             'description': 'AI-based medical image analysis. Please consult a healthcare professional for confirmation.',
             'model_used': model_type,
+            'cascade': cascade_info,
+            'tta': tta_info,
             'dataset': dataset,
             'using_pretrained': using_pretrained,
             'warning': warning
-        })
+        }
+        prediction_cache.put(cache_key, response)
+        
+        return jsonify(dict(response, cached=False))
         
     except Exception as e:
         error_msg = str(e)
@@ -263,6 +594,133 @@ def predict():
             'details': traceback.format_exc()
         }), 500
 
+@app.route('/api/medvit/embed', methods=['POST'])
+def embed():
+    """
+    Return the image embedding of a MedViT backbone (no classifier head) as float16
+    
+    Request: same formats as /api/medvit/predict, with parameters
+        model_type:  MedViT variant (default MedViT-Large)
+        image_size:  input size (default 224)
+        stages:      optional stage indices (0-3) whose pooled feature maps are returned too
+        normalize:   L2-normalise the vectors (default true)
+        encoding:    "base64" (little-endian float16 bytes, default) or "list"
+    """
+    try:
+        image_data, params = read_predict_request()
+        
+        if not image_data:
+            return jsonify({'error': 'No image provided'}), 400
+        
+        try:
+            model_type, image_size = parse_model_params(params, list(CHECKPOINT_FILES))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        normalize = parse_bool(params.get('normalize'), default=True)
+        encoding = params.get('encoding', 'base64')
+        if encoding not in ('base64', 'list'):
+            return jsonify({'error': f'Unknown encoding: {encoding}'}), 400
+        try:
+            stages = parse_stages(params.get('stages'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        image_tensor = preprocessor.load(image_data, image_size)
+        embedding, stage_features = embed_batcher.predict((model_type, image_size, stages), image_tensor, None)
+        
+        def finish(vector):
+            if normalize:
+                vector = vector / max(float(np.linalg.norm(vector)), 1e-6)
+            return encode_embedding(vector, encoding)
+        
+        response = {
+            'success': True,
+            'model_used': model_type,
+            'image_size': image_size,
+            'dim': int(embedding.shape[0]),
+            'dtype': 'float16',
+            'encoding': encoding,
+            'normalized': normalize,
+            'embedding': finish(embedding),
+        }
+        if stages is not None:
+            response['stages'] = {str(stage): finish(features) for stage, features in stage_features.items()}
+            response['stage_dims'] = {str(stage): int(features.shape[0]) for stage, features in stage_features.items()}
+        return jsonify(response)
+        
+    except Exception as e:
+        print(f"Error in embedding: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/medvit/similar', methods=['POST'])
+def similar_cases():
+    """
+    Return the k most similar indexed cases for an image (same request formats as predict)
+    
+    Parameters: k (default 5), nprobe (IVF lists to scan, default VECTOR_INDEX_NPROBE)
+    """
+    try:
+        image_data, params = read_predict_request()
+        if not image_data:
+            return jsonify({'error': 'No image provided'}), 400
+        
+        index = get_vector_index()
+        if index is None or len(index) == 0:
+            return jsonify({'error': 'Vector index is empty; build it with vector_index.py'}), 404
+        
+        k = int(params.get('k', 5))
+        nprobe = int(params.get('nprobe', VECTOR_INDEX_NPROBE))
+        embedding, model_type = index_embedding(image_data, index.meta)
+        neighbors = [dict(item, id=row, similarity=score) for row, score, item in index.search(embedding, k, nprobe)]
+        
+        return jsonify({
+            'success': True,
+            'model_used': model_type,
+            'neighbors': neighbors,
+            'indexed_cases': len(index),
+        })
+        
+    except Exception as e:
+        print(f"Error in similar-case lookup: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/medvit/index', methods=['POST'])
+def index_case():
+    """
+    Add an image to the similar-case index without rebuilding it
+    
+    Optional parameters stored with the case: label, case_id, path
+    """
+    try:
+        image_data, params = read_predict_request()
+        if not image_data:
+            return jsonify({'error': 'No image provided'}), 400
+        
+        index = get_vector_index()
+        embedding, model_type = index_embedding(image_data, index.meta if index is not None else {})
+        if index is None:
+            index = get_vector_index(create=True, dim=embedding.shape[0])
+        
+        item = {key: params.get(key) for key in ('label', 'case_id', 'path') if params.get(key) is not None}
+        row = index.add(embedding[None], [item])[0]
+        
+        return jsonify({
+            'success': True,
+            'id': row,
+            'model_used': model_type,
+            'indexed_cases': len(index),
+        })
+        
+    except Exception as e:
+        print(f"Error indexing case: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/medvit/datasets', methods=['GET'])
 def get_datasets():
     """Get available datasets and their class labels"""
@@ -284,7 +742,21 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'MedViT Disease Detection API',
-        'models_cached': len(model_cache),
+        'models_cached': len(model_registry),
+        'model_registry': model_registry.stats(),
+        'inference_backend': inference_backend.name,
+        'batching': batcher.stats(),
+        'embed_batching': embed_batcher.stats(),
+        'vector_index': _vector_index.stats() if _vector_index is not None else None,
+        'early_exits': {f"{os.path.basename(key[0])}/{key[1]}": model.stats()
+                        for key, model in early_exit_models.items() if isinstance(model, EarlyExitMedViT)},
+        'preprocessing': preprocessor.stats(),
+        'compile': {f"{key[0]}/{os.path.basename(key[1] or '')}": backbone.forward_features.stats()
+                    for key, backbone in model_registry.backbones().items()
+                    if isinstance(backbone.forward_features, CompiledForward)},
+        'cascade_thresholds': cascade_thresholds.stats(),
+        'workers': inference_backend.stats() if WORKER_PROCESSES > 0 else None,
+        'prediction_cache': prediction_cache.stats(),
         'checkpoint_loaded': checkpoint_exists,
         'checkpoint_path': checkpoint_dir
     })
@@ -332,7 +804,13 @@ if __name__ == '__main__':
     print(f"Server: http://localhost:5001")
     print(f"Endpoints:")
     print(f"  - POST /api/medvit/predict")
+    print(f"  - POST /api/medvit/embed")
+    print(f"  - POST /api/medvit/similar")
+    print(f"  - POST /api/medvit/index")
     print(f"  - GET  /api/medvit/health")
     print(f"  - GET  /api/medvit/datasets")
     print("="*60 + "\n")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    if COMPILE and WORKER_PROCESSES == 0:
+        warm_up_compiled_models()
+    # The reloader would start a second API process with its own worker pool / compiled models
+    app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=WORKER_PROCESSES == 0 and not COMPILE)
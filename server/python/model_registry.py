@@ -0,0 +1,163 @@
+"""
+Shared-backbone model registry for MedViT serving.
+
+Every dataset served by a given MedViT variant uses the same feature trunk and differs only in
+``proj_head``. The registry loads each backbone once and attaches a lightweight classifier head
+per dataset, so serving all datasets costs one copy of the backbone weights plus a few small
+linear layers.
+"""
+import os
+import threading
+
+import torch
+from torch import nn
+
+from MedViT import merge_bn_and_verify
+from utils import merge_pre_bn
+
+
+class MedViTWithHead(nn.Module):
+    """
+    Dataset-specific view on a shared MedViT backbone: runs the shared feature trunk once and then
+    only this dataset's head. The backbone is not registered as a submodule so that the view's
+    state dict only holds the head weights.
+    """
+
+    def __init__(self, backbone, head):
+        super(MedViTWithHead, self).__init__()
+        self.__dict__['backbone'] = backbone
+        self.head = head
+
+    def forward_features(self, x, stages=None):
+        return self.backbone.forward_features(x, stages=stages)
+
+    def embed(self, x, stages=None):
+        return self.backbone.embed(x, stages=stages)
+
+    def forward(self, x):
+        return self.head(self.backbone.forward_features(x))
+
+
+class MultiHeadMedViT(nn.Module):
+    """
+    A shared backbone together with several dataset heads as one module, used for export. The
+    forward pass runs the trunk once and returns one logits tensor per dataset, in ``datasets`` order.
+    """
+
+    def __init__(self, backbone, heads):
+        super(MultiHeadMedViT, self).__init__()
+        self.backbone = backbone
+        self.heads = nn.ModuleDict(heads)
+        self.datasets = list(heads)
+
+    def forward(self, x):
+        features = self.backbone.forward_features(x)
+        return tuple(self.heads[name](features) for name in self.datasets)
+
+
+class ModelRegistry(object):
+    """
+    Load each backbone once and attach per-dataset heads to it.
+
+    :param load_backbone: callable ``(model_type, checkpoint_path) -> MedViT`` returning an eval-mode
+        model with its ImageNet ``proj_head`` in place. It is called once per backbone key.
+    :param merge_bn: fold BatchNorm layers of the backbone, and its final norm into every head.
+    :param verify_merge: check the folded backbone's logits against the unfolded ones on a random
+        batch (two extra forward passes per backbone load).
+    :param head_dir: optional directory with per-dataset head weights named
+        ``<checkpoint stem>_<dataset>_head.pth`` (a state dict for ``nn.Linear``).
+    :param transform_backbone: optional callable applied to each backbone after BN folding,
+        e.g. quantization. It must return the module to serve.
+    :param transform_head: optional callable applied to each dataset head after it is built.
+    """
+
+    def __init__(self, load_backbone, merge_bn=True, head_dir=None, transform_backbone=None,
+                 transform_head=None, verify_merge=False):
+        self.load_backbone = load_backbone
+        self.merge_bn = merge_bn
+        self.verify_merge = verify_merge
+        self.head_dir = head_dir
+        self.transform_backbone = transform_backbone
+        self.transform_head = transform_head
+        self._backbones = {}
+        self._models = {}
+        self._lock = threading.RLock()
+
+    def get(self, model_type, dataset, num_classes, checkpoint_path=None):
+        """Return a ``MedViTWithHead`` for ``dataset`` on the shared ``model_type`` backbone"""
+        key = (model_type, checkpoint_path, dataset, num_classes)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            if key not in self._models:
+                backbone = self._get_backbone(model_type, checkpoint_path)
+                head = self._build_head(backbone, dataset, num_classes, checkpoint_path)
+                self._models[key] = MedViTWithHead(backbone, head).eval()
+            return self._models[key]
+
+    def stats(self):
+        backbone_params = sum(p.numel() for b in self._backbones.values() for p in b.parameters())
+        head_params = sum(p.numel() for m in self._models.values() for p in m.head.parameters())
+        return {
+            'backbones': len(self._backbones),
+            'heads': len(self._models),
+            'backbone_params': backbone_params,
+            'head_params': head_params,
+        }
+
+    def backbones(self):
+        """``{(model_type, checkpoint_path): backbone}`` of the backbones loaded so far"""
+        return dict(self._backbones)
+
+    def __len__(self):
+        return len(self._models)
+
+    def _get_backbone(self, model_type, checkpoint_path):
+        backbone_key = (model_type, checkpoint_path)
+        if backbone_key not in self._backbones:
+            backbone = self.load_backbone(model_type, checkpoint_path)
+            backbone.eval()
+            # Snapshots converted by checkpoint_loading.py load already folded and are used as is
+            if self.merge_bn and not backbone.is_bn_merged:
+                if self.verify_merge:
+                    backbone, rel_diff = merge_bn_and_verify(backbone)
+                    print(f"✓ Folded BatchNorm layers (relative output diff {rel_diff:.2e})")
+                else:
+                    backbone.merge_bn()
+                    print("✓ Folded BatchNorm layers")
+            if self.transform_backbone is not None:
+                backbone = self.transform_backbone(backbone)
+            self._backbones[backbone_key] = backbone
+        return self._backbones[backbone_key]
+
+    def _build_head(self, backbone, dataset, num_classes, checkpoint_path):
+        original_head = backbone.proj_head[0]
+        if num_classes == original_head.out_features and dataset is None:
+            # ImageNet head, already carries the folded final norm
+            return backbone.proj_head
+
+        head = nn.Sequential(nn.Linear(original_head.in_features, num_classes))
+        head_path = self.head_path(checkpoint_path, dataset)
+        if head_path and os.path.exists(head_path):
+            try:
+                head[0].load_state_dict(torch.load(head_path, map_location='cpu'))
+                print(f"✓ Loaded {dataset} head from {head_path}")
+            except Exception as e:
+                print(f"⚠ Warning: Could not load head for {dataset}: {e}")
+
+        if backbone.is_bn_merged:
+            # The backbone's final norm is folded into each dataset head
+            with torch.no_grad():
+                merge_pre_bn(head[0], backbone.head_norm)
+        if self.transform_head is not None:
+            head = self.transform_head(head)
+        return head.eval()
+
+    def head_path(self, checkpoint_path, dataset):
+        """Path of the unfolded per-dataset head weights for a checkpoint, or None"""
+        if not self.head_dir or not checkpoint_path or not dataset:
+            return None
+        stem = os.path.splitext(os.path.basename(checkpoint_path))[0]
+        return os.path.join(self.head_dir, f"{stem}_{dataset.lower()}_head.pth")
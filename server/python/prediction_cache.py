@@ -0,0 +1,128 @@
+"""
+Content-addressed prediction cache.
+
+Predictions are keyed on a SHA-256 of the raw image bytes together with the dataset, model type
+and image size, so a resubmitted scan is answered without decoding the image or touching torch.
+Entries are evicted least-recently-used once ``max_entries`` is reached and expire after
+``ttl_seconds``. With ``persist_path`` set, entries are also written to a SQLite file and
+reloaded on restart.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(image_bytes, dataset, model_type, image_size, options=None):
+    """
+    Hash the raw image bytes together with the parameters that affect the prediction. ``options``
+    is an optional string for further prediction settings (e.g. test-time augmentation).
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    key = f"{digest}:{dataset}:{model_type}:{image_size}"
+    return f"{key}:{options}" if options else key
+
+
+class PredictionCache(object):
+    """
+    Size-bounded LRU cache with a TTL and optional on-disk persistence.
+
+    :param max_entries: maximum number of cached predictions.
+    :param ttl_seconds: lifetime of an entry, ``None`` to never expire.
+    :param persist_path: optional SQLite file used to keep entries across restarts.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, persist_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._open_db(persist_path)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, created = entry
+            if self._expired(created):
+                self._delete(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (value, created)
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)',
+                                 (key, json.dumps(value), created))
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._delete(oldest)
+                self.evictions += 1
+            if self._db is not None:
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM predictions')
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'persistent': self._db is not None,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM predictions WHERE key = ?', (key,))
+
+    def _open_db(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)')
+        if self.ttl_seconds is not None:
+            self._db.execute('DELETE FROM predictions WHERE created < ?', (time.time() - self.ttl_seconds,))
+        rows = self._db.execute('SELECT key, value, created FROM predictions ORDER BY created DESC LIMIT ?',
+                                (self.max_entries,)).fetchall()
+        for key, value, created in reversed(rows):
+            self._entries[key] = (json.loads(value), created)
+        self._db.execute('DELETE FROM predictions WHERE key NOT IN '
+                         '(SELECT key FROM predictions ORDER BY created DESC LIMIT ?)', (self.max_entries,))
+        self._db.commit()
+        print(f"✓ Loaded {len(self._entries)} cached predictions from {path}")
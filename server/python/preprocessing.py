@@ -0,0 +1,104 @@
+"""
+Image preprocessing for MedViT inference.
+
+Equivalent to Resize((size, size)) -> ToTensor() -> Normalize(mean, std), but cheaper for large
+inputs:
+
+    decode:    JPEGs are decoded with ``Image.draft`` directly at the smallest DCT scale that is still
+               at least ``size`` pixels, instead of at full resolution.
+    resize:    a single PIL bilinear resize to (size, size), giving a uint8 HWC array.
+    normalize: uint8 -> float, /255 and mean/std normalisation fused into one ``addcmul`` per image,
+               which also does the HWC -> CHW transpose and writes into a preallocated batch buffer.
+
+Per-step timings are tracked and reported by ``stats()``.
+"""
+import io
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from utils import SmoothedValue
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class Preprocessor(object):
+    """
+    Decode, resize and normalize images for a model expecting ``mean``/``std`` normalised input.
+    Safe to share between threads; batch buffers are kept per thread and per (batch, size).
+    """
+
+    def __init__(self, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        std = torch.tensor(std).view(3, 1, 1)
+        # x_norm = (x / 255 - mean) / std = x * scale + shift
+        self.scale = 1.0 / (255.0 * std)
+        self.shift = -torch.tensor(mean).view(3, 1, 1) / std
+        self.timings = {step: SmoothedValue(window_size=100, fmt='{avg:.2f}')
+                        for step in ('decode', 'resize', 'normalize')}
+        self._local = threading.local()
+
+    def decode(self, image_data, size=224):
+        """Open encoded image bytes, decoding JPEGs at reduced resolution close to ``size``"""
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(image_data))
+        if image.format == 'JPEG':
+            image.draft('RGB', (size, size))
+        image.load()
+        self._record('decode', start)
+        return image
+
+    def resize(self, image, size=224):
+        """Convert to RGB and resize to (size, size); returns a (3, size, size) uint8 tensor view"""
+        start = time.perf_counter()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.BILINEAR)
+        array = torch.from_numpy(np.array(image)).permute(2, 0, 1)
+        self._record('resize', start)
+        return array
+
+    def normalize(self, images, out=None):
+        """
+        Normalize a list of (3, H, W) uint8 tensors into one (B, 3, H, W) float batch. Writes into
+        ``out`` when given, otherwise into a buffer reused by this thread.
+        """
+        start = time.perf_counter()
+        _, height, width = images[0].shape
+        if out is None:
+            out = self._buffer(len(images), height, width)
+        for i, image in enumerate(images):
+            torch.addcmul(self.shift, image, self.scale, out=out[i])
+        self._record('normalize', start)
+        return out
+
+    def load(self, image_data, size=224):
+        """Decode and resize encoded image bytes to a (3, size, size) uint8 tensor"""
+        return self.resize(self.decode(image_data, size), size)
+
+    def __call__(self, image, size=224):
+        """Preprocess a PIL image or encoded bytes into a new (1, 3, size, size) float tensor"""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = self.decode(bytes(image), size)
+        array = self.resize(image, size)
+        return self.normalize([array], out=torch.empty(1, 3, size, size))
+
+    def stats(self):
+        return {f"{step}_ms": meter.global_avg * 1000.0 if meter.count else 0.0
+                for step, meter in self.timings.items()}
+
+    def _buffer(self, batch_size, height, width):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        key = (batch_size, height, width)
+        if key not in buffers:
+            buffers[key] = torch.empty(batch_size, 3, height, width)
+        return buffers[key]
+
+    def _record(self, step, start):
+        self.timings[step].update(time.perf_counter() - start)
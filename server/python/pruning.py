@@ -0,0 +1,467 @@
+"""
+Structured pruning and knowledge distillation of MedViT students.
+
+A student keeps the teacher's stem and hybrid block layout with fewer blocks per stage
+(``--depths``) and narrower residual streams (``--width``). Channels are removed in whole
+``head_dim`` (32-channel) groups, so every MHCA group convolution and attention head left in the
+student is an unmodified head of the teacher, and every width stays a multiple of 32 as
+``_make_divisible`` and ``ECB`` require. LTB widths follow from their stream width, so their patch
+embedding stays an identity as in the teacher.
+
+The kept teacher weights initialise the student:
+    * residual-stream and MHCA groups are ranked by mean absolute activation on the images,
+    * attention heads by the norm of their output-projection columns,
+    * LocalityFeedForward hidden channels by the scale of their first BatchNorm.
+The student and its dataset head are then distilled on the served teacher's logits, plus
+cross-entropy when the image folder has one sub-folder per class.
+
+    python pruning.py --images data/pathmnist_train --dataset PathMNIST --teacher MedViT-Large \\
+        --depths 2 2 5 2 --width 0.75 0.5 --latency-budget-ms 80
+
+With several ``--width`` values the widest student within ``--latency-budget-ms`` (batch 1, served
+layout) is used. The student is written to ``checkpoints/`` and registered in
+``checkpoints/students.json``, which ``medvit_api.py`` reads to serve it as a new ``model_type``
+(``MedViT-Student-<dataset>`` unless ``--model-type`` is given).
+"""
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from MedViT import LTB, MedViT, _make_divisible
+
+HEAD_DIM = 32
+STEM_CHANNELS = [64, 32, 64]
+STREAM_CHANNELS = (96, 192, 384, 768)
+
+
+def ltb_out_channels(stream_channels, mix_block_ratio=0.75):
+    """Smallest LTB width whose MHSA part is ``stream_channels`` wide"""
+    out = stream_channels + HEAD_DIM
+    while _make_divisible(int(out * mix_block_ratio), 32) < stream_channels:
+        out += HEAD_DIM
+    if _make_divisible(int(out * mix_block_ratio), 32) != stream_channels:
+        raise ValueError(f"No LTB width keeps a {stream_channels}-channel stream; use a wider student")
+    return out
+
+
+def student_arch(depths, width):
+    """MedViT constructor arguments for a student with ``depths`` and stream width ratio ``width``"""
+    if len(depths) != 4 or depths[0] < 1 or depths[1] < 2 or depths[3] < 2 or depths[2] < 5 or depths[2] % 5:
+        raise ValueError(f"Student depths {depths}: stages 1 and 3 need >= 2 blocks, stage 2 a multiple of 5")
+    streams = [_make_divisible(channels * width, HEAD_DIM) for channels in STREAM_CHANNELS]
+    if streams[0] == STEM_CHANNELS[-1]:
+        # The first block would lose the patch embedding it inherits from the teacher
+        streams[0] += HEAD_DIM
+    ltb = {stage: ltb_out_channels(streams[stage]) for stage in (1, 2, 3)}
+    return {
+        'stem_chs': list(STEM_CHANNELS),
+        'depths': list(depths),
+        'stage_out_channels': [[streams[0]] * depths[0],
+                               [streams[1]] * (depths[1] - 1) + [ltb[1]],
+                               ([streams[2]] * 4 + [ltb[2]]) * (depths[2] // 5),
+                               [streams[3]] * (depths[3] - 1) + [ltb[3]]],
+    }
+
+
+def build_student(arch, num_classes=1000, use_sdpa=False, init_weights=False):
+    return MedViT(path_dropout=0., num_classes=num_classes, use_sdpa=use_sdpa, init_weights=init_weights,
+                  **arch)
+
+
+def stage_depths(model):
+    ends = [-1] + list(model.stage_out_idx)
+    return [ends[i + 1] - ends[i] for i in range(len(ends) - 1)]
+
+
+def _spaced(candidates, count):
+    if count == 1:
+        return candidates[:1]
+    return [candidates[round(i * (len(candidates) - 1) / (count - 1))] for i in range(count)]
+
+
+def select_blocks(teacher_depths, student_depths):
+    """
+    Teacher block kept for every student block. Each stage keeps its first block (stride / width
+    change) and its final LTB; stage 2 keeps whole ECB x4 + LTB groups.
+    """
+    blocks, start = [], 0
+    for stage, (teacher, student) in enumerate(zip(teacher_depths, student_depths)):
+        if student > teacher:
+            raise ValueError(f"Student stage {stage} has more blocks ({student}) than the teacher ({teacher})")
+        if stage == 0:
+            kept = _spaced(list(range(teacher)), student)
+        elif stage == 2:
+            groups = _spaced(list(range(teacher // 5)), student // 5)
+            kept = [5 * group + i for group in groups for i in range(5)]
+        else:
+            kept = _spaced(list(range(teacher - 1)), student - 1) + [teacher - 1]
+        blocks.extend(start + i for i in kept)
+        start += teacher
+    return blocks
+
+
+@torch.no_grad()
+def activation_importance(model, batches):
+    """Mean absolute activation per channel at the output of every block"""
+    sums = {}
+
+    def record(idx):
+        def hook(module, inputs, output):
+            sums[idx] = sums.get(idx, 0) + output.abs().mean(dim=(0, 2, 3))
+        return hook
+
+    hooks = [layer.register_forward_hook(record(idx)) for idx, layer in enumerate(model.features)]
+    try:
+        for batch in batches:
+            model.forward_features(batch)
+    finally:
+        for handle in hooks:
+            handle.remove()
+    return sums
+
+
+def _has_patch_conv(block):
+    return isinstance(block.patch_embed.conv, nn.Conv2d)
+
+
+def _top_groups(scores, count):
+    """Channel indices of the ``count // HEAD_DIM`` highest scoring whole groups, in original order"""
+    groups = scores.view(-1, HEAD_DIM).sum(dim=1).topk(count // HEAD_DIM).indices.sort().values
+    return (groups[:, None] * HEAD_DIM + torch.arange(HEAD_DIM)).flatten()
+
+
+def _top_channels(scores, count):
+    return scores.topk(count).indices.sort().values
+
+
+def _take(tensor, out_idx=None, in_idx=None):
+    if out_idx is not None:
+        tensor = tensor.index_select(0, out_idx)
+    if in_idx is not None:
+        tensor = tensor.index_select(1, in_idx)
+    return tensor
+
+
+def _copy_layer(dst, src, out_idx=None, in_idx=None):
+    """Copy the kept output rows / input channels of a convolution or linear layer"""
+    dst.weight.copy_(_take(src.weight, out_idx, in_idx))
+    if src.bias is not None:
+        dst.bias.copy_(_take(src.bias, out_idx))
+
+
+def _copy_bn(dst, src, idx):
+    for name in ('weight', 'bias', 'running_mean', 'running_var'):
+        getattr(dst, name).copy_(_take(getattr(src, name), idx))
+
+
+def _prune_mhca(dst, src, idx):
+    _copy_layer(dst.group_conv3x3, src.group_conv3x3, idx)
+    _copy_bn(dst.norm, src.norm, idx)
+    _copy_layer(dst.projection, src.projection, idx, idx)
+
+
+def _prune_feed_forward(dst, src, idx):
+    first, bn1, _, depthwise, bn2, _, se, last, bn3 = src.conv
+    dst_first, dst_bn1, _, dst_depthwise, dst_bn2, _, dst_se, dst_last, dst_bn3 = dst.conv
+    hidden = _top_channels(bn1.weight.abs(), dst_first.out_channels)
+    _copy_layer(dst_first, first, hidden, idx)
+    _copy_bn(dst_bn1, bn1, hidden)
+    _copy_layer(dst_depthwise, depthwise, hidden)
+    _copy_bn(dst_bn2, bn2, hidden)
+    _copy_layer(dst_se.fc[0], se.fc[0], None, hidden)
+    _copy_layer(dst_se.fc[2], se.fc[2], hidden)
+    _copy_layer(dst_last, last, idx, hidden)
+    _copy_bn(dst_bn3, bn3, idx)
+
+
+def _projection_rows(attention):
+    """``{part: (layer, first row)}`` of the q / k / v projections, separate (E_MHSA) or packed (E_MHSA_SDPA)"""
+    if hasattr(attention, 'qkv'):
+        return {part: (attention.qkv, i * attention.dim) for i, part in enumerate('qkv')}
+    if hasattr(attention, 'kv'):
+        return {'q': (attention.q, 0), 'k': (attention.kv, 0), 'v': (attention.kv, attention.dim)}
+    return {part: (getattr(attention, part), 0) for part in 'qkv'}
+
+
+def _prune_attention(dst, src, idx):
+    heads = _top_groups(src.proj.weight.pow(2).sum(dim=0), dst.dim)
+    # Copied part by part, so teacher and student may use different attention classes
+    dst_rows = _projection_rows(dst)
+    for part, (src_layer, src_start) in _projection_rows(src).items():
+        dst_layer, dst_start = dst_rows[part]
+        rows = slice(dst_start, dst_start + dst.dim)
+        dst_layer.weight[rows] = _take(src_layer.weight, src_start + heads, idx)
+        if src_layer.bias is not None:
+            dst_layer.bias[rows] = _take(src_layer.bias, src_start + heads)
+    _copy_layer(dst.proj, src.proj, idx, heads)
+    if src.sr_ratio > 1:
+        _copy_bn(dst.norm, src.norm, idx)
+
+
+def _prune_ecb(dst, src, in_idx, scores):
+    if _has_patch_conv(src):
+        out_idx = _top_groups(scores[:src.out_channels], dst.out_channels)
+        _copy_layer(dst.patch_embed.conv, src.patch_embed.conv, out_idx, in_idx)
+        _copy_bn(dst.patch_embed.norm, src.patch_embed.norm, out_idx)
+    else:
+        out_idx = in_idx
+    _prune_mhca(dst.mhca, src.mhca, out_idx)
+    _copy_bn(dst.norm, src.norm, out_idx)
+    _prune_feed_forward(dst.conv, src.conv, out_idx)
+    return out_idx
+
+
+def _prune_ltb(dst, src, in_idx, scores):
+    if _has_patch_conv(src):
+        mhsa_idx = _top_groups(scores[:src.mhsa_out_channels], dst.mhsa_out_channels)
+        _copy_layer(dst.patch_embed.conv, src.patch_embed.conv, mhsa_idx, in_idx)
+        _copy_bn(dst.patch_embed.norm, src.patch_embed.norm, mhsa_idx)
+    else:
+        mhsa_idx = in_idx
+    _copy_bn(dst.norm1, src.norm1, mhsa_idx)
+    _prune_attention(dst.e_mhsa, src.e_mhsa, mhsa_idx)
+
+    mhca_idx = _top_groups(scores[src.mhsa_out_channels:], dst.mhca_out_channels)
+    _copy_layer(dst.projection.conv, src.projection.conv, mhca_idx, mhsa_idx)
+    _copy_bn(dst.projection.norm, src.projection.norm, mhca_idx)
+    _prune_mhca(dst.mhca, src.mhca, mhca_idx)
+
+    out_idx = torch.cat([mhsa_idx, src.mhsa_out_channels + mhca_idx])
+    _copy_bn(dst.norm2, src.norm2, out_idx)
+    _prune_feed_forward(dst.conv, src.conv, out_idx)
+    return out_idx
+
+
+@torch.no_grad()
+def prune(teacher, arch, batches, use_sdpa=False):
+    """
+    Build a student with ``arch`` (see ``student_arch``) initialised from the kept weights of an
+    unfolded ``teacher``. Returns ``(student, channels)`` where ``channels`` are the teacher's final
+    feature channels the student keeps, for slicing classifier heads.
+    """
+    if teacher.is_bn_merged:
+        raise ValueError("Prune the unfolded teacher; BatchNorm statistics are needed")
+    teacher.eval()
+    student = build_student(arch, teacher.proj_head[0].out_features, use_sdpa=use_sdpa).eval()
+    student.stem.load_state_dict(teacher.stem.state_dict())
+
+    # A residual stream runs until the next block with its own patch embedding; its channels are
+    # ranked by the activations at the end of the stream
+    importance = activation_importance(teacher, batches)
+    stream_end = list(range(len(teacher.features)))
+    for idx in reversed(range(len(teacher.features) - 1)):
+        if not _has_patch_conv(teacher.features[idx + 1]):
+            stream_end[idx] = stream_end[idx + 1]
+
+    channels = torch.arange(arch['stem_chs'][-1])
+    for dst, teacher_idx in zip(student.features, select_blocks(stage_depths(teacher), arch['depths'])):
+        src = teacher.features[teacher_idx]
+        if _has_patch_conv(dst) != _has_patch_conv(src):
+            raise ValueError(f"Student block {type(dst).__name__} does not match teacher block {teacher_idx}")
+        prune_block = _prune_ltb if isinstance(src, LTB) else _prune_ecb
+        channels = prune_block(dst, src, channels, importance[stream_end[teacher_idx]])
+    _copy_bn(student.norm, teacher.norm, channels)
+    _copy_layer(student.proj_head[0], teacher.proj_head[0], None, channels)
+    return student, channels
+
+
+@torch.no_grad()
+def measure_latency(model, image_size=224, warmup=2, iterations=5):
+    """Median batch-1 seconds of ``model`` in the served (inference, channels_last) form"""
+    served = copy.deepcopy(model).to_inference().to_channels_last()
+    x = torch.randn(1, 3, image_size, image_size)
+    for _ in range(warmup):
+        served(x)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        served(x)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def choose_arch(depths, widths, latency_budget_ms=None, image_size=224, use_sdpa=False):
+    """Widest student architecture within the latency budget; returns ``(arch, width, seconds)``"""
+    for width in sorted(widths, reverse=True):
+        arch = student_arch(depths, width)
+        latency = measure_latency(build_student(arch, use_sdpa=use_sdpa), image_size)
+        print(f"  width {width}: {latency * 1000:.1f} ms")
+        if latency_budget_ms is None or latency * 1000 <= latency_budget_ms:
+            return arch, width, latency
+    raise ValueError(f"No student with widths {widths} and depths {depths} fits {latency_budget_ms} ms")
+
+
+def distill(student, head, batches, teacher_logits, labels=None, epochs=10, lr=1e-4, temperature=2.0,
+            alpha=0.5, val_fraction=0.2):
+    """
+    Train ``student`` and its classifier ``head`` (applied to pooled features) on the teacher's
+    logits, with random horizontal flips. The state with the best top-1 agreement on the held-out
+    batches is kept. Returns a report.
+    """
+    val_batches = max(1, int(len(batches) * val_fraction)) if len(batches) > 1 else 0
+    split = len(batches) - val_batches
+    offsets = [0]
+    for batch in batches:
+        offsets.append(offsets[-1] + batch.shape[0])
+
+    def targets(i):
+        return teacher_logits[offsets[i]:offsets[i + 1]], None if labels is None else labels[offsets[i]:offsets[i + 1]]
+
+    @torch.no_grad()
+    def evaluate():
+        student.eval()
+        agree = correct = count = 0
+        for i in range(split, len(batches)) if val_batches else range(len(batches)):
+            logits, batch_labels = targets(i)
+            prediction = head(student.forward_features(batches[i])).argmax(1)
+            agree += (prediction == logits.argmax(1)).sum().item()
+            if batch_labels is not None:
+                correct += (prediction == batch_labels).sum().item()
+            count += prediction.numel()
+        return agree / count, (correct / count if labels is not None else None)
+
+    parameters = list(student.parameters()) + list(head.parameters())
+    optimizer = torch.optim.AdamW(parameters, lr=lr, weight_decay=0.05)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, max(1, epochs * split))
+    best_agreement, best_accuracy = evaluate()
+    report = {'initial_agreement': best_agreement}
+    best_state = copy.deepcopy((student.state_dict(), head.state_dict()))
+    for epoch in range(epochs):
+        student.train()
+        head.train()
+        for i in torch.randperm(split).tolist():
+            x = batches[i]
+            flip = torch.rand(x.shape[0]) < 0.5
+            x = torch.where(flip[:, None, None, None], x.flip(-1), x)
+            logits, batch_labels = targets(i)
+            student_logits = head(student.forward_features(x))
+            loss = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                            F.softmax(logits / temperature, dim=1), reduction='batchmean') * temperature ** 2
+            if batch_labels is not None:
+                loss = alpha * loss + (1 - alpha) * F.cross_entropy(student_logits, batch_labels)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+        agreement, accuracy = evaluate()
+        print(f"  epoch {epoch + 1}/{epochs}: loss {loss.item():.4f}, agreement {agreement:.4f}")
+        if agreement > best_agreement:
+            best_agreement, best_accuracy = agreement, accuracy
+            best_state = copy.deepcopy((student.state_dict(), head.state_dict()))
+
+    student.load_state_dict(best_state[0])
+    head.load_state_dict(best_state[1])
+    student.eval()
+    head.eval()
+    report['agreement'] = best_agreement
+    if best_accuracy is not None:
+        report['accuracy'] = best_accuracy
+    return report
+
+
+def load_students(path):
+    """Registered students: ``{model_type: {'checkpoint', 'arch', ...}}``"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def register_student(path, model_type, entry):
+    students = load_students(path)
+    students[model_type] = entry
+    with open(path + '.tmp', 'w') as f:
+        json.dump(students, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prune and distil a MedViT student for one dataset')
+    parser.add_argument('--images', required=True, help='image folder, optionally one sub-folder per class')
+    parser.add_argument('--dataset', default='PathMNIST')
+    parser.add_argument('--teacher', default='MedViT-Large')
+    parser.add_argument('--model-type', default=None, help='served name, default MedViT-Student-<dataset>')
+    parser.add_argument('--depths', type=int, nargs=4, default=[2, 2, 5, 2])
+    parser.add_argument('--width', type=float, nargs='+', default=[0.5],
+                        help='stream width ratio(s); the widest within --latency-budget-ms is used')
+    parser.add_argument('--latency-budget-ms', type=float, default=None)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    from medvit_api import (CHECKPOINT_DIR, CHECKPOINT_FILES, CLASS_LABELS, STUDENTS_PATH, USE_SDPA, get_model,
+                            load_backbone, model_registry, preprocess_image)
+    from quantization import list_images, load_batches
+
+    class_labels = CLASS_LABELS.get(args.dataset)
+    items = list_images(args.images)
+    if not items:
+        raise SystemExit(f"No images found in {args.images}")
+    labels = None
+    if class_labels and all(label in class_labels for _, label in items):
+        labels = torch.tensor([class_labels.index(label) for _, label in items])
+    else:
+        print("⚠ Folder names are not class labels; distilling on the teacher's predictions only")
+    batches = load_batches(items, preprocess_image, args.image_size, args.batch_size)
+
+    print(f"Choosing a student architecture (depths {args.depths}):")
+    arch, width, latency = choose_arch(args.depths, args.width, args.latency_budget_ms, args.image_size, USE_SDPA)
+
+    teacher_checkpoint = os.path.join(CHECKPOINT_DIR, CHECKPOINT_FILES[args.teacher])
+    served_teacher = get_model(args.teacher, len(class_labels), dataset=args.dataset)
+    with torch.no_grad():
+        teacher_logits = torch.cat([served_teacher(batch) for batch in batches])
+
+    # The unfolded .pth: a converted .safetensors snapshot has its BatchNorm statistics folded away
+    teacher = load_backbone(args.teacher, teacher_checkpoint, fast=False)
+    teacher_latency = measure_latency(teacher, args.image_size)
+    student, channels = prune(teacher, arch, batches, use_sdpa=USE_SDPA)
+    teacher_head = nn.Linear(teacher.proj_head[0].in_features, len(class_labels))
+    head_path = model_registry.head_path(teacher_checkpoint, args.dataset)
+    if head_path and os.path.exists(head_path):
+        teacher_head.load_state_dict(torch.load(head_path, map_location='cpu'))
+    else:
+        print(f"⚠ No trained {args.dataset} head for {args.teacher}; the student head starts from random weights")
+    head = nn.Linear(student.proj_head[0].in_features, len(class_labels))
+    with torch.no_grad():
+        _copy_layer(head, teacher_head, None, channels)
+    del teacher
+
+    report = distill(student, head, batches, teacher_logits, labels, epochs=args.epochs, lr=args.lr)
+
+    model_type = args.model_type or f"MedViT-Student-{args.dataset}"
+    checkpoint_file = model_type.lower().replace('-', '_') + '.pth'
+    checkpoint_path = os.path.join(CHECKPOINT_DIR, checkpoint_file)
+    torch.save({'model': student.state_dict()}, checkpoint_path)
+    torch.save(head.state_dict(), model_registry.head_path(checkpoint_path, args.dataset))
+    register_student(STUDENTS_PATH, model_type, {
+        'checkpoint': checkpoint_file,
+        'arch': arch,
+        'teacher': args.teacher,
+        'dataset': args.dataset,
+        'width': width,
+    })
+
+    report.update({
+        'student_params_m': sum(p.numel() for p in student.parameters()) / 1e6,
+        'student_ms': latency * 1000,
+        'teacher_ms': teacher_latency * 1000,
+    })
+    print("=" * 60)
+    print(f"Student {model_type} - {args.teacher} / {args.dataset}, width {width}, depths {args.depths}")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+    print(f"✓ Wrote {checkpoint_path} and registered {model_type} in {STUDENTS_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+INT8 post-training quantization for MedViT CPU serving.
+
+Two modes are supported:
+    dynamic: ``nn.Linear`` layers (E_MHSA q/k/v/proj, SELayer.fc, classifier heads) get INT8 weights
+             and dynamically quantized activations.
+    static:  additionally quantizes the 1x1 convolutions in LocalityFeedForward and PatchEmbed with
+             activation ranges calibrated on a small image folder.
+
+Quantize after BatchNorm folding so the quantized layers see the folded weights.
+
+Usage (calibration + accuracy report against the FP32 model):
+    python quantization.py --images path/to/folder --dataset PathMNIST --model-type MedViT-Large --mode static
+"""
+import argparse
+import copy
+import os
+
+import torch
+from torch import nn
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, get_default_qconfig, prepare, quantize_dynamic
+
+from MedViT import LocalityFeedForward, PatchEmbed
+from model_registry import MedViTWithHead
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class QuantizedPointwiseConv(nn.Module):
+    """Wrap a 1x1 convolution with quant/dequant stubs for eager-mode static quantization"""
+
+    def __init__(self, conv):
+        super(QuantizedPointwiseConv, self).__init__()
+        self.quant = QuantStub()
+        self.conv = conv
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+def _wrap_pointwise_convs(model, qconfig):
+    """Replace the 1x1 convs of LocalityFeedForward / PatchEmbed with quantizable wrappers"""
+    wrapped = 0
+    for module in model.modules():
+        if isinstance(module, LocalityFeedForward):
+            for i, layer in enumerate(module.conv):
+                if isinstance(layer, nn.Conv2d) and layer.kernel_size == (1, 1) and layer.groups == 1:
+                    module.conv[i] = QuantizedPointwiseConv(layer)
+                    module.conv[i].qconfig = qconfig
+                    wrapped += 1
+        elif isinstance(module, PatchEmbed) and isinstance(module.conv, nn.Conv2d):
+            module.conv = QuantizedPointwiseConv(module.conv)
+            module.conv.qconfig = qconfig
+            wrapped += 1
+    return wrapped
+
+
+@torch.no_grad()
+def quantize_model(model, mode='dynamic', calibration_batches=None, engine='x86'):
+    """
+    Return an INT8 copy of ``model``.
+
+    :param mode: 'dynamic' (Linear layers only) or 'static' (Linear layers and 1x1 convolutions).
+    :param calibration_batches: iterable of input tensors, required for 'static'.
+    :param engine: quantized backend, 'x86'/'fbgemm' on Intel/AMD or 'qnnpack' on ARM.
+    """
+    if mode not in ('dynamic', 'static'):
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    torch.backends.quantized.engine = engine
+
+    model = copy.deepcopy(model).eval()
+    if mode == 'static':
+        if calibration_batches is None:
+            raise ValueError("Static quantization needs calibration images")
+        _wrap_pointwise_convs(model, get_default_qconfig(engine))
+        prepare(model, inplace=True)
+        for batch in calibration_batches:
+            model(batch)
+        convert(model, inplace=True)
+
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=False)
+
+
+def quantize_with_head(model, mode='dynamic', calibration_batches=None, engine='x86'):
+    """Quantize a ``MedViTWithHead``: the backbone and the dataset head are quantized separately"""
+    backbone = quantize_model(model.backbone, mode, calibration_batches, engine)
+    head = quantize_model(model.head, 'dynamic', engine=engine)
+    return MedViTWithHead(backbone, head).eval()
+
+
+def model_size_mb(model):
+    """Serialized state dict size, which reflects packed INT8 weights"""
+    import io
+    buffer = io.BytesIO()
+    state_dict = model.state_dict()
+    if isinstance(model, MedViTWithHead):
+        state_dict.update(model.backbone.state_dict())
+    torch.save(state_dict, buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+def list_images(folder):
+    """Return (path, label) pairs; the label is the sub-directory name, or None for flat folders"""
+    items = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                label = os.path.basename(root) if os.path.abspath(root) != os.path.abspath(folder) else None
+                items.append((os.path.join(root, name), label))
+    return items
+
+
+def load_batches(items, preprocess, image_size=224, batch_size=8):
+    from PIL import Image
+
+    batches = []
+    for start in range(0, len(items), batch_size):
+        tensors = [preprocess(Image.open(path), image_size) for path, _ in items[start:start + batch_size]]
+        batches.append(torch.cat(tensors, dim=0))
+    return batches
+
+
+@torch.no_grad()
+def accuracy_report(fp32_model, int8_model, batches, labels=None, class_labels=None):
+    """
+    Compare INT8 against FP32 predictions: top-1 agreement, mean/max absolute probability delta,
+    and accuracy of both models when ground-truth labels are available.
+    """
+    import time
+
+    fp32_probs, int8_probs = [], []
+    fp32_time = int8_time = 0.0
+    for batch in batches:
+        start = time.perf_counter()
+        fp32_probs.append(fp32_model(batch).softmax(dim=1))
+        fp32_time += time.perf_counter() - start
+        start = time.perf_counter()
+        int8_probs.append(int8_model(batch).softmax(dim=1))
+        int8_time += time.perf_counter() - start
+    fp32_probs, int8_probs = torch.cat(fp32_probs), torch.cat(int8_probs)
+    delta = (fp32_probs - int8_probs).abs()
+
+    report = {
+        'images': fp32_probs.shape[0],
+        'top1_agreement': (fp32_probs.argmax(1) == int8_probs.argmax(1)).float().mean().item(),
+        'mean_abs_prob_delta': delta.mean().item(),
+        'max_abs_prob_delta': delta.max().item(),
+        'fp32_seconds': fp32_time,
+        'int8_seconds': int8_time,
+        'fp32_size_mb': model_size_mb(fp32_model),
+        'int8_size_mb': model_size_mb(int8_model),
+    }
+    if labels and class_labels and all(label in class_labels for label in labels):
+        target = torch.tensor([class_labels.index(label) for label in labels])
+        report['fp32_accuracy'] = (fp32_probs.argmax(1) == target).float().mean().item()
+        report['int8_accuracy'] = (int8_probs.argmax(1) == target).float().mean().item()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate and evaluate INT8 MedViT')
+    parser.add_argument('--images', required=True, help='image folder, optionally one sub-folder per class')
+    parser.add_argument('--dataset', default='PathMNIST')
+    parser.add_argument('--model-type', default='MedViT-Large')
+    parser.add_argument('--mode', default='static', choices=['dynamic', 'static'])
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--calibration-images', type=int, default=64,
+                        help='number of images used for calibration; the rest are used for the report')
+    args = parser.parse_args()
+
+    from medvit_api import CHECKPOINT_DIR, CLASS_LABELS, default_checkpoint, load_backbone, preprocess_image
+    from model_registry import ModelRegistry
+
+    class_labels = CLASS_LABELS.get(args.dataset)
+    items = list_images(args.images)
+    if not items:
+        raise SystemExit(f"No images found in {args.images}")
+    calibration_items = items[:args.calibration_images]
+    eval_items = items[args.calibration_images:] or calibration_items
+
+    # Same order as quantize_backbone in the API: load, fold BatchNorm, quantize. get_model would return
+    # a served model that is already converted with to_inference/to_channels_last (or quantized).
+    registry = ModelRegistry(load_backbone, merge_bn=True, head_dir=CHECKPOINT_DIR)
+    fp32_model = registry.get(args.model_type, args.dataset, len(class_labels), default_checkpoint(args.model_type))
+    calibration = load_batches(calibration_items, preprocess_image, args.image_size, args.batch_size)
+    int8_model = quantize_with_head(fp32_model, args.mode, calibration)
+
+    batches = load_batches(eval_items, preprocess_image, args.image_size, args.batch_size)
+    report = accuracy_report(fp32_model, int8_model, batches, [label for _, label in eval_items], class_labels)
+    print("=" * 60)
+    print(f"INT8 ({args.mode}) vs FP32 - {args.model_type} / {args.dataset}")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Test-time augmentation for MedViT predictions.
+
+All views of an image (flips and crops) are stacked into one ``(V, 3, H, W)`` batch and classified
+in a single forward pass. The per-view probabilities are reduced to one prediction, and the
+fraction of views whose top-1 class matches the aggregate is reported as agreement.
+"""
+import torch
+import torch.nn.functional as F
+
+DEFAULT_VIEWS = ('identity', 'hflip', 'vflip', 'center_crop')
+CROP_SCALE = 0.875
+REDUCTIONS = ('mean', 'geometric', 'max')
+
+
+def _crop(x, top, left, size):
+    h, w = x.shape[-2:]
+    crop = x[..., top:top + size[0], left:left + size[1]]
+    return F.interpolate(crop, size=(h, w), mode='bilinear', align_corners=False)
+
+
+def _corner_crop(corner):
+    def view(x):
+        h, w = x.shape[-2:]
+        ch, cw = int(round(h * CROP_SCALE)), int(round(w * CROP_SCALE))
+        top = 0 if corner[0] == 't' else h - ch
+        left = 0 if corner[1] == 'l' else w - cw
+        return _crop(x, top, left, (ch, cw))
+    return view
+
+
+def _center_crop(x):
+    h, w = x.shape[-2:]
+    ch, cw = int(round(h * CROP_SCALE)), int(round(w * CROP_SCALE))
+    return _crop(x, (h - ch) // 2, (w - cw) // 2, (ch, cw))
+
+
+VIEWS = {
+    'identity': lambda x: x,
+    'hflip': lambda x: x.flip(-1),
+    'vflip': lambda x: x.flip(-2),
+    'rot180': lambda x: x.flip(-2, -1),
+    'center_crop': _center_crop,
+    'crop_tl': _corner_crop('tl'),
+    'crop_tr': _corner_crop('tr'),
+    'crop_bl': _corner_crop('bl'),
+    'crop_br': _corner_crop('br'),
+}
+
+
+def parse_views(value):
+    """``True``/"true" selects DEFAULT_VIEWS, otherwise a comma-separated list or sequence of view names"""
+    if value is True or str(value).lower() in ('1', 'true', 'yes'):
+        return DEFAULT_VIEWS
+    views = tuple(v.strip() for v in value.split(',')) if isinstance(value, str) else tuple(value)
+    unknown = [v for v in views if v not in VIEWS]
+    if unknown or not views:
+        raise ValueError(f"Unknown TTA views {unknown}; choose from {sorted(VIEWS)}")
+    return views
+
+
+def make_views(x, views):
+    """Stack the requested views of a preprocessed ``(1, 3, H, W)`` image into one batch"""
+    return torch.cat([VIEWS[view](x) for view in views], dim=0)
+
+
+def aggregate(probs, reduction='mean'):
+    """Reduce ``(V, C)`` per-view probabilities to ``(C,)``"""
+    if reduction == 'mean':
+        return probs.mean(dim=0)
+    if reduction == 'geometric':
+        return F.softmax(probs.clamp_min(1e-12).log().mean(dim=0), dim=0)
+    if reduction == 'max':
+        combined = probs.max(dim=0).values
+        return combined / combined.sum()
+    raise ValueError(f"Unknown TTA reduction {reduction}; choose from {REDUCTIONS}")
+
+
+@torch.no_grad()
+def predict_tta(run, x, views=DEFAULT_VIEWS, reduction='mean', top_k=5, class_labels=None):
+    """
+    Classify every view of ``x`` with one call of ``run`` (a batch -> logits callable). Returns
+    ``(top_probs, top_indices, info)`` for the aggregated prediction.
+    """
+    probs = F.softmax(run(make_views(x, views)), dim=1)
+    combined = aggregate(probs, reduction)
+    top_probs, top_indices = torch.topk(combined, min(top_k, combined.shape[0]))
+
+    view_probs, view_indices = probs.max(dim=1)
+    per_view = []
+    for view, prob, index in zip(views, view_probs.tolist(), view_indices.tolist()):
+        name = class_labels[index] if class_labels and index < len(class_labels) else f"Class {index}"
+        per_view.append({'view': view, 'class': name, 'confidence': prob * 100})
+    info = {
+        'views': list(views),
+        'reduction': reduction,
+        'agreement': (view_indices == top_indices[0]).float().mean().item(),
+        'per_view': per_view,
+    }
+    return top_probs.tolist(), top_indices.tolist(), info
@@ -241,7 +241,7 @@ def merge_pre_bn(module, pre_bn_1, pre_bn_2=None):
     """
     weight = module.weight.data
     if module.bias is None:
-        zeros = torch.zeros(module.out_channels, device=weight.device).type(weight.type())
+        zeros = torch.zeros(module.out_channels, device=weight.device, dtype=weight.dtype)
         module.bias = nn.Parameter(zeros)
     bias = module.bias.data
     if pre_bn_2 is None:
@@ -278,6 +278,28 @@ def merge_pre_bn(module, pre_bn_1, pre_bn_2=None):
     module.weight.data = weight
     module.bias.data = bias
 
+def merge_post_bn(module, post_bn):
+    """ Merge post BN (conv -> bn) into the preceding conv to reduce inference runtime.
+    """
+    assert post_bn.track_running_stats is True, "Unsupport bn_module.track_running_stats is False"
+    assert post_bn.affine is True, "Unsupport bn_module.affine is False"
+
+    weight = module.weight.data
+    if module.bias is None:
+        zeros = torch.zeros(weight.shape[0], device=weight.device, dtype=weight.dtype)
+        module.bias = nn.Parameter(zeros)
+    bias = module.bias.data
+
+    scale_invstd = post_bn.running_var.add(post_bn.eps).pow(-0.5)
+    extra_weight = scale_invstd * post_bn.weight
+    extra_bias = post_bn.bias - post_bn.weight * post_bn.running_mean * scale_invstd
+
+    weight.mul_(extra_weight.view(-1, *([1] * (weight.dim() - 1))))
+    bias.mul_(extra_weight).add_(extra_bias)
+
+    module.weight.data = weight
+    module.bias.data = bias
+
 def cal_flops_params_with_fvcore(model, inputs):
     from fvcore.nn import FlopCountAnalysis, parameter_count_table, parameter_count
     flops = FlopCountAnalysis(model, inputs)
@@ -0,0 +1,304 @@
+"""
+Nearest-case lookup over MedViT embeddings.
+
+Vectors are L2-normalised ``MedViT.embed`` outputs, so cosine similarity is a dot product. An
+index directory holds:
+
+    vectors.f16      memory-mapped float16 matrix (capacity x dim), grown by doubling
+    lists.i32        memory-mapped IVF list id of every vector (-1 before training)
+    centroids.npy    IVF centroids (spherical k-means on a sample of the vectors)
+    items.jsonl      one JSON object per vector (path, label, ...), in row order
+    meta.json        dimension, committed vector count and the model that produced them
+
+Queries probe the ``nprobe`` closest IVF lists, or scan every vector until the index has been
+trained (the bulk job trains once MIN_TRAIN_VECTORS are stored). New vectors are assigned to their
+nearest centroid on insert, so the index never needs a full rebuild; ``train`` can be re-run when
+the collection has grown a lot.
+
+The bulk indexing job embeds an image folder in batches and commits after every batch; rerunning
+it skips images that are already indexed:
+    python vector_index.py --images data/archive --index-dir checkpoints/vector_index --model-type MedViT-Large
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+MIN_CAPACITY = 1024
+MIN_TRAIN_VECTORS = 4096
+TRAIN_SAMPLE = 65536
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+def spherical_kmeans(vectors, num_centroids, iterations=10, seed=0):
+    """Unit-norm centroids maximising the dot product with their assigned (unit-norm) vectors"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_centroids, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = np.linalg.norm(sums, axis=1) == 0
+        # Re-seed empty clusters with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class VectorIndex(object):
+    """
+    Memory-mapped float16 IVF index. Safe to share between threads.
+
+    :param index_dir: directory holding the index files, created if missing.
+    :param dim: vector dimension, required when creating a new index.
+    :param metadata: extra fields stored in meta.json of a new index (e.g. model_type, image_size).
+    """
+
+    def __init__(self, index_dir, dim=None, metadata=None):
+        self.index_dir = index_dir
+        self._lock = threading.RLock()
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if dim is None:
+                raise ValueError(f"No index in {index_dir}; pass dim to create one")
+            os.makedirs(index_dir, exist_ok=True)
+            self.meta = dict(metadata or {}, dim=int(dim), count=0, capacity=0)
+        self.dim = self.meta['dim']
+        self.count = self.meta['count']
+
+        self._open_storage(max(self.meta['capacity'], MIN_CAPACITY))
+        self.items = self._read_items()
+        centroids_path = os.path.join(index_dir, 'centroids.npy')
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._build_lists()
+        self.query_times = []
+
+    def add(self, vectors, items):
+        """Append vectors (normalised here) with one metadata dict each; returns their row ids"""
+        vectors = _normalize(vectors).reshape(-1, self.dim)
+        if len(vectors) != len(items):
+            raise ValueError("Need one item per vector")
+        with self._lock:
+            start, end = self.count, self.count + len(vectors)
+            if end > self.capacity:
+                self._open_storage(max(end, self.capacity * 2))
+            self.vectors[start:end] = vectors.astype(np.float16)
+            if self.centroids is not None:
+                assignments = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+                self.list_ids[start:end] = assignments
+                for row, list_id in enumerate(assignments, start):
+                    self._lists[list_id].append(row)
+            else:
+                self.list_ids[start:end] = -1
+            self.vectors.flush()
+            self.list_ids.flush()
+            with open(os.path.join(self.index_dir, 'items.jsonl'), 'a') as f:
+                for item in items:
+                    f.write(json.dumps(item) + '\n')
+            self.items.extend(items)
+            self.count = end
+            self._write_meta()
+            return list(range(start, end))
+
+    def train(self, num_lists=None, iterations=10):
+        """Fit IVF centroids on (a sample of) the stored vectors and assign every vector to a list"""
+        with self._lock:
+            if self.count == 0:
+                return
+            num_lists = num_lists or max(1, int(np.sqrt(self.count)))
+            num_lists = min(num_lists, self.count)
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(self.count, min(self.count, TRAIN_SAMPLE), replace=False))
+            self.centroids = spherical_kmeans(self.vectors[sample].astype(np.float32), num_lists, iterations)
+            np.save(os.path.join(self.index_dir, 'centroids.npy'), self.centroids)
+            for start in range(0, self.count, TRAIN_SAMPLE):
+                end = min(start + TRAIN_SAMPLE, self.count)
+                chunk = self.vectors[start:end].astype(np.float32)
+                self.list_ids[start:end] = np.argmax(chunk @ self.centroids.T, axis=1)
+            self.list_ids.flush()
+            self.meta['trained_count'] = self.count
+            self._write_meta()
+            self._build_lists()
+
+    def search(self, query, k=5, nprobe=8):
+        """Return ``[(row, score, item), ...]`` for the ``k`` most similar stored vectors"""
+        start_time = time.perf_counter()
+        query = _normalize(query).reshape(self.dim)
+        with self._lock:
+            if self.count == 0:
+                return []
+            if self.centroids is None:
+                rows = None
+            else:
+                probe = np.argsort(-(self.centroids @ query))[:nprobe]
+                rows = np.concatenate([np.asarray(self._lists[i], dtype=np.int64) for i in probe])
+            scores, rows = self._score(query, rows)
+            k = min(k, len(rows))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = [(int(rows[i]), float(scores[i]), self.items[rows[i]]) for i in top]
+        self.query_times = (self.query_times + [time.perf_counter() - start_time])[-100:]
+        return results
+
+    def stats(self):
+        return {
+            'vectors': self.count,
+            'dim': self.dim,
+            'lists': 0 if self.centroids is None else len(self.centroids),
+            'trained_count': self.meta.get('trained_count', 0),
+            'model_type': self.meta.get('model_type'),
+            'image_size': self.meta.get('image_size'),
+            'avg_query_ms': 1000.0 * float(np.mean(self.query_times)) if self.query_times else 0.0,
+        }
+
+    def __len__(self):
+        return self.count
+
+    def _score(self, query, rows, chunk_size=65536):
+        if rows is None:
+            scores = np.concatenate([self.vectors[start:min(start + chunk_size, self.count)].astype(np.float32) @ query
+                                     for start in range(0, self.count, chunk_size)])
+            return scores, np.arange(self.count)
+        rows = np.sort(rows)
+        return self.vectors[rows].astype(np.float32) @ query, rows
+
+    def _open_storage(self, capacity):
+        """(Re)map the vector and list-id files with room for ``capacity`` vectors"""
+        for name, dtype, width in (('vectors.f16', np.float16, self.dim), ('lists.i32', np.int32, 1)):
+            path = os.path.join(self.index_dir, name)
+            size = capacity * width * np.dtype(dtype).itemsize
+            with open(path, 'ab') as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        self.vectors = np.memmap(os.path.join(self.index_dir, 'vectors.f16'), dtype=np.float16, mode='r+',
+                                 shape=(capacity, self.dim))
+        self.list_ids = np.memmap(os.path.join(self.index_dir, 'lists.i32'), dtype=np.int32, mode='r+',
+                                  shape=(capacity,))
+        self.capacity = capacity
+        self.meta['capacity'] = capacity
+
+    def _read_items(self):
+        path = os.path.join(self.index_dir, 'items.jsonl')
+        items = []
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                while len(items) < self.count:
+                    line = f.readline()
+                    if not line:
+                        break
+                    items.append(json.loads(line))
+                # Drop metadata written after the last committed count (interrupted insert)
+                f.truncate(f.tell())
+        if len(items) != self.count:
+            raise ValueError(f"{path} has {len(items)} entries, expected {self.count}")
+        return items
+
+    def _build_lists(self):
+        self._lists = [[] for _ in range(0 if self.centroids is None else len(self.centroids))]
+        if self.centroids is None:
+            return
+        list_ids = np.asarray(self.list_ids[:self.count])
+        for list_id in range(len(self.centroids)):
+            self._lists[list_id] = np.flatnonzero(list_ids == list_id).tolist()
+
+    def _write_meta(self):
+        self.meta['count'] = self.count
+        path = os.path.join(self.index_dir, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+def build_index(index_dir, items, embed_batch, load_image, batch_size=32, metadata=None, train=True):
+    """
+    Embed ``items`` (``(path, label)`` pairs) into the index at ``index_dir``, skipping paths that are
+    already indexed. ``load_image(path)`` returns a model input tensor and ``embed_batch(tensors)`` a
+    ``(B, dim)`` array. Commits after every batch, so an interrupted run can simply be restarted.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = VectorIndex(index_dir) if os.path.exists(os.path.join(index_dir, 'meta.json')) else None
+    done = {item['path'] for item in index.items} if index is not None else set()
+    todo = [(path, label) for path, label in items if path not in done]
+    print(f"✓ {len(done)} images already indexed, {len(todo)} to go")
+
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    start_time = time.perf_counter()
+    done_count = 0
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        def load_batch(batch):
+            return list(pool.map(lambda item: load_image(item[0]), batch))
+
+        # Decode the next batch while the current one is being embedded
+        loader = ThreadPoolExecutor(max_workers=1)
+        pending = loader.submit(load_batch, batches[0]) if batches else None
+        for batch_index, batch in enumerate(batches):
+            tensors = pending.result()
+            if batch_index + 1 < len(batches):
+                pending = loader.submit(load_batch, batches[batch_index + 1])
+            vectors = np.asarray(embed_batch(tensors), dtype=np.float32)
+            if index is None:
+                index = VectorIndex(index_dir, dim=vectors.shape[1], metadata=metadata)
+            index.add(vectors, [{'path': path, 'label': label} for path, label in batch])
+            done_count += len(batch)
+            rate = done_count / (time.perf_counter() - start_time)
+            print(f"  {done_count}/{len(todo)} images ({rate:.1f} img/s)")
+        loader.shutdown()
+
+    if index is not None and train and len(index) >= MIN_TRAIN_VECTORS and \
+            len(index) >= 2 * index.meta.get('trained_count', 0):
+        index.train()
+        print(f"✓ Trained {len(index.centroids)} IVF lists on {len(index)} vectors")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embed an image archive into a MedViT vector index')
+    parser.add_argument('--images', required=True, help='image folder, optionally one sub-folder per label')
+    parser.add_argument('--index-dir', default=os.path.join('checkpoints', 'vector_index'))
+    parser.add_argument('--model-type', default='MedViT-Large')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--no-train', action='store_true', help='skip (re)training the IVF lists')
+    args = parser.parse_args()
+
+    import torch
+
+    from medvit_api import get_model, preprocessor
+    from quantization import list_images
+
+    items = list_images(args.images)
+    if not items:
+        raise SystemExit(f"No images found in {args.images}")
+    model = get_model(args.model_type, 1000)
+
+    def load_image(path):
+        with open(path, 'rb') as f:
+            return preprocessor.load(f.read(), args.image_size)
+
+    def embed_batch(tensors):
+        with torch.no_grad():
+            return model.embed(preprocessor.normalize(tensors)).numpy()
+
+    metadata = {'model_type': args.model_type, 'image_size': args.image_size}
+    index = build_index(args.index_dir, items, embed_batch, load_image, args.batch_size, metadata,
+                        train=not args.no_train)
+    if index is not None:
+        print(f"✓ Index at {args.index_dir}: {index.stats()}")
+
+
+if __name__ == '__main__':
+    main()
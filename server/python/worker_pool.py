@@ -0,0 +1,218 @@
+"""
+Multi-process MedViT inference.
+
+The API process keeps accepting requests while inference runs in N worker processes, each pinned to
+a disjoint set of CPU cores with its own ``torch.set_num_threads``. Models are loaded once in the
+API process, moved to shared memory and handed to the workers, so the weights are not duplicated
+per worker. Requests are dispatched to the worker with the fewest requests in flight.
+
+The pool implements the inference backend interface (``get_runner``), so it sits behind the
+micro-batcher like any other backend. Worker processes are started lazily on first use. A worker
+that dies (crash, OOM kill) fails its pending requests and is respawned with the loaded models.
+"""
+import itertools
+import os
+import threading
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.connection import wait
+
+import torch
+import torch.multiprocessing as mp
+
+
+def _available_cores():
+    """Cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _split_cores(cores, num_workers):
+    """Split ``cores`` into ``num_workers`` disjoint, contiguous sets (needs ``num_workers <= len(cores)``)"""
+    if num_workers > len(cores):
+        raise ValueError(f"Cannot split {len(cores)} cores into {num_workers} disjoint sets")
+    per_worker, extra = divmod(len(cores), num_workers)
+    sets, start = [], 0
+    for i in range(num_workers):
+        end = start + per_worker + (1 if i < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def _worker_main(worker_id, cores, num_threads, requests, results):
+    """Worker process loop: load shared models and run forward passes until told to stop"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+
+    models = {}
+    while True:
+        message = requests.get()
+        kind = message[0]
+        if kind == 'stop':
+            break
+        if kind == 'load':
+            _, key, model = message
+            models[key] = model
+            continue
+
+        _, request_id, key, batch = message
+        try:
+            with torch.no_grad():
+                outputs = models[key](batch)
+            results.put((request_id, worker_id, outputs, None))
+        except Exception as e:
+            results.put((request_id, worker_id, None, f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool(object):
+    """
+    Inference backend that runs eager MedViT models in worker processes.
+
+    :param get_model: model loader of the API process (shared-backbone registry).
+    :param class_labels: dataset -> class labels, used to size the heads.
+    :param num_workers: number of worker processes, at most one per available core.
+    :param threads_per_worker: intra-op threads per worker, defaults to the size of its core set.
+    :param timeout: seconds a request waits for its worker before failing.
+    """
+    name = 'workers'
+
+    def __init__(self, get_model, class_labels, num_workers=2, threads_per_worker=None, timeout=60.0):
+        self.get_model = get_model
+        self.class_labels = class_labels
+        cores = _available_cores()
+        if num_workers > len(cores):
+            print(f"⚠ Warning: {num_workers} worker processes requested but only {len(cores)} cores are "
+                  f"available; starting {len(cores)}")
+            num_workers = len(cores)
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.timeout = timeout
+        self.core_sets = _split_cores(cores, num_workers)
+        self._processes = []
+        self._queues = []
+        self._results = None
+        self._inflight = [0] * num_workers
+        self._futures = {}
+        self._models = {}
+        self.restarts = 0
+        self._stopping = False
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def get_runner(self, model_type, dataset, image_size):
+        key = (model_type, dataset)
+        with self._lock:
+            self._start()
+            if key not in self._models:
+                num_classes = len(self.class_labels.get(dataset, [f"Class {i}" for i in range(10)]))
+                model = self.get_model(model_type, num_classes, dataset=dataset)
+                # Place the weights in shared memory once; workers receive handles, not copies
+                model.backbone.share_memory()
+                model.share_memory()
+                for q in self._queues:
+                    q.put(('load', key, model))
+                self._models[key] = model
+        return lambda batch: self.run(key, batch)
+
+    def run(self, key, batch):
+        """Send a batch to the least busy worker and wait for its logits"""
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            worker_id = min(range(self.num_workers), key=lambda i: self._inflight[i])
+            self._inflight[worker_id] += 1
+            self._futures[request_id] = (future, worker_id)
+            self._queues[worker_id].put(('run', request_id, key, batch))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise TimeoutError(f"Worker {worker_id} did not answer within {self.timeout}s") from None
+
+    def stats(self):
+        return {
+            'workers': self.num_workers,
+            'alive': sum(p.is_alive() for p in self._processes),
+            'core_sets': self.core_sets,
+            'inflight': list(self._inflight),
+            'models_loaded': len(self._models),
+            'restarts': self.restarts,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            self._stopping = True
+        for q in self._queues:
+            q.put(('stop',))
+        for process in self._processes:
+            process.join(timeout=5)
+
+    def _start(self):
+        if self._processes:
+            return
+        self._ctx = mp.get_context('spawn')
+        self._results = self._ctx.Queue()
+        for worker_id in range(self.num_workers):
+            requests, process = self._spawn(worker_id)
+            self._queues.append(requests)
+            self._processes.append(process)
+        threading.Thread(target=self._collect_results, daemon=True, name='medvit-worker-results').start()
+        threading.Thread(target=self._watch_workers, daemon=True, name='medvit-worker-watch').start()
+        print(f"✓ Started {self.num_workers} MedViT worker processes on cores {self.core_sets}")
+
+    def _spawn(self, worker_id):
+        """Start worker ``worker_id`` with a fresh request queue holding every loaded model"""
+        cores = self.core_sets[worker_id]
+        requests = self._ctx.Queue()
+        for key, model in self._models.items():
+            requests.put(('load', key, model))
+        process = self._ctx.Process(target=_worker_main,
+                                    args=(worker_id, cores, self.threads_per_worker or len(cores), requests,
+                                          self._results),
+                                    daemon=True, name=f'medvit-worker-{worker_id}')
+        process.start()
+        return requests, process
+
+    def _watch_workers(self):
+        """Fail the pending requests of a worker that exited and start a replacement"""
+        while True:
+            wait([process.sentinel for process in self._processes], timeout=1.0)
+            with self._lock:
+                if self._stopping:
+                    return
+                for worker_id, process in enumerate(self._processes):
+                    if process.is_alive():
+                        continue
+                    pending = [request_id for request_id, (_, owner) in self._futures.items() if owner == worker_id]
+                    for request_id in pending:
+                        future, _ = self._futures.pop(request_id)
+                        future.set_exception(RuntimeError(
+                            f"Worker {worker_id} exited with code {process.exitcode}"))
+                    print(f"⚠ Warning: MedViT worker {worker_id} exited with code {process.exitcode}; "
+                          f"failed {len(pending)} requests, restarting it")
+                    self._inflight[worker_id] = 0
+                    self._queues[worker_id], self._processes[worker_id] = self._spawn(worker_id)
+                    self.restarts += 1
+
+    def _collect_results(self):
+        while True:
+            try:
+                request_id, worker_id, outputs, error = self._results.get()
+            except Exception as e:
+                # e.g. the tensors of a worker that exited before they were received
+                if self._stopping:
+                    return
+                print(f"⚠ Warning: Could not receive a worker result: {type(e).__name__}: {e}")
+                continue
+            with self._lock:
+                entry = self._futures.pop(request_id, None)
+                if entry is None:
+                    # Already failed when its worker was restarted
+                    continue
+                self._inflight[worker_id] -= 1
+            future = entry[0]
+            if error is not None:
+                future.set_exception(RuntimeError(f"Worker {worker_id} failed: {error}"))
+            else:
+                future.set_result(outputs)
@@ -8,13 +8,14 @@ import websockets
 import json
 import cv2
 import numpy as np
-import base64
 import time
 from typing import Dict, List, Optional, Tuple
 import threading
 from collections import deque
 import logging
 
+from frame_protocol import MSG_CLIENT_FRAME, PROTOCOL_VERSION, decode_frame, encode_frame
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -107,6 +108,7 @@ class SimpleExerciseWebSocketServer:
         self.port = port
         self.clients = set()
         self.exercise_counters = {}  # Per-client counters
+        self.exercise_types = {}  # Per-client exercise, set by start_session
         
         # Available exercises
         self.exercises = {
@@ -121,6 +123,7 @@ class SimpleExerciseWebSocketServer:
         self.clients.add(websocket)
         client_id = id(websocket)
         self.exercise_counters[client_id] = SimpleExerciseCounter()
+        self.exercise_types[client_id] = 'squats'
         logger.info(f"Client {client_id} connected")
     
     async def unregister_client(self, websocket):
@@ -129,6 +132,7 @@ class SimpleExerciseWebSocketServer:
         client_id = id(websocket)
         if client_id in self.exercise_counters:
             del self.exercise_counters[client_id]
+        self.exercise_types.pop(client_id, None)
         logger.info(f"Client {client_id} disconnected")
     
     async def handle_client(self, websocket, path):
@@ -146,8 +150,14 @@ class SimpleExerciseWebSocketServer:
             await self.unregister_client(websocket)
     
     async def process_message(self, websocket, message):
-        """Process incoming message from client"""
+        """Process incoming message from client (binary frames, JSON control messages)"""
         try:
+            if isinstance(message, bytes):
+                frame_message = decode_frame(message)
+                if frame_message.type == MSG_CLIENT_FRAME and frame_message.image:
+                    await self.process_frame(websocket, frame_message)
+                return
+
             data = json.loads(message)
             message_type = data.get('type')
             
@@ -157,9 +167,6 @@ class SimpleExerciseWebSocketServer:
             elif message_type == 'start_session':
                 await self.start_session(websocket, data)
             
-            elif message_type == 'process_frame':
-                await self.process_frame(websocket, data)
-            
             elif message_type == 'reset_counter':
                 await self.reset_counter(websocket)
             
@@ -171,6 +178,11 @@ class SimpleExerciseWebSocketServer:
                 'type': 'error',
                 'message': 'Invalid JSON format'
             }))
+        except ValueError as e:
+            await websocket.send(json.dumps({
+                'type': 'error',
+                'message': f'Invalid frame message: {e}'
+            }))
         except Exception as e:
             logger.error(f"Message processing error: {e}")
             await websocket.send(json.dumps({
@@ -192,33 +204,25 @@ class SimpleExerciseWebSocketServer:
         
         if client_id in self.exercise_counters:
             self.exercise_counters[client_id].reset()
+            self.exercise_types[client_id] = exercise_type
         
         await websocket.send(json.dumps({
             'type': 'session_started',
             'exercise_type': exercise_type,
-            'message': f'Started {exercise_type} session'
+            'message': f'Started {exercise_type} session',
+            'protocol': PROTOCOL_VERSION
         }))
     
-    async def process_frame(self, websocket, data):
-        """Process video frame for exercise detection"""
+    async def process_frame(self, websocket, frame_message):
+        """Process a binary video frame for exercise detection"""
         client_id = id(websocket)
         
         if client_id not in self.exercise_counters:
             return
         
         try:
-            # Decode frame from base64
-            frame_data = data.get('frame', '')
-            if not frame_data:
-                return
-            
-            # Remove data URL prefix if present
-            if frame_data.startswith('data:image'):
-                frame_data = frame_data.split(',')[1]
-            
-            # Decode image
-            img_bytes = base64.b64decode(frame_data)
-            nparr = np.frombuffer(img_bytes, np.uint8)
+            # Decode the raw JPEG payload
+            nparr = np.frombuffer(frame_message.image, np.uint8)
             frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
             
             if frame is None:
@@ -232,7 +236,7 @@ class SimpleExerciseWebSocketServer:
                 new_height = int(height * scale)
                 frame = cv2.resize(frame, (new_width, new_height))
             
-            exercise_type = data.get('exercise_type', 'squats')
+            exercise_type = self.exercise_types.get(client_id, 'squats')
             counter = self.exercise_counters[client_id]
             
             # Count exercise using motion detection
@@ -243,23 +247,16 @@ class SimpleExerciseWebSocketServer:
             cv2.putText(frame, f"Reps: {reps}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
             cv2.putText(frame, f"Stage: {stage}", (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             
-            # Encode processed frame
+            # Reply with a binary frame message: header + processed JPEG
             _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            processed_frame_b64 = base64.b64encode(buffer).decode('utf-8')
-            
-            # Send response
-            response = {
-                'type': 'frame_processed',
-                'reps': reps,
-                'stage': stage,
-                'angle': round(angle, 1),
-                'pose_detected': True,  # Always true for motion detection
-                'exercise_type': exercise_type,
-                'frame': f'data:image/jpeg;base64,{processed_frame_b64}',
-                'timestamp': time.time()
-            }
-            
-            await websocket.send(json.dumps(response))
+            await websocket.send(encode_frame(
+                buffer,
+                frame_id=frame_message.frame_id,
+                reps=reps,
+                stage=stage,
+                angle=angle,
+                pose_detected=True  # Always true for motion detection
+            ))
             
         except Exception as e:
             logger.error(f"Frame processing error: {e}")
@@ -8,7 +8,6 @@ import mediapipe as mp
 import numpy as np
 import asyncio
 import json
-import base64
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
@@ -19,6 +18,9 @@ from datetime import datetime
 from collections import deque
 import logging
 
+from frame_pipeline import acquire_camera, active_camera, pose_executor, release_camera, stream_frames
+from frame_protocol import PROTOCOL_VERSION, encode_frame, encode_landmarks
+
 # Minimal logging for performance
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -158,11 +160,13 @@ class UltraFastDetector:
             return False, self.last_angle, "error"
 
 class UltraFastSession:
-    def __init__(self, session_id: str, exercise_type: str):
+    def __init__(self, session_id: str, exercise_type: str, mode: str = "frames"):
         self.session_id = session_id
+        # "landmarks": send only pose landmarks + rep state, no annotated JPEG
+        self.landmarks_only = mode == "landmarks"
         self.detector = UltraFastDetector(exercise_type)
         self.is_active = False
-        self.cap = None
+        self.capture = None
         self.pose = None
         self.websocket = None
         self.frame_count = 0
@@ -174,43 +178,39 @@ class UltraFastSession:
         self.width = 320      # Even smaller for speed
         self.height = 240
         self.send_interval = 1.0 / self.target_fps
-        self.last_send = 0
         
     async def start_session(self, websocket: WebSocket):
         """Ultra-fast session start"""
         self.websocket = websocket
         self.is_active = True
         
+        loop = asyncio.get_running_loop()
         try:
-            # Ultra-fast camera setup
-            self.cap = cv2.VideoCapture(0)
-            if not self.cap.isOpened():
+            # Shared camera capture thread, minimal settings for maximum speed
+            self.capture = await loop.run_in_executor(None, acquire_camera, 0, self.width, self.height, 30)
+            if not self.capture.is_opened():
                 await websocket.send_text(json.dumps({
                     "type": "error",
                     "message": "Camera unavailable"
                 }))
                 return False
             
-            # Minimal camera settings for maximum speed
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
-            self.cap.set(cv2.CAP_PROP_FPS, 30)
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            
             # Ultra-fast MediaPipe setup
-            self.pose = mp_pose.Pose(
+            self.pose = await loop.run_in_executor(pose_executor, lambda: mp_pose.Pose(
                 min_detection_confidence=0.5,
                 min_tracking_confidence=0.3,
                 model_complexity=0,
                 smooth_landmarks=False,  # Disabled for speed
                 enable_segmentation=False,
                 smooth_segmentation=False
-            )
+            ))
             
             await websocket.send_text(json.dumps({
                 "type": "session_started",
                 "exercise_type": self.detector.exercise_type,
-                "session_id": self.session_id
+                "session_id": self.session_id,
+                "protocol": PROTOCOL_VERSION,
+                "mode": "landmarks" if self.landmarks_only else "frames"
             }))
             
             # Start ultra-fast loop
@@ -223,96 +223,77 @@ class UltraFastSession:
             }))
     
     async def ultra_fast_loop(self):
-        """Ultra-optimized detection loop - maximum speed"""
+        """Ultra-optimized detection pipeline - capture and inference never block the event loop"""
         try:
-            while self.is_active and self.cap and self.cap.isOpened():
-                ret, frame = self.cap.read()
-                if not ret:
-                    continue
-                
-                current_time = time.time()
-                
-                # Rate limiting for consistent FPS
-                if current_time - self.last_send < self.send_interval:
-                    continue
-                
-                self.frame_count += 1
-                
-                # Ultra-fast processing
-                frame = cv2.flip(frame, 1)
-                
-                # Convert to RGB (minimal processing)
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                rgb_frame.flags.writeable = False
-                
-                # MediaPipe processing
-                results = self.pose.process(rgb_frame)
-                
-                # Convert back
-                rgb_frame.flags.writeable = True
-                bgr_frame = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2BGR)
-                
-                # Prepare minimal data
-                data = {
-                    "type": "frame_data",
-                    "timestamp": current_time,
-                    "frame_count": self.frame_count,
-                    "reps": self.detector.count,
-                    "stage": self.detector.stage or "detecting",
-                    "angle": int(self.detector.last_angle),
-                    "posture_state": self.detector.posture_state,
-                    "exercise_type": self.detector.exercise_type,
-                    "pose_detected": False,
-                    "rep_completed": False
-                }
-                
-                if results.pose_landmarks:
-                    data["pose_detected"] = True
-                    
-                    # Ultra-fast detection
-                    rep_completed, angle, status = self.detector.detect(results.pose_landmarks.landmark)
-                    
-                    data.update({
-                        "reps": self.detector.count,
-                        "angle": int(angle),
-                        "stage": status,
-                        "rep_completed": rep_completed
-                    })
-                    
-                    # Minimal landmark drawing (every 3rd frame only)
-                    if self.frame_count % 3 == 0:
-                        mp_drawing.draw_landmarks(
-                            bgr_frame, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                            mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=1, circle_radius=1),
-                            mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=1)
-                        )
-                
-                # Ultra-fast encoding
-                encode_params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
-                _, buffer = cv2.imencode('.jpg', bgr_frame, encode_params)
-                frame_b64 = base64.b64encode(buffer).decode('utf-8')
-                data["frame"] = frame_b64
-                
-                # Send immediately
-                try:
-                    await self.websocket.send_text(json.dumps(data))
-                    self.last_send = current_time
-                except:
-                    break
-                
-                # Minimal delay
-                await asyncio.sleep(0.001)  # 1ms only
-                
+            await stream_frames(self.capture, self.process_frame, self.websocket.send_bytes,
+                                lambda: self.is_active, interval=self.send_interval, frame_skip=self.frame_skip)
         except Exception as e:
             logger.error(f"Loop error: {e}")
         finally:
             self.cleanup()
+
+    def process_frame(self, frame):
+        """Runs in the pose executor"""
+        self.frame_count += 1
+
+        # Ultra-fast processing
+        frame = cv2.flip(frame, 1)
+
+        # Convert to RGB (minimal processing)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        rgb_frame.flags.writeable = False
+
+        # MediaPipe processing
+        results = self.pose.process(rgb_frame)
+
+        rep_completed = False
+        angle = self.detector.last_angle
+        stage = self.detector.stage
+
+        if results.pose_landmarks:
+            # Ultra-fast detection
+            rep_completed, angle, stage = self.detector.detect(results.pose_landmarks.landmark)
+
+        state = dict(
+            frame_id=self.frame_count,
+            reps=self.detector.count,
+            stage=stage,
+            angle=angle,
+            posture_state=self.detector.posture_state,
+            pose_detected=results.pose_landmarks is not None,
+            rep_completed=rep_completed
+        )
+
+        # Landmarks-only sessions: the client draws the skeleton over its own video, so skip the
+        # conversion back to BGR, the drawing and the JPEG encoding
+        if self.landmarks_only:
+            return encode_landmarks(results.pose_landmarks.landmark if results.pose_landmarks else None, **state)
+
+        # Convert back
+        rgb_frame.flags.writeable = True
+        bgr_frame = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2BGR)
+
+        if results.pose_landmarks:
+            # Minimal landmark drawing (every 3rd frame only)
+            if self.frame_count % 3 == 0:
+                mp_drawing.draw_landmarks(
+                    bgr_frame, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
+                    mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=1, circle_radius=1),
+                    mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=1)
+                )
+
+        # Ultra-fast encoding, sent as raw JPEG behind the binary header
+        _, buffer = cv2.imencode('.jpg', bgr_frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return encode_frame(buffer, **state)
     
     def cleanup(self):
-        if self.cap:
-            self.cap.release()
+        self.is_active = False
+        if self.capture:
+            release_camera(self.capture)
+            self.capture = None
         if self.pose:
             self.pose.close()
+            self.pose = None
 
 # Minimal API routes
 @app.get("/")
@@ -333,7 +314,9 @@ async def get_exercises():
     }
 
 @app.get("/camera/test")
-async def test_camera():
+def test_camera():
+    if active_camera(0):
+        return {"status": "success", "message": "Camera working (in use)"}
     try:
         cap = cv2.VideoCapture(0)
         if cap.isOpened():
@@ -346,11 +329,11 @@ async def test_camera():
 
 # Ultra-fast WebSocket
 @app.websocket("/ws/exercise/{exercise_type}")
-async def websocket_endpoint(websocket: WebSocket, exercise_type: str):
+async def websocket_endpoint(websocket: WebSocket, exercise_type: str, mode: str = "frames"):
     await websocket.accept()
     
     session_id = f"ultra_{int(time.time())}"
-    session = UltraFastSession(session_id, exercise_type)
+    session = UltraFastSession(session_id, exercise_type, mode)
     active_sessions[session_id] = session
     
     try:
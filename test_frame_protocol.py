@@ -0,0 +1,83 @@
+"""
+Tests for the binary exercise frame protocol (server/frame_protocol.py). The hex fixtures are also
+pinned in client/lib/frameProtocol.spec.ts, so the Python and TypeScript sides cannot drift apart.
+
+Run directly or with pytest:
+    python test_frame_protocol.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'server'))
+
+from frame_protocol import (HEADER, LANDMARK_COUNT, LANDMARK_SCALE, MSG_CLIENT_FRAME, MSG_FRAME, MSG_LANDMARKS,
+                            decode_frame, encode_frame, encode_landmarks)
+
+SERVER_FRAME_HEX = "01010702020700000000001040fc54d9410c000000bb42ffd84a504547"
+CLIENT_FRAME_HEX = "010204000005000000000000000000f03f0000000000004a5047"
+LANDMARKS_HEADER_HEX = "01030901010403020100006040fc54d941030000003542"
+
+
+class Landmark(object):
+    def __init__(self, i):
+        self.x = i / 100
+        self.y = -i / 200
+        self.z = 0.5 - i / 33
+        self.visibility = 1.0 if i % 2 else 0.25
+
+
+def test_header_layout():
+    assert HEADER.size == 23
+
+
+def test_frame_round_trip():
+    message = encode_frame(image=b'\xff\xd8JPEG', frame_id=7, reps=12, stage='down', angle=93.5,
+                           posture_state='bad', pose_detected=True, rep_completed=True, timestamp=1700000000.25)
+    assert message.hex() == SERVER_FRAME_HEX
+    frame = decode_frame(message)
+    assert frame.type == MSG_FRAME
+    assert (frame.frame_id, frame.timestamp, frame.reps, frame.angle) == (7, 1700000000.25, 12, 93.5)
+    assert (frame.stage, frame.posture_state) == ('down', 'bad')
+    assert frame.pose_detected and frame.rep_completed
+    assert frame.image == b'\xff\xd8JPEG' and frame.landmarks is None
+
+
+def test_client_frame():
+    message = encode_frame(image=b'JPG', frame_id=5, timestamp=1.0, message_type=MSG_CLIENT_FRAME)
+    assert message.hex() == CLIENT_FRAME_HEX
+    frame = decode_frame(message)
+    assert (frame.type, frame.frame_id, frame.image) == (MSG_CLIENT_FRAME, 5, b'JPG')
+
+
+def test_landmarks_round_trip():
+    landmarks = [Landmark(i) for i in range(LANDMARK_COUNT)]
+    message = encode_landmarks(landmarks, frame_id=0x01020304, reps=3, stage='up', angle=45.25,
+                               posture_state='ok', pose_detected=True, timestamp=1700000001.5)
+    assert len(message) == HEADER.size + LANDMARK_COUNT * 8
+    assert message[:HEADER.size].hex() == LANDMARKS_HEADER_HEX
+    frame = decode_frame(message)
+    assert frame.type == MSG_LANDMARKS and frame.image is None
+    assert (frame.frame_id, frame.reps, frame.stage, frame.posture_state) == (0x01020304, 3, 'up', 'ok')
+    for landmark, (x, y, z, visibility) in zip(landmarks, frame.landmarks):
+        for expected, value in ((landmark.x, x), (landmark.y, y), (landmark.z, z), (landmark.visibility, visibility)):
+            assert abs(expected - value) <= 0.5 / LANDMARK_SCALE
+
+    # No pose: header only
+    assert len(encode_landmarks(None, pose_detected=False)) == HEADER.size
+
+
+def test_rejects_bad_messages():
+    for message in (bytes(HEADER.size - 1), b'\x02' + bytes.fromhex(SERVER_FRAME_HEX)[1:],
+                    bytes.fromhex(LANDMARKS_HEADER_HEX) + bytes(10)):
+        try:
+            decode_frame(message)
+        except ValueError:
+            continue
+        raise AssertionError(f"decode_frame accepted {message.hex()}")
+
+
+if __name__ == '__main__':
+    for test in (test_header_layout, test_frame_round_trip, test_client_frame, test_landmarks_round_trip,
+                 test_rejects_bad_messages):
+        test()
+        print(f"✓ {test.__name__}")
@@ -0,0 +1,79 @@
+"""
+Regression test for MedViT BatchNorm folding: folded and unfolded MedViT-Small must give the same
+logits (merge_bn for ConvBNReLU / PatchEmbed / MHCA / LocalityFeedForward / ECB / LTB, the
+shortcut_scale of the pre-norm fold, and the final norm folded into a new dataset head).
+
+Run directly or with pytest:
+    python test_merge_bn.py
+"""
+import copy
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'server', 'python'))
+
+import torch
+from torch import nn
+
+from MedViT import MedViT_small
+from utils import merge_pre_bn
+
+IMAGE_SIZE = 64
+RTOL = 1e-4
+
+
+def _relative_diff(output, reference):
+    return ((output - reference).abs().max() / reference.abs().max().clamp_min(1e-6)).item()
+
+
+def _model(use_sdpa):
+    """MedViT-Small with non-trivial BatchNorm statistics, so folding changes every weight"""
+    torch.manual_seed(0)
+    model = MedViT_small(num_classes=1000, use_sdpa=use_sdpa)
+    for module in model.modules():
+        if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d)):
+            module.running_mean.uniform_(-0.2, 0.2)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model.eval()
+
+
+@torch.no_grad()
+def _check_fold(use_sdpa):
+    model = _model(use_sdpa)
+    x = torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE)
+    reference = model(x)
+    features = model.forward_features(x)
+    head = nn.Linear(features.shape[1], 9)
+    dataset_reference = head(features)
+
+    merged = copy.deepcopy(model)
+    merged.merge_bn()
+    assert merged.is_bn_merged
+    assert any(getattr(m, 'shortcut_scale', None) is not None for m in merged.modules()), "no pre-norm fold"
+    diff = _relative_diff(merged(x), reference)
+    assert diff < RTOL, f"merge_bn changed the logits (relative diff {diff:.2e})"
+
+    # A dataset head attached after folding gets the final norm through head_norm
+    merge_pre_bn(head, merged.head_norm)
+    diff = _relative_diff(head(merged.forward_features(x)), dataset_reference)
+    assert diff < RTOL, f"head_norm folding changed the dataset logits (relative diff {diff:.2e})"
+
+    inference = merged.to_inference()
+    diff = _relative_diff(inference(x), reference)
+    assert diff < RTOL, f"to_inference changed the logits (relative diff {diff:.2e})"
+
+
+def test_merge_bn():
+    _check_fold(use_sdpa=False)
+
+
+def test_merge_bn_sdpa():
+    _check_fold(use_sdpa=True)
+
+
+if __name__ == '__main__':
+    for test in (test_merge_bn, test_merge_bn_sdpa):
+        test()
+        print(f"✓ {test.__name__}")